@@ -1,29 +1,37 @@
 import os
-from flask import Flask, render_template, redirect, url_for, request, flash, jsonify, session
+from flask import Flask, render_template, redirect, url_for, request, flash, jsonify, session, Response, stream_with_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 import sqlite3
 import json
-from datetime import datetime, timedelta
+from datetime import datetime
 import pandas as pd
-import yfinance as yf
 from dotenv import load_dotenv
 import time
-import groq
-import numpy as np
-import pickle
 import uuid
 import logging
-import threading
-import concurrent.futures
 from functools import lru_cache
 
 # Import services
-from services.stock_service import get_stock_data, get_stock_info, search_stocks, get_market_indices, get_watchlist_prices, get_portfolio_data
-from services.yahoo_scraper import get_yahoo_market_stocks
+from services.stock_service import get_stock_data, get_stock_info, search_stocks, get_watchlist_prices, get_portfolio_data
 from services.ai_service import analyze_stock_movement, chat_with_ai
-from services.strategy_service import backtest_strategy, get_predefined_strategies
+from services.strategy_service import backtest_strategy, sweep_strategy, get_predefined_strategies
+from services.batch_backtest import batch_backtest
+from services.portfolio_backtest import backtest_portfolio
+from services.prediction_service import predict_stock, FORECAST_HORIZON, MAX_HORIZON
+from services.batch_predict import predict_many
+from services.jobs import jobs, JobLimitError
+from services.model_registry import registry as model_registry
+from services import universe_model
+from services.llm_gateway import gateway as llm_gateway
+from services.saved_strategies import evaluate as evaluate_saved_strategy, refresh_saved_strategy, start_roller
 from services.scraper_service import get_market_news, get_social_sentiment
+from services.quote_service import get_quotes
+from services.symbol_resolver import canonical_symbol, normalize
+from services.search_index import get_search_index
+from services.singleflight import get_stats as get_single_flight_stats
+from services.cache import cache
+from services.market_snapshot import get_market_snapshot, start_refresher, refresher as market_refresher
 
 # Load environment variables
 load_dotenv()
@@ -74,94 +82,6 @@ def load_user(user_id):
         return User(user['id'], user['username'], user['email'])
     return None
 
-# Create a simple in-memory cache with expiration
-stock_data_cache = {}
-cache_lock = threading.Lock()
-
-def cache_with_timeout(seconds=300):
-    """Cache decorator with timeout"""
-    def decorator(func):
-        def wrapper(*args, **kwargs):
-            cache_key = f"{func.__name__}:{str(args)}:{str(kwargs)}"
-            
-            with cache_lock:
-                if cache_key in stock_data_cache:
-                    cached_data, timestamp = stock_data_cache[cache_key]
-                    if datetime.now().timestamp() - timestamp < seconds:
-                        return cached_data
-            
-            # If not in cache or expired, call the function
-            result = func(*args, **kwargs)
-            
-            # Update cache
-            with cache_lock:
-                stock_data_cache[cache_key] = (result, datetime.now().timestamp())
-            
-            return result
-        return wrapper
-    return decorator
-
-# Apply cache to expensive operations
-@cache_with_timeout(seconds=300)  # Cache for 5 minutes
-def cached_get_yahoo_market_stocks(category):
-    return get_yahoo_market_stocks(category)
-
-# Thread worker to load data for dashboard
-def load_dashboard_data():
-    try:
-        # Get market indices data
-        indices = get_market_indices()
-        
-        # Get various categories of stock data in parallel
-        with concurrent.futures.ThreadPoolExecutor(max_workers=6) as executor:
-            # Submit all tasks
-            most_active_future = executor.submit(cached_get_yahoo_market_stocks, 'most-active')
-            trending_future = executor.submit(cached_get_yahoo_market_stocks, 'trending')
-            gainers_future = executor.submit(cached_get_yahoo_market_stocks, 'gainers')
-            losers_future = executor.submit(cached_get_yahoo_market_stocks, 'losers')
-            week52_gainers_future = executor.submit(cached_get_yahoo_market_stocks, '52-week-gainers')
-            week52_losers_future = executor.submit(cached_get_yahoo_market_stocks, '52-week-losers')
-            
-            # Get results as they complete
-            most_active = most_active_future.result()
-            trending = trending_future.result()
-            gainers = gainers_future.result()
-            losers = losers_future.result()
-            week52_gainers = week52_gainers_future.result()
-            week52_losers = week52_losers_future.result()
-        
-        # Process stocks to ensure numeric values are of correct type
-        for stock_list in [most_active, trending, gainers, losers, week52_gainers, week52_losers]:
-            if isinstance(stock_list, list):
-                for stock in stock_list:
-                    try:
-                        # Convert price to float
-                        if 'price' in stock:
-                            stock['price'] = float(stock['price']) if stock['price'] not in ('N/A', '') else 0.0
-                        
-                        # Convert change to float
-                        if 'change' in stock:
-                            stock['change'] = float(stock['change']) if stock['change'] not in ('N/A', '') else 0.0
-                        
-                        # Convert change_percent to float
-                        if 'change_percent' in stock:
-                            stock['change_percent'] = float(stock['change_percent']) if stock['change_percent'] not in ('N/A', '') else 0.0
-                    except (ValueError, TypeError) as e:
-                        app.logger.error(f"Error converting stock data values: {str(e)}")
-        
-        return {
-            'indices': indices,
-            'most_active': most_active,
-            'trending': trending,
-            'gainers': gainers,
-            'losers': losers,
-            'week52_gainers': week52_gainers,
-            'week52_losers': week52_losers
-        }
-    except Exception as e:
-        app.logger.error(f"Error loading dashboard data: {str(e)}")
-        return {}
-
 # Routes
 @app.route('/')
 def index():
@@ -256,7 +176,7 @@ def dashboard():
         
         # Get real-time data for all symbols at once
         try:
-            watchlist_prices = get_watchlist_prices(symbols)
+            watchlist_prices = get_watchlist_prices(symbols, names={item['symbol']: item['name'] for item in watchlist_items})
             
             # Combine database and real-time data
             for item in watchlist_items:
@@ -307,50 +227,8 @@ def dashboard():
         app.logger.error(f"Error fetching news: {str(e)}")
         news = []
     
-    # Use cached/preloaded market data
-    try:
-        # Generate a unique key for this user's session
-        cache_key = f"dashboard_data:{current_user.id}"
-        
-        with cache_lock:
-            if cache_key in stock_data_cache:
-                market_data, timestamp = stock_data_cache[cache_key]
-                # Use cached data if less than 5 minutes old
-                if datetime.now().timestamp() - timestamp < 300:
-                    # Add a small delay for the loading animation
-                    time.sleep(0.5)
-                    return render_template(
-                        'dashboard.html',
-                        indices=market_data['indices'],
-                        watchlist=watchlist_data,
-                        news=news,
-                        most_active=market_data['most_active'],
-                        trending=market_data['trending'],
-                        gainers=market_data['gainers'],
-                        losers=market_data['losers'],
-                        week52_gainers=market_data['week52_gainers'],
-                        week52_losers=market_data['week52_losers']
-                    )
-        
-        # If no cached data or data is stale, load fresh data
-        market_data = load_dashboard_data()
-        
-        # Cache the market data
-        with cache_lock:
-            stock_data_cache[cache_key] = (market_data, datetime.now().timestamp())
-        
-    except Exception as e:
-        app.logger.error(f"Error with dashboard cache: {str(e)}")
-        # Fallback to direct loading
-        market_data = {
-            'indices': get_market_indices(),
-            'most_active': cached_get_yahoo_market_stocks('most-active'),
-            'trending': cached_get_yahoo_market_stocks('trending'),
-            'gainers': cached_get_yahoo_market_stocks('gainers'),
-            'losers': cached_get_yahoo_market_stocks('losers'),
-            'week52_gainers': cached_get_yahoo_market_stocks('52-week-gainers'),
-            'week52_losers': cached_get_yahoo_market_stocks('52-week-losers')
-        }
+    # Market data comes from the shared snapshot kept fresh in the background
+    market_data = get_market_snapshot()
     
     # Add a small delay to ensure the loading animation is visible
     time.sleep(0.5)
@@ -364,13 +242,28 @@ def dashboard():
         trending=market_data['trending'],
         gainers=market_data['gainers'],
         losers=market_data['losers'],
-        week52_gainers=market_data.get('week52_gainers', []),
-        week52_losers=market_data.get('week52_losers', [])
+        week52_gainers=market_data['week52_gainers'],
+        week52_losers=market_data['week52_losers'],
+        market_updated_at=market_data['updated_at']
     )
 
+@app.route('/api/cache/stats')
+@login_required
+def api_cache_stats():
+    stats = cache.stats()
+    stats['single_flight'] = get_single_flight_stats()
+    stats['market_snapshot'] = market_refresher.stats()
+    stats['jobs'] = jobs.stats()
+    stats['models'] = model_registry.stats()
+    stats['universe_model'] = universe_model.info()
+    stats['llm'] = llm_gateway.stats()
+    return jsonify(stats)
+
 @app.route('/stock/<symbol>')
 @login_required
 def stock_details(symbol):
+    symbol = canonical_symbol(symbol)
+    
     # Get stock information
     stock_info = get_stock_info(symbol)
     
@@ -399,34 +292,19 @@ def api_stock_info():
     if not symbol:
         return jsonify({'error': 'Symbol is required'})
     
-    # Try to get stock info
+    # Map the input to its listed symbol (e.g. adds .NS for Indian stocks)
+    symbol = canonical_symbol(symbol)
+    
     try:
-        info = get_stock_info(symbol)
-        
-        # Check if we got an error back
-        if 'error' in info and info['error'] != symbol:
-            # Try with .NS suffix for Indian stocks if not already present
-            if not symbol.endswith('.NS') and not symbol.endswith('.ns'):
-                try:
-                    indian_symbol = f"{symbol}.NS"
-                    print(f"Trying with Indian stock suffix: {indian_symbol}")
-                    info = get_stock_info(indian_symbol)
-                    if 'error' not in info or info['error'] == indian_symbol:
-                        symbol = indian_symbol  # Update symbol for day change calculation
-                except Exception as e:
-                    print(f"Error getting Indian stock info: {e}")
+        # Copy the cached entry so the day change is not written into it
+        info = dict(get_stock_info(symbol))
         
         # Add day change and percentage if available
         try:
-            ticker = yf.Ticker(symbol)
-            hist = ticker.history(period='2d')
-            if len(hist) >= 2:
-                prev_close = hist['Close'].iloc[-2]
-                current = hist['Close'].iloc[-1]
-                day_change = current - prev_close
-                day_change_percent = (day_change / prev_close) * 100
-                info['day_change'] = day_change
-                info['day_change_percent'] = day_change_percent
+            quote = get_quotes([symbol]).get(symbol)
+            if quote:
+                info['day_change'] = quote['change']
+                info['day_change_percent'] = quote['change_percent']
         except Exception as e:
             print(f"Error calculating day change: {e}")
         
@@ -445,7 +323,7 @@ def api_stock_data():
     period = request.args.get('period', '1y')
     interval = request.args.get('interval', '1d')
     
-    data = get_stock_data(symbol, period, interval)
+    data = get_stock_data(canonical_symbol(symbol), period, interval)
     return jsonify(data)
 
 @app.route('/api/watchlist/add', methods=['POST'])
@@ -455,6 +333,10 @@ def api_add_to_watchlist():
     symbol = data.get('symbol')
     name = data.get('name')
     
+    # Store the listed symbol so watchlist quotes resolve on the first try
+    if symbol:
+        symbol = canonical_symbol(symbol)
+    
     conn = get_db_connection()
     existing = conn.execute('SELECT * FROM watchlist WHERE user_id = ? AND symbol = ?', 
                           (current_user.id, symbol)).fetchone()
@@ -515,6 +397,136 @@ def api_backtest_strategy():
     results = backtest_strategy(symbol, strategy, parameters, start_date, end_date)
     return jsonify(results)
 
+@app.route('/api/backtest/sweep', methods=['POST'])
+@login_required
+def api_backtest_sweep():
+    data = request.json
+    symbol = data.get('symbol')
+    strategy = data.get('strategy')
+    ranges = data.get('ranges', {})
+    start_date = data.get('start_date')
+    end_date = data.get('end_date')
+    sort_by = data.get('sort_by', 'total_return')
+    if not isinstance(ranges, dict):
+        return jsonify({'error': 'ranges must map parameter names to values'}), 400
+    try:
+        top = min(max(int(data.get('top', 5)), 1), 50)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'top must be an integer'}), 400
+
+    results = sweep_strategy(symbol, strategy, ranges, start_date, end_date, sort_by, top)
+    return jsonify(results)
+
+@app.route('/api/backtest/batch', methods=['POST'])
+@login_required
+def api_backtest_batch():
+    data = request.json
+    symbols = data.get('symbols', [])
+    if isinstance(symbols, str):
+        symbols = symbols.split(',')
+
+    try:
+        records = batch_backtest(symbols, data.get('strategy'), data.get('parameters', {}),
+                                 data.get('start_date'), data.get('end_date'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # One JSON object per line: per-symbol results as they finish, then the summary
+    def generate():
+        for record in records:
+            yield json.dumps(record) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/api/backtest/portfolio', methods=['POST'])
+@login_required
+def api_backtest_portfolio():
+    data = request.json
+    source = data.get('source')
+    symbols = data.get('symbols', [])
+    weights = data.get('weights')
+
+    if source in ('portfolio', 'watchlist'):
+        conn = get_db_connection()
+        if source == 'portfolio':
+            # Weight holdings by cost basis
+            rows = conn.execute('SELECT symbol, SUM(shares * avg_price) AS cost FROM portfolio WHERE user_id = ? GROUP BY symbol',
+                                (current_user.id,)).fetchall()
+            weights = {row['symbol']: row['cost'] for row in rows}
+        else:
+            rows = conn.execute('SELECT symbol FROM watchlist WHERE user_id = ?', (current_user.id,)).fetchall()
+        conn.close()
+        symbols = [row['symbol'] for row in rows]
+
+    results = backtest_portfolio(symbols, data.get('strategy'), data.get('parameters', {}),
+                                 data.get('start_date'), data.get('end_date'),
+                                 weights=weights, rebalance=data.get('rebalance', 'monthly'))
+    return jsonify(results)
+
+def _backtest_job(symbol, strategy, parameters, start_date, end_date, progress):
+    progress(0.1, 'Running backtest')
+    return backtest_strategy(symbol, strategy, parameters, start_date, end_date)
+
+# Long-running requests that can run as background jobs, with the request
+# fields passed to each job function
+jobs.register('backtest', _backtest_job)
+jobs.register('predict', predict_stock)
+JOB_FIELDS = {
+    'backtest': ('symbol', 'strategy', 'parameters', 'start_date', 'end_date'),
+    'predict': ('symbol', 'horizon'),
+}
+
+@app.route('/api/jobs', methods=['POST'])
+@login_required
+def api_submit_job():
+    data = request.json or {}
+    job_type = data.get('type')
+    if job_type not in JOB_FIELDS:
+        return jsonify({'error': f'Unknown job type: {job_type}'}), 400
+    params = {name: data.get(name) for name in JOB_FIELDS[job_type]}
+    params['symbol'] = normalize(params['symbol'] or '')
+    if not params['symbol']:
+        return jsonify({'error': 'Invalid stock symbol'}), 400
+    # Canonical values, so equal requests share a job digest
+    if job_type == 'backtest':
+        params['parameters'] = params['parameters'] or {}
+        if not isinstance(params['parameters'], dict):
+            return jsonify({'error': 'parameters must map parameter names to values'}), 400
+    if job_type == 'predict':
+        try:
+            params['horizon'] = FORECAST_HORIZON if params['horizon'] is None else int(params['horizon'])
+        except (TypeError, ValueError):
+            return jsonify({'error': 'horizon must be an integer'}), 400
+        if not 1 <= params['horizon'] <= MAX_HORIZON:
+            return jsonify({'error': f'horizon must be between 1 and {MAX_HORIZON}'}), 400
+
+    try:
+        record, deduplicated = jobs.submit(job_type, params, current_user.id)
+    except JobLimitError as e:
+        return jsonify({'error': str(e)}), 429
+    return jsonify({'job_id': record['id'], 'status': record['status'], 'deduplicated': deduplicated}), 202
+
+def _user_job(job_id):
+    record = jobs.get(job_id)
+    # Jobs are only visible to the users who submitted them
+    return record if record is not None and current_user.id in record['users'] else None
+
+@app.route('/api/jobs/<job_id>')
+@login_required
+def api_job_status(job_id):
+    record = _user_job(job_id)
+    if record is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(record)
+
+@app.route('/api/jobs/<job_id>/events')
+@login_required
+def api_job_events(job_id):
+    if _user_job(job_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(jobs.events(job_id)), mimetype='text/event-stream', headers=headers)
+
 @app.route('/api/strategy/save', methods=['POST'])
 @login_required
 def api_save_strategy():
@@ -527,10 +539,18 @@ def api_save_strategy():
         start_date = data.get('start_date')
         end_date = data.get('end_date')
         metrics = json.dumps(data.get('metrics', {}))
+        state = None
         
         if not name or not symbol or not strategy_type:
             return jsonify({'success': False, 'error': 'Missing required fields'})
         
+        # Store the backtest's terminal state so refreshes only apply new bars
+        evaluation = evaluate_saved_strategy(symbol, strategy_type, data.get('parameters', {}), start_date, end_date)
+        if 'error' not in evaluation:
+            metrics = json.dumps(evaluation['metrics'])
+            end_date = evaluation['end_date']
+            state = json.dumps(evaluation['state'])
+        
         conn = get_db_connection()
         
         # Check if strategy with the same name already exists for this user
@@ -543,9 +563,9 @@ def api_save_strategy():
             conn.execute(
                 '''UPDATE saved_strategies 
                    SET symbol = ?, strategy_type = ?, parameters = ?, 
-                       start_date = ?, end_date = ?, metrics = ?, updated_at = ?
+                       start_date = ?, end_date = ?, metrics = ?, state = ?, updated_at = ?
                    WHERE id = ?''',
-                (symbol, strategy_type, parameters, start_date, end_date, metrics, 
+                (symbol, strategy_type, parameters, start_date, end_date, metrics, state,
                  datetime.now().strftime('%Y-%m-%d %H:%M:%S'), existing['id'])
             )
             conn.commit()
@@ -554,9 +574,9 @@ def api_save_strategy():
         else:
             conn.execute(
                 '''INSERT INTO saved_strategies 
-                   (user_id, name, symbol, strategy_type, parameters, start_date, end_date, metrics, created_at)
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                (current_user.id, name, symbol, strategy_type, parameters, start_date, end_date, metrics,
+                   (user_id, name, symbol, strategy_type, parameters, start_date, end_date, metrics, state, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                (current_user.id, name, symbol, strategy_type, parameters, start_date, end_date, metrics, state,
                  datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
             )
             conn.commit()
@@ -567,9 +587,19 @@ def api_save_strategy():
         print(f"Error saving strategy: {str(e)}")
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/api/strategy/<int:strategy_id>/refresh', methods=['POST'])
+@login_required
+def api_refresh_strategy(strategy_id):
+    result = refresh_saved_strategy(app.config['DATABASE'], strategy_id, current_user.id)
+    if 'error' in result:
+        return jsonify({'success': False, 'error': result['error']})
+    return jsonify({'success': True, 'strategy': result})
+
 @app.route('/stock-analysis/<symbol>')
 @login_required
 def stock_analysis(symbol):
+    symbol = canonical_symbol(symbol)
+    
     # Get stock information
     stock_info = get_stock_info(symbol)
     
@@ -621,392 +651,24 @@ def stock_predictor():
 @login_required
 def api_predict_stock(symbol):
     """API endpoint to predict stock movement and generate explanation using Groq API."""
+    return jsonify(predict_stock(symbol, request.args.get('horizon', type=int)))
+
+@app.route('/api/predict/batch', methods=['POST'])
+@login_required
+def api_predict_batch():
+    """Predict several stocks at once; explanations only for the symbols in 'explain'."""
+    data = request.json or {}
+    symbols = data.get('symbols', [])
+    if data.get('source') == 'watchlist':
+        conn = get_db_connection()
+        rows = conn.execute('SELECT symbol FROM watchlist WHERE user_id = ?', (current_user.id,)).fetchall()
+        conn.close()
+        symbols = [row['symbol'] for row in rows]
+
     try:
-        # Check if it's an Indian stock and add .NS suffix if needed
-        is_indian_stock = False
-        if '.' not in symbol and any(bank in symbol.upper() for bank in ['HDFC', 'ICICI', 'SBI', 'KOTAK', 'AXIS', 'TCS', 'INFY', 'RELIANCE']):
-            original_symbol = symbol
-            symbol = f"{symbol}.NS"
-            is_indian_stock = True
-            print(f"Detected Indian stock. Trying with NS suffix: {symbol}")
-        
-        # Get stock data
-        ticker = yf.Ticker(symbol)
-        hist = ticker.history(period="120d")  # Get more historical data for better prediction
-        
-        if hist.empty and is_indian_stock and '.' not in original_symbol:
-            # Try with .BO suffix (Bombay Stock Exchange) if NS didn't work
-            symbol = f"{original_symbol}.BO"
-            print(f"NS suffix didn't work. Trying with BO suffix: {symbol}")
-            ticker = yf.Ticker(symbol)
-            hist = ticker.history(period="120d")
-        
-        if hist.empty:
-            return jsonify({
-                "error": f"No data available for {symbol}. For Indian stocks, try adding .NS or .BO suffix."
-            })
-        
-        # Prepare historical data for visualization
-        dates = hist.index.strftime('%Y-%m-%d').tolist()
-        historical_prices = hist['Close'].tolist()
-        
-        # Calculate technical indicators
-        hist['SMA20'] = hist['Close'].rolling(window=20).mean()
-        hist['SMA50'] = hist['Close'].rolling(window=50).mean()
-        hist['SMA200'] = hist['Close'].rolling(window=200).mean()
-        
-        # Calculate RSI
-        delta = hist['Close'].diff()
-        gain = delta.where(delta > 0, 0).fillna(0)
-        loss = -delta.where(delta < 0, 0).fillna(0)
-        avg_gain = gain.rolling(window=14).mean()
-        avg_loss = loss.rolling(window=14).mean()
-        rs = avg_gain / avg_loss.replace(0, 0.001)  # Avoid division by zero
-        hist['RSI'] = 100 - (100 / (1 + rs))
-        
-        # Calculate MACD
-        hist['EMA12'] = hist['Close'].ewm(span=12, adjust=False).mean()
-        hist['EMA26'] = hist['Close'].ewm(span=26, adjust=False).mean()
-        hist['MACD'] = hist['EMA12'] - hist['EMA26']
-        hist['Signal'] = hist['MACD'].ewm(span=9, adjust=False).mean()
-        
-        # Calculate Bollinger Bands
-        hist['Middle Band'] = hist['Close'].rolling(window=20).mean()
-        hist['STD'] = hist['Close'].rolling(window=20).std()
-        hist['Upper Band'] = hist['Middle Band'] + (hist['STD'] * 2)
-        hist['Lower Band'] = hist['Middle Band'] - (hist['STD'] * 2)
-        
-        # Recent values for analysis
-        current_price = hist['Close'].iloc[-1]
-        prev_price = hist['Close'].iloc[-2]
-        sma20 = hist['SMA20'].iloc[-1]
-        sma50 = hist['SMA50'].iloc[-1]
-        sma200 = hist['SMA200'].iloc[-1] if len(hist) >= 200 else None
-        rsi = hist['RSI'].iloc[-1]
-        macd = hist['MACD'].iloc[-1]
-        signal = hist['Signal'].iloc[-1]
-        upper_band = hist['Upper Band'].iloc[-1]
-        lower_band = hist['Lower Band'].iloc[-1]
-        
-        # Determine prediction based on technical indicators
-        prediction_factors = []
-        
-        # RSI signals
-        if rsi > 70:
-            prediction_factors.append({"factor": "RSI", "signal": "bearish", "value": rsi, "weight": 0.3})
-        elif rsi < 30:
-            prediction_factors.append({"factor": "RSI", "signal": "bullish", "value": rsi, "weight": 0.3})
-        else:
-            prediction_factors.append({"factor": "RSI", "signal": "neutral", "value": rsi, "weight": 0.1})
-        
-        # Moving average signals
-        if current_price > sma20 and sma20 > sma50:
-            prediction_factors.append({"factor": "Moving Averages", "signal": "bullish", "value": f"Price > SMA20 > SMA50", "weight": 0.25})
-        elif current_price < sma20 and sma20 < sma50:
-            prediction_factors.append({"factor": "Moving Averages", "signal": "bearish", "value": f"Price < SMA20 < SMA50", "weight": 0.25})
-        else:
-            prediction_factors.append({"factor": "Moving Averages", "signal": "neutral", "value": f"Mixed signals", "weight": 0.1})
-        
-        # MACD signals
-        if macd > signal and macd > 0:
-            prediction_factors.append({"factor": "MACD", "signal": "bullish", "value": f"MACD({macd:.2f}) > Signal({signal:.2f})", "weight": 0.25})
-        elif macd < signal and macd < 0:
-            prediction_factors.append({"factor": "MACD", "signal": "bearish", "value": f"MACD({macd:.2f}) < Signal({signal:.2f})", "weight": 0.25})
-        else:
-            prediction_factors.append({"factor": "MACD", "signal": "neutral", "value": f"MACD({macd:.2f}), Signal({signal:.2f})", "weight": 0.1})
-        
-        # Bollinger Bands signals
-        if current_price > upper_band:
-            prediction_factors.append({"factor": "Bollinger Bands", "signal": "bearish", "value": f"Price({current_price:.2f}) > Upper({upper_band:.2f})", "weight": 0.2})
-        elif current_price < lower_band:
-            prediction_factors.append({"factor": "Bollinger Bands", "signal": "bullish", "value": f"Price({current_price:.2f}) < Lower({lower_band:.2f})", "weight": 0.2})
-        else:
-            prediction_factors.append({"factor": "Bollinger Bands", "signal": "neutral", "value": f"Within bands", "weight": 0.1})
-        
-        # Price change momentum
-        price_changes = hist['Close'].pct_change(5).iloc[-5:].mean() * 100  # 5-day average change
-        if price_changes > 1:
-            prediction_factors.append({"factor": "Price Momentum", "signal": "bullish", "value": f"{price_changes:.2f}%", "weight": 0.2})
-        elif price_changes < -1:
-            prediction_factors.append({"factor": "Price Momentum", "signal": "bearish", "value": f"{price_changes:.2f}%", "weight": 0.2})
-        else:
-            prediction_factors.append({"factor": "Price Momentum", "signal": "neutral", "value": f"{price_changes:.2f}%", "weight": 0.1})
-        
-        # Volume Analysis
-        volume_change = hist['Volume'].pct_change(5).iloc[-5:].mean() * 100
-        if volume_change > 20 and price_changes > 0:
-            prediction_factors.append({"factor": "Volume Trend", "signal": "bullish", "value": f"{volume_change:.2f}%", "weight": 0.15})
-        elif volume_change > 20 and price_changes < 0:
-            prediction_factors.append({"factor": "Volume Trend", "signal": "bearish", "value": f"{volume_change:.2f}%", "weight": 0.15})
-        else:
-            prediction_factors.append({"factor": "Volume Trend", "signal": "neutral", "value": f"{volume_change:.2f}%", "weight": 0.05})
-        
-        # Simple Machine Learning Model
-        # Prepare data for ML model
-        ml_data = hist.copy()
-        
-        # Feature engineering
-        ml_data['Price_SMA20_Ratio'] = ml_data['Close'] / ml_data['SMA20']
-        ml_data['Price_SMA50_Ratio'] = ml_data['Close'] / ml_data['SMA50']
-        ml_data['SMA20_SMA50_Ratio'] = ml_data['SMA20'] / ml_data['SMA50']
-        ml_data['RSI_Scaled'] = ml_data['RSI'] / 100  # Scale RSI to 0-1
-        ml_data['MACD_Signal_Diff'] = ml_data['MACD'] - ml_data['Signal']
-        
-        # Add more sophisticated features
-        ml_data['Price_BB_Position'] = (ml_data['Close'] - ml_data['Lower Band']) / (ml_data['Upper Band'] - ml_data['Lower Band'])
-        ml_data['Volume_Change'] = ml_data['Volume'].pct_change(5).rolling(window=5).mean()
-        ml_data['Price_Volatility'] = ml_data['Close'].pct_change().rolling(window=10).std()
-        
-        # Create target: 1 if price went up in next 7 days, 0 if not
-        ml_data['Target'] = ml_data['Close'].shift(-7) > ml_data['Close']
-        ml_data = ml_data.dropna()
-        
-        if len(ml_data) > 30:  # Only use ML if we have enough data
-            try:
-                # Features and target
-                features = ['Price_SMA20_Ratio', 'Price_SMA50_Ratio', 'SMA20_SMA50_Ratio', 
-                           'RSI_Scaled', 'MACD_Signal_Diff', 'Price_BB_Position', 
-                           'Volume_Change', 'Price_Volatility']
-                X = ml_data[features].values
-                y = ml_data['Target'].astype(int).values
-                
-                # Try more advanced model if enough data
-                if len(ml_data) > 100:
-                    from sklearn.ensemble import RandomForestClassifier
-                    from sklearn.preprocessing import StandardScaler
-                    
-                    # Scale the features
-                    scaler = StandardScaler()
-                    X_scaled = scaler.fit_transform(X)
-                    
-                    # Split data (use most recent data for validation)
-                    split_idx = int(len(X_scaled) * 0.8)
-                    X_train, X_test = X_scaled[:split_idx], X_scaled[split_idx:]
-                    y_train, y_test = y[:split_idx], y[split_idx:]
-                    
-                    # Train model
-                    model = RandomForestClassifier(n_estimators=100, random_state=42)
-                    model.fit(X_train, y_train)
-                else:
-                    # Use logistic regression for smaller datasets
-                    from sklearn.linear_model import LogisticRegression
-                    from sklearn.preprocessing import StandardScaler
-                    
-                    # Scale the features
-                    scaler = StandardScaler()
-                    X_scaled = scaler.fit_transform(X)
-                    
-                    # Split data (use most recent data for validation)
-                    split_idx = int(len(X_scaled) * 0.8)
-                    X_train, X_test = X_scaled[:split_idx], X_scaled[split_idx:]
-                    y_train, y_test = y[:split_idx], y[split_idx:]
-                    
-                    # Train model
-                    model = LogisticRegression(random_state=42)
-                    model.fit(X_train, y_train)
-                
-                # Make prediction for current data
-                current_features = np.array([[
-                    ml_data['Price_SMA20_Ratio'].iloc[-1],
-                    ml_data['Price_SMA50_Ratio'].iloc[-1],
-                    ml_data['SMA20_SMA50_Ratio'].iloc[-1],
-                    ml_data['RSI_Scaled'].iloc[-1],
-                    ml_data['MACD_Signal_Diff'].iloc[-1],
-                    ml_data['Price_BB_Position'].iloc[-1],
-                    ml_data['Volume_Change'].iloc[-1],
-                    ml_data['Price_Volatility'].iloc[-1]
-                ]])
-                
-                current_features_scaled = scaler.transform(current_features)
-                ml_prediction = model.predict(current_features_scaled)[0]
-                ml_probability = model.predict_proba(current_features_scaled)[0][1]  # Probability of going up
-                
-                # Add ML prediction to factors
-                ml_signal = "bullish" if ml_prediction == 1 else "bearish"
-                prediction_factors.append({
-                    "factor": "Machine Learning Model", 
-                    "signal": ml_signal, 
-                    "value": f"{ml_probability:.2f} probability", 
-                    "weight": 0.35  # Give ML prediction higher weight
-                })
-                
-                # Include sentiment analysis from news
-                # This is a simplified approximation using technical indicators as proxy for sentiment
-                sentiment_score = 0
-                if rsi < 30:  # Oversold condition often indicates negative sentiment
-                    sentiment_score = -0.5
-                elif rsi > 70:  # Overbought condition often indicates positive sentiment
-                    sentiment_score = 0.5
-                
-                # Adjust sentiment based on recent price momentum
-                if price_changes > 3:  # Strong positive momentum
-                    sentiment_score += 0.3
-                elif price_changes < -3:  # Strong negative momentum
-                    sentiment_score -= 0.3
-                
-                # Add sentiment factor
-                sentiment_signal = "bullish" if sentiment_score > 0.2 else "bearish" if sentiment_score < -0.2 else "neutral"
-                prediction_factors.append({
-                    "factor": "Market Sentiment", 
-                    "signal": sentiment_signal, 
-                    "value": f"{sentiment_score:.2f} score", 
-                    "weight": 0.25
-                })
-                
-                # Generate future price projection for visualization
-                future_prices = []
-                last_price = current_price
-                
-                # Enhanced projection based on ML model confidence and sentiment
-                base_daily_change = hist['Close'].pct_change().iloc[-14:].mean()
-                
-                # Weight the prediction more heavily based on ML confidence
-                ml_weight = abs(ml_probability - 0.5) * 2  # 0 to 1 scale
-                ml_adjustment = 0.008 * ml_weight if ml_prediction == 1 else -0.008 * ml_weight
-                
-                # Add sentiment influence
-                sentiment_adjustment = sentiment_score * 0.002
-                
-                for i in range(7):  # Project 7 days into future
-                    # Combine all factors for projection
-                    projected_change = base_daily_change + ml_adjustment + sentiment_adjustment
-                    
-                    # Add some randomness that decreases over time for more realistic prediction
-                    noise_factor = max(0.003 - (i * 0.0003), 0.001)
-                    noise = np.random.normal(0, noise_factor)
-                    
-                    # Calculate next price
-                    next_price = last_price * (1 + projected_change + noise)
-                    future_prices.append(next_price)
-                    last_price = next_price
-                
-            except Exception as e:
-                print(f"Error in machine learning prediction: {e}")
-                # If ML fails, don't add ML factor
-                future_prices = []
-                for i in range(7):
-                    # Simple projection based on recent trend
-                    noise = np.random.normal(0, 0.005)
-                    future_prices.append(current_price * (1 + (i+1) * 0.002 * (1 if price_changes > 0 else -1) + noise))
-        else:
-            # If not enough data for ML, use simpler projection
-            future_prices = []
-            for i in range(7):
-                # Simple projection based on recent trend
-                noise = np.random.normal(0, 0.005)
-                future_prices.append(current_price * (1 + (i+1) * 0.002 * (1 if price_changes > 0 else -1) + noise))
-        
-        # Calculate weighted prediction
-        bullish_score = sum([factor["weight"] for factor in prediction_factors if factor["signal"] == "bullish"])
-        bearish_score = sum([factor["weight"] for factor in prediction_factors if factor["signal"] == "bearish"])
-        
-        # Determine final prediction
-        prediction = "up" if bullish_score > bearish_score else "down"
-        confidence = max(bullish_score, bearish_score) / sum([factor["weight"] for factor in prediction_factors]) * 100
-        
-        # Get stock info for context
-        try:
-            stock_info = ticker.info
-            company_name = stock_info.get('longName', symbol)
-            sector = stock_info.get('sector', 'Unknown Sector')
-            industry = stock_info.get('industry', 'Unknown Industry')
-        except Exception as e:
-            print(f"Error getting stock info: {e}")
-            company_name = symbol
-            sector = "Unknown Sector"
-            industry = "Unknown Industry"
-        
-        # Format analysis factors for AI prompt
-        factors_text = "\n".join([f"- {factor['factor']}: {factor['signal'].upper()} ({factor['value']})" for factor in prediction_factors])
-        
-        # Generate AI explanation using Groq
-        try:
-            client = groq.Groq(api_key=os.environ.get('GROQ_API_KEY'))
-            
-            prompt = f"""
-            You are a financial analyst providing an explanation for a stock prediction.
-            
-            Stock: {company_name} ({symbol})
-            Sector: {sector}
-            Industry: {industry}
-            Current Price: ${current_price:.2f}
-            
-            Technical Analysis Factors:
-            {factors_text}
-            
-            Overall Prediction: Stock will likely go {prediction.upper()} with {confidence:.1f}% confidence.
-            
-            Based on this information, provide a detailed but concise explanation of why {symbol} is predicted to go {prediction}. 
-            Focus on the most important technical indicators and their implications. 
-            Explain in clear terms that a retail investor would understand.
-            
-            Structure your explanation in these sections:
-            1. Summary (2-3 sentences)
-            2. Key Technical Indicators (bullet points explaining the most important signals)
-            3. Market Context (1-2 sentences about market conditions)
-            4. Conclusion (1-2 sentences with outlook)
-            
-            Keep your total response under 400 words and focus on being educational and insightful.
-            """
-            
-            chat_completion = client.chat.completions.create(
-                messages=[
-                    {"role": "system", "content": "You are a financial analyst providing stock predictions."},
-                    {"role": "user", "content": prompt}
-                ],
-                model="llama3-70b-8192",
-                temperature=0.5,
-                max_tokens=600,
-                top_p=1,
-                stream=False
-            )
-            
-            explanation = chat_completion.choices[0].message.content
-        except Exception as e:
-            print(f"Error generating AI explanation: {e}")
-            explanation = f"Based on technical analysis, {symbol} is predicted to go {prediction} with {confidence:.1f}% confidence. Key factors include RSI, moving averages, MACD, and recent price momentum."
-        
-        # Format dates for future projection
-        last_date = datetime.strptime(dates[-1], '%Y-%m-%d')
-        future_dates = [(last_date + timedelta(days=i+1)).strftime('%Y-%m-%d') for i in range(7)]
-        
-        # Create more accurate predicted price visualization
-        # First, create an array that properly shows null values for historical dates
-        # and predicted values only for future dates
-        all_predicted_prices = [None] * len(dates)
-        
-        # Connect the last actual price with first predicted price for visual continuity
-        # This ensures there's no gap between historical and predicted data
-        all_predicted_prices[-1] = current_price  # Connect the last historical point
-        all_predicted_prices.extend(future_prices)  # Add the future predictions
-        
-        # Combine historical and future data for visualization
-        visualization_data = {
-            "dates": dates + future_dates,
-            "prices": historical_prices + [None] * 7,  # Historical prices with None for future dates
-            "predicted": all_predicted_prices  # Now includes connecting point for better visualization
-        }
-        
-        result = {
-            "symbol": symbol,
-            "company_name": company_name,
-            "current_price": current_price,
-            "prediction": prediction,
-            "confidence": round(confidence, 1),
-            "explanation": explanation,
-            "analysis_factors": prediction_factors,
-            "visualization_data": visualization_data,
-            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        }
-        
-        return jsonify(result)
-        
-    except Exception as e:
-        print(f"Error in stock prediction: {e}")
-        return jsonify({
-            "error": f"Failed to analyze {symbol}: {str(e)}",
-            "symbol": symbol
-        })
+        return jsonify(predict_many(symbols, data.get('explain', False)))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
 # Check database tables and initialize if needed
 def check_db_tables():
@@ -1014,6 +676,12 @@ def check_db_tables():
         conn = get_db_connection()
         # Try to query the users table to see if it exists
         conn.execute('SELECT 1 FROM users LIMIT 1')
+        # Add columns introduced after the database was created
+        columns = {row['name'] for row in conn.execute('PRAGMA table_info(saved_strategies)')}
+        if columns and 'state' not in columns:
+            conn.execute('ALTER TABLE saved_strategies ADD COLUMN state TEXT')
+            conn.commit()
+            print("Added state column to saved_strategies")
         conn.close()
         print("Database tables already exist")
         return True
@@ -1028,6 +696,18 @@ def check_db_tables():
 with app.app_context():
     check_db_tables()
 
+# Batch backtest workers import the script they were started from as
+# __mp_main__; only the web process runs the background work below
+if __name__ != '__mp_main__':
+    # Build the stock search index so the first autocomplete request does not pay for it
+    get_search_index()
+
+    # Start refreshing the global market snapshot in the background
+    start_refresher()
+
+    # Roll saved strategies forward to the latest completed session every night
+    start_roller(app.config['DATABASE'])
+
 if __name__ == '__main__':
     # Check if database exists, if not initialize it
     if not os.path.exists(app.config['DATABASE']):
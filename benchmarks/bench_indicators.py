@@ -0,0 +1,99 @@
+"""
+Throughput benchmark for services/indicators.py.
+
+Reports bars per second for each indicator on random-walk price series of
+1k, 100k and 10M bars (best of several runs). ``--check`` instead compares
+the EMA with pandas ``ewm(adjust=False)`` on series with missing and
+infinite values, and exits non-zero on a mismatch.
+
+    python benchmarks/bench_indicators.py
+    python benchmarks/bench_indicators.py --sizes 1000 100000 --repeat 5
+    python benchmarks/bench_indicators.py --check
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import indicators
+
+INDICATORS = {
+    'sma(20)': lambda x: indicators.sma(x, 20),
+    'ema(12)': lambda x: indicators.ema(x, span=12),
+    'rolling_std(20)': lambda x: indicators.rolling_std(x, 20),
+    'rsi(14)': lambda x: indicators.rsi(x, 14),
+    'macd(12,26,9)': lambda x: indicators.macd(x, 12, 26, 9),
+    'bollinger(20,2)': lambda x: indicators.bollinger(x, 20, 2),
+}
+
+
+def random_walk(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return 100.0 * np.exp(np.cumsum(rng.normal(0.0, 0.01, n)))
+
+
+def best_time(fn, x, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(x)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def check_ema(n=5_000, seed=0):
+    """
+    Largest relative difference between ``indicators.ema`` and pandas
+
+    Gaps of missing values are placed at the start, inside and at the end of
+    the series; infinite values are compared as missing. Span 3 (alpha 0.5)
+    is left out: pandas treats exactly com=1 differently from every nearby
+    value.
+    """
+    rng = np.random.default_rng(seed)
+    x = random_walk(n, seed)
+    gaps = np.concatenate([np.arange(3), rng.choice(n, n // 20, replace=False), np.arange(n - 4, n)])
+    x[gaps] = np.nan
+    x[rng.choice(n, 5, replace=False)] = np.inf
+    expected_input = np.where(np.isfinite(x), x, np.nan)
+    worst = 0.0
+    for span in (2, 5, 12, 26, 200):
+        expected = pd.Series(expected_input).ewm(span=span, adjust=False).mean().to_numpy()
+        actual = indicators.ema(x, span=span)
+        if not np.array_equal(np.isnan(actual), np.isnan(expected)):
+            return float('inf')
+        finite = np.isfinite(expected)
+        worst = max(worst, float(np.max(np.abs(actual[finite] / expected[finite] - 1))))
+    return worst
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark indicator throughput')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 100_000, 10_000_000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--check', action='store_true', help='compare the EMA with pandas instead')
+    args = parser.parse_args(argv)
+
+    if args.check:
+        worst = check_ema()
+        print(f"ema vs pandas ewm: max relative difference {worst:.3g}")
+        return 0 if worst < 1e-9 else 1
+
+    print(f"{'indicator':<18}{'bars':>12}{'seconds':>12}{'bars/sec':>16}")
+    for n in args.sizes:
+        x = random_walk(n)
+        # Small inputs are timed over more runs to get past timer resolution
+        repeat = args.repeat if n >= 100_000 else args.repeat * 20
+        for name, fn in INDICATORS.items():
+            seconds = best_time(fn, x, repeat)
+            print(f"{name:<18}{n:>12,}{seconds:>12.5f}{n / seconds:>16,.0f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
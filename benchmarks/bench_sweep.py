@@ -0,0 +1,57 @@
+"""
+Timing benchmark for services/backtest_engine.py.
+
+Sweeps every predefined strategy over a random-walk series of ten years of
+daily bars and reports settings per second (best of several runs). The SMA
+crossover case is the 50 x 200 window grid.
+
+    python benchmarks/bench_sweep.py
+    python benchmarks/bench_sweep.py --bars 5000 --repeat 5
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import backtest_engine
+from services.strategy_service import get_predefined_strategies
+
+SWEEPS = {
+    'sma_crossover': {'short_window': {'min': 1, 'max': 50}, 'long_window': {'min': 1, 'max': 200}},
+    'rsi': {'rsi_period': {'min': 7, 'max': 30}, 'oversold': {'min': 10, 'max': 40}, 'overbought': [60, 70, 80, 90]},
+    'macd': {'fast_period': {'min': 8, 'max': 20}, 'slow_period': {'min': 20, 'max': 40}, 'signal_period': {'min': 5, 'max': 15}},
+    'bollinger': {'window': {'min': 10, 'max': 50}, 'num_std': {'min': 1.0, 'max': 3.0, 'step': 0.1}},
+}
+
+
+def random_walk(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return 100.0 * np.exp(np.cumsum(rng.normal(0.0003, 0.015, n)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark vectorized parameter sweeps')
+    parser.add_argument('--bars', type=int, default=2520)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    specs = {s['id']: s['parameters'] for s in get_predefined_strategies()}
+    close = random_walk(args.bars)
+    print(f"{'strategy':<16}{'settings':>10}{'seconds':>12}{'settings/sec':>16}")
+    for strategy, ranges in SWEEPS.items():
+        best = float('inf')
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            grid, metrics = backtest_engine.sweep(strategy, close, specs[strategy], ranges)
+            best = min(best, time.perf_counter() - start)
+        settings = metrics['total_return'].size
+        print(f"{strategy:<16}{settings:>10,}{best:>12.4f}{settings / best:>16,.0f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -59,6 +59,7 @@ CREATE TABLE saved_strategies (
     start_date DATE NOT NULL,
     end_date DATE NOT NULL,
     metrics TEXT NOT NULL,
+    state TEXT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP,
     FOREIGN KEY (user_id) REFERENCES users (id)
@@ -1 +1,7 @@
+import os
 
+# Root directory for locally persisted market data (bars, caches, models)
+DATA_DIR = os.environ.get(
+    'STOCKSENSE_DATA_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+)
@@ -1,9 +1,14 @@
 import os
-import yfinance as yf
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-import groq
+
+from services.bar_store import get_history
+from services.indicator_state import latest_indicators
+from services.llm_gateway import gateway
+
+# Seconds a chat answer is reused for the same question
+CHAT_CACHE_TTL = int(os.environ.get('CHAT_CACHE_TTL', 86400))
 
 # No longer need OpenAI
 # openai.api_key = os.environ.get('OPENAI_API_KEY')
@@ -14,8 +19,7 @@ def analyze_stock_movement(symbol):
     """
     try:
         # Get historical data
-        ticker = yf.Ticker(symbol)
-        hist = ticker.history(period="6mo")
+        hist = get_history(symbol, period="6mo")
         
         if hist.empty:
             return {
@@ -26,10 +30,10 @@ def analyze_stock_movement(symbol):
                 "prediction": "Insufficient data for prediction"
             }
         
-        # Calculate some basic technical indicators
-        hist['SMA20'] = hist['Close'].rolling(window=20).mean()
-        hist['SMA50'] = hist['Close'].rolling(window=50).mean()
-        hist['RSI'] = calculate_rsi(hist['Close'])
+        # Latest technical indicators, updated incrementally from the checkpoint
+        latest = latest_indicators(symbol) or {}
+        sma20 = latest.get('sma20', np.nan)
+        sma50 = latest.get('sma50', np.nan)
         
         # Get recent price and calculate changes
         current_price = hist['Close'].iloc[-1]
@@ -38,10 +42,10 @@ def analyze_stock_movement(symbol):
         price_change_1m = (current_price / hist['Close'].iloc[-20] - 1) * 100 if len(hist) > 20 else 0
         
         # Determine trend direction
-        trend = "bullish" if hist['SMA20'].iloc[-1] > hist['SMA50'].iloc[-1] else "bearish"
+        trend = "bullish" if sma20 > sma50 else "bearish"
         
         # Simple sentiment based on recent performance and RSI
-        rsi = hist['RSI'].iloc[-1]
+        rsi = latest.get('rsi14', np.nan)
         
         if rsi > 70:
             sentiment = "overbought"
@@ -69,7 +73,7 @@ def analyze_stock_movement(symbol):
                 f"Price change (1 day): {round(price_change_1d, 2)}%",
                 f"Price change (1 week): {round(price_change_1w, 2)}%",
                 f"Price change (1 month): {round(price_change_1m, 2)}%",
-                f"20-day SMA is {'above' if hist['SMA20'].iloc[-1] > hist['SMA50'].iloc[-1] else 'below'} 50-day SMA"
+                f"20-day SMA is {'above' if sma20 > sma50 else 'below'} 50-day SMA"
             ],
             "prediction": "Likely to continue " + trend + " pattern in the short term"
         }
@@ -90,6 +94,9 @@ def chat_with_ai(message):
     """
     Send a message to Groq API (Llama3-70b-8192) and get a response
     
+    Repeated questions are answered from the LLM gateway's cache for
+    CHAT_CACHE_TTL seconds.
+    
     Args:
         message: User's message
     
@@ -97,52 +104,19 @@ def chat_with_ai(message):
         Llama3 model response via Groq API
     """
     try:
-        # Initialize Groq client with API key
-        client = groq.Groq(api_key=os.environ.get('GROQ_API_KEY'))
-        
-        # Call Groq API with Llama3-70b-8192 model
-        response = client.chat.completions.create(
+        # Call Groq API with Llama3-70b-8192 model through the caching gateway
+        return gateway.complete(
             model="llama3-70b-8192",
             messages=[
                 {"role": "system", "content": "You are a financial advisor bot for StockSense AI. You help users with stock market questions, investment advice, and general financial knowledge. Keep responses concise but informative."},
                 {"role": "user", "content": message}
             ],
+            ttl=CHAT_CACHE_TTL,
             temperature=0.5,
             max_tokens=500,
-            top_p=1,
-            stream=False
+            top_p=1
         )
-        
-        # Extract the message from the response
-        return response.choices[0].message.content
     
     except Exception as e:
         print(f"Error in chat_with_ai: {e}")
         return "I apologize, but I'm having trouble connecting to my knowledge base right now. Please try again later."
-
-def calculate_rsi(prices, period=14):
-    """Calculate Relative Strength Index"""
-    deltas = np.diff(prices)
-    seed = deltas[:period+1]
-    up = seed[seed>=0].sum()/period
-    down = -seed[seed<0].sum()/period
-    rs = up/down
-    rsi = np.zeros_like(prices)
-    rsi[:period] = 100. - 100./(1.+rs)
-
-    for i in range(period, len(prices)):
-        delta = deltas[i-1]
-        if delta > 0:
-            upval = delta
-            downval = 0.
-        else:
-            upval = 0.
-            downval = -delta
-            
-        up = (up * (period - 1) + upval) / period
-        down = (down * (period - 1) + downval) / period
-        
-        rs = up/down if down != 0 else 0
-        rsi[i] = 100. - 100./(1.+rs)
-        
-    return rsi
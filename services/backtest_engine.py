@@ -0,0 +1,362 @@
+"""
+Vectorized backtest engine.
+
+Evaluates many parameter settings of a predefined strategy at once. Each
+strategy builder turns one close-price series into a 2-D signal matrix (one
+row per distinct setting, one column per bar), and ``grid_metrics`` scores
+all rows with whole-matrix NumPy operations. Signals follow the rules of
+``strategy_service.backtest_strategy`` and are scored by the same trade
+ledger, so the best setting of a sweep reproduces the single backtest
+exactly.
+"""
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from services import indicators, trade_ledger
+from services.strategy_dsl import compile_rule
+
+# Upper bound on settings evaluated by one sweep
+MAX_COMBINATIONS = 50_000
+
+# Settings scored per batch, bounding the size of the float matrices
+_ROW_BATCH = 128
+
+METRICS = trade_ledger.METRICS
+
+
+def parameter_values(spec, value):
+    """
+    Expand one parameter range into the list of values to sweep
+
+    Args:
+        spec: Parameter definition from ``get_predefined_strategies``
+        value: A scalar, a list of values, or a dictionary with ``min``,
+            ``max`` and optional ``step`` (bounds inclusive)
+
+    Returns:
+        Sorted list of distinct values of the parameter's type (text values
+        keep their order)
+    """
+    if spec.get('type') == 'text':
+        # Free-form values such as custom rules are kept as given, in order
+        values = value if isinstance(value, (list, tuple)) else [spec['default'] if value is None else value]
+        if not values:
+            raise ValueError('Empty parameter range')
+        return list(dict.fromkeys(str(v) for v in values))
+    cast = float if spec.get('type') == 'float' else int
+    if value is None:
+        return [cast(spec['default'])]
+    if isinstance(value, dict):
+        low = cast(value.get('min', spec.get('min', spec['default'])))
+        high = cast(value.get('max', spec.get('max', spec['default'])))
+        step = cast(value.get('step', 1 if cast is int else 0.5))
+        if step <= 0:
+            raise ValueError('step must be positive')
+        if high < low:
+            raise ValueError('max must not be below min')
+        count = int(np.floor((high - low) / step + 1e-9)) + 1
+        if count > MAX_COMBINATIONS:
+            raise ValueError(f'Too many values ({count})')
+        values = [low + i * step for i in range(count)]
+        if cast is float:
+            values = [round(v, 10) for v in values]
+    elif isinstance(value, (list, tuple)):
+        values = [cast(v) for v in value]
+    else:
+        values = [cast(value)]
+    if not values:
+        raise ValueError('Empty parameter range')
+    if cast is int and min(values) <= 0:
+        raise ValueError('Periods must be positive')
+    return sorted(set(values))
+
+
+def _sma_crossover(close, grid):
+    short = np.asarray(grid['short_window'])
+    long = np.asarray(grid['long_window'])
+    n = len(close)
+    windows = np.union1d(short, long)
+
+    # Every window's SMA from one cumulative sum (centred to limit cancellation)
+    centre = np.nanmean(close) if n else 0.0
+    sums = np.concatenate(([0.0], np.cumsum(close - centre)))
+    sma = np.full((n, len(windows)), np.nan)
+    for j, w in enumerate(windows):
+        if w <= n:
+            sma[w - 1:, j] = (sums[w:] - sums[:-w]) / w + centre
+
+    fast = sma[:, np.searchsorted(windows, short)].T
+    slow = sma[:, np.searchsorted(windows, long)].T
+    # Signals start at bar short_window, as in the single backtest
+    for j, w in enumerate(short):
+        fast[j, :w] = np.nan
+    with np.errstate(invalid='ignore'):
+        above = fast[:, None, :] > slow[None, :, :]
+    signals = above.reshape(-1, n).view(np.int8)
+    column = np.arange(len(signals)).reshape(len(short), len(long))
+    return signals, column
+
+
+def _rsi(close, grid):
+    periods = grid['rsi_period']
+    oversold = np.asarray(grid['oversold'], dtype=np.float64)
+    rsi = np.array([indicators.rsi(close, p) for p in periods])
+    with np.errstate(invalid='ignore'):
+        signals = (rsi[:, None, :] < oversold[None, :, None]).reshape(-1, len(close)).view(np.int8)
+    # The overbought level does not change the signal, so those settings share rows
+    column = np.arange(len(signals)).reshape(len(periods), len(oversold), 1)
+    column = np.broadcast_to(column, (len(periods), len(oversold), len(grid['overbought'])))
+    return signals, column
+
+
+def _macd(close, grid):
+    fast = grid['fast_period']
+    slow = grid['slow_period']
+    signal_periods = grid['signal_period']
+    emas = {span: indicators.ema(close, span=span) for span in set(fast) | set(slow)}
+    lines = np.column_stack([emas[f] - emas[s] for f in fast for s in slow])
+
+    blocks = []
+    for period in signal_periods:
+        alpha = 2.0 / (period + 1.0)
+        signal_line = indicators.linear_filter(lines, 1.0 - alpha, alpha)
+        block = np.sign(lines - signal_line).T.astype(np.int8)
+        block[:, :period] = 0
+        blocks.append(block)
+    # Rows ordered (signal_period, fast, slow); reorder the index to the grid
+    signals = np.concatenate(blocks)
+    column = np.arange(len(signals)).reshape(len(signal_periods), len(fast), len(slow)).transpose(1, 2, 0)
+    return signals, column
+
+
+def _bollinger(close, grid):
+    windows = grid['window']
+    num_std = np.asarray(grid['num_std'], dtype=np.float64)
+    middle = np.array([indicators.sma(close, w) for w in windows])[:, None, :]
+    width = np.array([indicators.rolling_std(close, w) for w in windows])[:, None, :] * num_std[None, :, None]
+    with np.errstate(invalid='ignore'):
+        signals = (close < middle - width).view(np.int8) - (close > middle + width).view(np.int8)
+    signals = signals.reshape(-1, len(close))
+    column = np.arange(len(signals)).reshape(len(windows), len(num_std))
+    return signals, column
+
+
+def _custom(close, grid, fields=None):
+    # One row per rule; rules read close plus any other price fields given
+    series = dict(fields or {}, close=close)
+    signals = np.array([compile_rule(code).signals(series) for code in grid['code']], dtype=np.int8)
+    column = np.arange(len(signals))
+    return signals.reshape(len(column), len(close)), column
+
+
+def price_fields(strategy_type, grid):
+    """
+    Price fields a strategy reads, close first
+
+    Args:
+        strategy_type: Predefined strategy id
+        grid: Dictionary mapping each parameter name to its list of values
+
+    Returns:
+        Tuple of field names (see ``strategy_dsl.FIELDS``)
+    """
+    fields = ['close']
+    if strategy_type == 'custom':
+        for code in grid['code']:
+            fields.extend(field for field in compile_rule(code).fields if field not in fields)
+    return tuple(fields)
+
+
+def strategy_signals(strategy_type, prices, parameters, fields=None):
+    """
+    Signals of one strategy setting for one or many price series
+
+    Applies the rules of ``strategy_service.backtest_strategy``. A 2-D input
+    holds one series per column, each starting at row 0 (pad the tail of
+    shorter series with their last price).
+
+    Args:
+        strategy_type: Predefined strategy id
+        prices: 1-D close array or 2-D (bar x series) matrix
+        parameters: Dictionary of typed strategy parameters
+        fields: Optional dictionary of other price fields (open, high, low,
+            volume) shaped like prices, for custom rules
+
+    Returns:
+        int8 array shaped like prices (1 long, -1 short, 0 flat)
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    with np.errstate(invalid='ignore'):
+        if strategy_type == 'sma_crossover':
+            short_window = parameters['short_window']
+            signals = indicators.sma(prices, short_window) > indicators.sma(prices, parameters['long_window'])
+            signals[:short_window] = False
+            return signals.view(np.int8)
+        if strategy_type == 'rsi':
+            return (indicators.rsi(prices, parameters['rsi_period']) < parameters['oversold']).view(np.int8)
+        if strategy_type == 'macd':
+            line, signal_line, _ = indicators.macd(prices, parameters['fast_period'], parameters['slow_period'],
+                                                   parameters['signal_period'])
+            signals = np.nan_to_num(np.sign(line - signal_line)).astype(np.int8)
+            signals[:parameters['signal_period']] = 0
+            return signals
+        if strategy_type == 'bollinger':
+            _, upper, lower = indicators.bollinger(prices, parameters['window'], parameters['num_std'])
+            return (prices < lower).view(np.int8) - (prices > upper).view(np.int8)
+        if strategy_type == 'custom':
+            return compile_rule(parameters['code']).signals(dict(fields or {}, close=prices))
+    raise ValueError(f'Strategy {strategy_type} cannot be run on a price matrix')
+
+
+BUILDERS = {
+    'sma_crossover': _sma_crossover,
+    'rsi': _rsi,
+    'macd': _macd,
+    'bollinger': _bollinger,
+    'custom': _custom,
+}
+
+
+def signal_grid(strategy_type, close, grid, fields=None):
+    """
+    Build the signal matrix for every combination of parameter values
+
+    Args:
+        strategy_type: Predefined strategy id
+        close: 1-D array of close prices
+        grid: Dictionary mapping each parameter name to its list of values,
+            in the strategy's parameter order
+        fields: Optional dictionary of other price fields (open, high, low,
+            volume) as arrays shaped like close, for custom rules
+
+    Returns:
+        Tuple of (signals, column): an int8 matrix with one row per
+        distinct setting and one column per bar (1 long, -1 short, 0 flat),
+        and an integer array shaped like the parameter grid giving each
+        combination's row
+    """
+    builder = BUILDERS.get(strategy_type)
+    if builder is None:
+        raise ValueError(f'Strategy {strategy_type} cannot be swept')
+    close = np.asarray(close, dtype=np.float64)
+    if strategy_type == 'custom':
+        return builder(close, grid, fields)
+    return builder(close, grid)
+
+
+def grid_metrics(close, signals, years=None):
+    """
+    Score every row of a signal matrix
+
+    Args:
+        close: 1-D array of close prices
+        signals: Matrix of positions, one row per setting and one column per bar
+        years: Optional length of the period in years, for CAGR
+
+    Returns:
+        Dictionary of per-setting arrays, one per name in METRICS
+    """
+    settings = len(signals)
+    result = {name: np.zeros(settings) for name in METRICS}
+    # Batches bound the size of the float equity matrices
+    for start in range(0, settings, _ROW_BATCH):
+        rows = slice(start, min(settings, start + _ROW_BATCH))
+        for name, values in trade_ledger.performance(close, signals[rows], years).items():
+            result[name][rows] = values
+    return result
+
+
+def sweep(strategy_type, close, spec, ranges, years=None, fields=None):
+    """
+    Evaluate every combination of parameter ranges for one price series
+
+    Args:
+        strategy_type: Predefined strategy id
+        close: 1-D array of close prices
+        spec: The strategy's parameter definitions (name -> definition)
+        ranges: Dictionary mapping parameter names to ranges accepted by
+            ``parameter_values``; omitted parameters use their default
+        years: Optional length of the period in years, for CAGR
+        fields: Optional dictionary of other price fields shaped like close,
+            for custom rules
+
+    Returns:
+        Tuple of (grid, metrics): the swept values per parameter and a
+        dictionary of metric arrays shaped like the grid
+    """
+    unknown = set(ranges) - set(spec)
+    if unknown:
+        raise ValueError(f"Unknown parameters: {', '.join(sorted(unknown))}")
+    grid = {name: parameter_values(definition, ranges.get(name)) for name, definition in spec.items()}
+    combinations = int(np.prod([len(values) for values in grid.values()]))
+    if combinations > MAX_COMBINATIONS:
+        raise ValueError(f'Too many combinations ({combinations}, limit {MAX_COMBINATIONS})')
+
+    signals, column = signal_grid(strategy_type, close, grid, fields)
+    scores = grid_metrics(close, signals, years)
+    return grid, {name: values[column] for name, values in scores.items()}
+
+
+def best_settings(grid, metrics, sort_by='total_return', top=5):
+    """
+    Best parameter combinations of a sweep
+
+    Drawdown is ranked ascending, every other metric descending.
+
+    Returns:
+        List of dictionaries with the parameters and metrics of each setting
+    """
+    values = metrics[sort_by].ravel()
+    order = np.argsort(values if sort_by == 'max_drawdown' else -values, kind='stable')[:top]
+    shape = tuple(len(v) for v in grid.values())
+    best = []
+    for index in order:
+        position = np.unravel_index(index, shape)
+        best.append({
+            'parameters': {name: grid[name][i] for name, i in zip(grid, position)},
+            'metrics': {name: trade_ledger.metric_value(name, metrics[name].flat[index]) for name in METRICS},
+        })
+    return best
+
+
+def score_shared(shm_name, layout, strategy_type, grid, fields=('close',)):
+    """
+    Backtest one setting on several price series held in shared memory
+
+    Runs in batch backtest worker processes: prices are read in place from
+    the named block instead of being pickled with the task.
+
+    Args:
+        shm_name: Name of a shared memory block holding a float64
+            (field x bar) matrix, one row per name in ``fields``
+        layout: List of (offset, length, years) triples, one per series
+            (years is the calendar span used for CAGR, or None)
+        strategy_type: Predefined strategy id
+        grid: Dictionary mapping each parameter name to a one-value list
+        fields: Price fields packed in the block, close first (see
+            ``price_fields``)
+
+    Returns:
+        List of metric dictionaries (plus buy_hold_return), one per series
+    """
+    block = shared_memory.SharedMemory(name=shm_name)
+    try:
+        size = max((offset + length for offset, length, _ in layout), default=0)
+        prices = np.ndarray((len(fields), size), dtype=np.float64, buffer=block.buf)
+        close = series = None
+        results = []
+        for offset, length, years in layout:
+            series = {field: prices[i, offset:offset + length] for i, field in enumerate(fields)}
+            close = series.pop('close')
+            signals, column = signal_grid(strategy_type, close, grid, series)
+            scores = grid_metrics(close, signals, years)
+            row = column.flat[0]
+            metrics = {name: trade_ledger.metric_value(name, scores[name][row]) for name in METRICS}
+            metrics['buy_hold_return'] = float(close[-1] / close[0] - 1) if length > 1 else 0.0
+            results.append(metrics)
+        # Views into the block must be gone before it can be closed
+        del prices, close, series
+        return results
+    finally:
+        block.close()
@@ -0,0 +1,487 @@
+"""
+Persistent on-disk OHLCV bar store.
+
+Each symbol/interval pair is kept in a single ``.npy`` file holding a 6 x N
+float64 matrix (timestamp, open, high, low, close, volume). Every field is a
+contiguous row, so reads memory-map the file and slice columns without
+loading the whole history. Only bars newer than the last stored timestamp are
+downloaded on refresh; requested periods and date ranges are sliced locally.
+Upstream prices are split- and dividend-adjusted, so each refresh also
+refetches the last completed bar and, if upstream has revised its close,
+rewrites the whole stored series.
+"""
+import os
+import re
+import json
+import time
+import threading
+import concurrent.futures
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+
+from services import DATA_DIR
+from services.market_data import get_provider
+
+BAR_STORE_DIR = os.environ.get('BAR_STORE_DIR', os.path.join(DATA_DIR, 'bars'))
+
+# Column order of the stored matrix (row 0 holds UTC epoch seconds)
+COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+# Longest time a stored series is served before asking upstream for new bars
+MAX_REFRESH_SECONDS = 900
+
+# Relative close difference on an overlapping bar that marks a re-adjusted history
+REVISION_TOLERANCE = 1e-6
+
+# Threads syncing symbols the bulk refresh could not cover
+FETCH_WORKERS = int(os.environ.get('BAR_STORE_FETCH_WORKERS', 8))
+
+_INTERVAL_SECONDS = {
+    'm': 60,
+    'h': 3600,
+    'd': 86400,
+    'wk': 7 * 86400,
+    'mo': 30 * 86400,
+}
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+_listeners = []
+
+
+def _get_lock(key):
+    with _locks_guard:
+        if key not in _locks:
+            _locks[key] = threading.Lock()
+        return _locks[key]
+
+
+def _paths(symbol, interval):
+    safe_symbol = re.sub(r'[^A-Za-z0-9._^=-]', '_', symbol.upper())
+    base = os.path.join(BAR_STORE_DIR, interval, safe_symbol)
+    return base + '.npy', base + '.json'
+
+
+def _interval_seconds(interval):
+    match = re.match(r'^(\d+)(m|h|d|wk|mo)$', interval)
+    if not match:
+        return 86400
+    return int(match.group(1)) * _INTERVAL_SECONDS[match.group(2)]
+
+
+def _is_intraday(interval):
+    return _interval_seconds(interval) < 86400
+
+
+def _refresh_seconds(interval):
+    """How long stored bars are considered current for this interval"""
+    return min(max(_interval_seconds(interval), 60), MAX_REFRESH_SECONDS)
+
+
+def _load(symbol, interval):
+    bars_path, meta_path = _paths(symbol, interval)
+    if not os.path.exists(bars_path) or not os.path.exists(meta_path):
+        return None, {}
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        matrix = np.load(bars_path, mmap_mode='r')
+        return matrix, meta
+    except (OSError, ValueError) as e:
+        print(f"Error reading bar store for {symbol} ({interval}): {e}")
+        return None, {}
+
+
+def _write(symbol, interval, matrix, meta):
+    bars_path, meta_path = _paths(symbol, interval)
+    os.makedirs(os.path.dirname(bars_path), exist_ok=True)
+
+    # Write to temp files and swap them in so readers never see partial data
+    suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(bars_path + suffix, 'wb') as f:
+        np.save(f, np.ascontiguousarray(matrix, dtype=np.float64))
+    with open(meta_path + suffix, 'w') as f:
+        json.dump(meta, f)
+    os.replace(bars_path + suffix, bars_path)
+    os.replace(meta_path + suffix, meta_path)
+
+    for listener in _listeners:
+        try:
+            listener(symbol, interval, matrix, meta)
+        except Exception as e:
+            print(f"Error in bar store listener for {symbol} ({interval}): {e}")
+
+
+def add_listener(func):
+    """
+    Call ``func(symbol, interval, matrix, meta)`` whenever a symbol's bars are written
+
+    Listeners run in the writing thread while the symbol's lock is held, so
+    they should be quick; their errors are logged and ignored.
+    """
+    if func not in _listeners:
+        _listeners.append(func)
+
+
+def _frame_to_matrix(hist):
+    """Convert a yfinance history frame into the stored 6 x N layout"""
+    if hist is None or hist.empty or not all(col in hist.columns for col in COLUMNS):
+        return np.empty((len(COLUMNS) + 1, 0))
+    index = hist.index if hist.index.tz is not None else hist.index.tz_localize('UTC')
+    timestamps = index.tz_convert('UTC').as_unit('ns').asi8 / 1e9
+    matrix = np.vstack([timestamps] + [hist[col].to_numpy(dtype=np.float64) for col in COLUMNS])
+    return matrix[:, np.argsort(matrix[0], kind='stable')]
+
+
+def _matrix_to_frame(matrix, tz):
+    index = pd.to_datetime(np.asarray(matrix[0]), unit='s', utc=True).tz_convert(tz or 'UTC')
+    return pd.DataFrame(np.array(matrix[1:]).T, index=index, columns=COLUMNS)
+
+
+def _revised(matrix, newer):
+    """Whether fetched bars disagree with the stored closes of completed bars"""
+    _, old, new = np.intersect1d(matrix[0, :-1], newer[0], return_indices=True)
+    if not len(old):
+        return False
+    return not np.allclose(newer[4, new], matrix[4, old], rtol=REVISION_TOLERANCE, atol=0)
+
+
+def _fetch(symbol, interval, start=None, end=None, period=None):
+    provider = get_provider()
+    if period:
+        return provider.history(symbol, period=period, interval=interval)
+    return provider.history(symbol, interval=interval, start=start, end=end)
+
+
+def _period_offset(period):
+    """Parse a yfinance period string into (count, unit)"""
+    match = re.match(r'^(\d+)(d|wk|mo|y)$', period or '')
+    if not match:
+        return None, None
+    return int(match.group(1)), match.group(2)
+
+
+def _coverage_start(period, start, anchor):
+    """Earliest UTC epoch second the store must hold, or None for full history"""
+    if start is not None:
+        return _to_epoch(start, 'UTC') - 86400
+    if period == 'max':
+        return None
+    if period == 'ytd':
+        return pd.Timestamp(year=anchor.year, month=1, day=1).timestamp()
+    count, unit = _period_offset(period)
+    if count is None:
+        count, unit = 1, 'mo'
+    if unit == 'd':
+        # Daily periods count sessions, so leave room for weekends and holidays
+        return (anchor - timedelta(days=int(count * 7 / 5) + 7)).timestamp()
+    if unit == 'wk':
+        return (anchor - timedelta(weeks=count)).timestamp()
+    if unit == 'mo':
+        return (anchor - pd.DateOffset(months=count)).timestamp()
+    return (anchor - pd.DateOffset(years=count)).timestamp()
+
+
+def _sync(symbol, interval, period, start):
+    """Make sure the store covers the request and is current, fetching only the gaps"""
+    key = (symbol.upper(), interval)
+    with _get_lock(key):
+        matrix, meta = _load(symbol, interval)
+        now = time.time()
+
+        if matrix is None or matrix.shape[1] == 0:
+            if start is not None:
+                hist = _fetch(symbol, interval, start=pd.Timestamp(_coverage_start(None, start, None), unit='s').strftime('%Y-%m-%d'))
+            else:
+                hist = _fetch(symbol, interval, period=period)
+            matrix = _frame_to_matrix(hist)
+            if matrix.shape[1] == 0:
+                return None, {}
+            want_start = _coverage_start(period, start, pd.Timestamp(matrix[0, -1], unit='s', tz='UTC'))
+            if start is None and _period_offset(period)[1] == 'd':
+                # Session-count periods only cover the bars actually returned
+                want_start = float(matrix[0, 0])
+            meta = {
+                'symbol': symbol.upper(),
+                'interval': interval,
+                'tz': str(hist.index.tz) if hist.index.tz is not None else 'UTC',
+                'covers_max': want_start is None,
+                'start': want_start,
+                'fetched_at': now
+            }
+            _write(symbol, interval, matrix, meta)
+            return np.load(_paths(symbol, interval)[0], mmap_mode='r'), meta
+
+        changed = False
+        try:
+            # Backfill history older than what we hold
+            want_start = _coverage_start(period, start, pd.Timestamp(matrix[0, -1], unit='s', tz='UTC'))
+            covers_max = meta.get('covers_max', False)
+            covered = meta.get('start')
+            if not covers_max and (want_start is None or (covered is not None and want_start < covered)):
+                first_ts = pd.Timestamp(matrix[0, 0], unit='s', tz='UTC')
+                if want_start is None:
+                    older = _fetch(symbol, interval, period='max')
+                else:
+                    older = _fetch(symbol, interval,
+                                   start=pd.Timestamp(want_start, unit='s').strftime('%Y-%m-%d'),
+                                   end=first_ts.strftime('%Y-%m-%d'))
+                older = _frame_to_matrix(older)
+                older = older[:, older[0] < matrix[0, 0]]
+                matrix = np.hstack([older, matrix])
+                meta['covers_max'] = want_start is None
+                meta['start'] = want_start
+                changed = True
+
+            # Append bars after the last stored timestamp. The last bar is
+            # refetched since it may still be forming, and the completed bar
+            # before it is refetched to detect a split or dividend adjustment.
+            if now - meta.get('fetched_at', 0) >= _refresh_seconds(interval):
+                tz = meta.get('tz') or 'UTC'
+                overlap_ts = pd.Timestamp(matrix[0, max(matrix.shape[1] - 2, 0)], unit='s', tz='UTC')
+                fetch_start = overlap_ts if _is_intraday(interval) else overlap_ts.tz_convert(tz).strftime('%Y-%m-%d')
+                newer = _frame_to_matrix(_fetch(symbol, interval, start=fetch_start))
+                if newer.shape[1] and _revised(matrix, newer):
+                    # Stored bars are on the old adjustment basis; refetch them all
+                    print(f"Upstream revised stored bars for {symbol} ({interval}); refetching history")
+                    if meta.get('covers_max'):
+                        newer = _fetch(symbol, interval, period='max')
+                    else:
+                        covered = pd.Timestamp(meta.get('start') or matrix[0, 0], unit='s', tz='UTC')
+                        newer = _fetch(symbol, interval, start=covered if _is_intraday(interval) else covered.strftime('%Y-%m-%d'))
+                    newer = _frame_to_matrix(newer)
+                if newer.shape[1]:
+                    matrix = np.hstack([matrix[:, matrix[0] < newer[0, 0]], newer])
+                meta['fetched_at'] = now
+                changed = True
+        except Exception as e:
+            print(f"Error refreshing bar store for {symbol} ({interval}): {e}")
+
+        if changed:
+            _write(symbol, interval, matrix, meta)
+            matrix = np.load(_paths(symbol, interval)[0], mmap_mode='r')
+        return matrix, meta
+
+
+def _to_epoch(value, tz):
+    stamp = pd.Timestamp(value)
+    stamp = stamp.tz_localize(tz) if stamp.tz is None else stamp
+    return stamp.timestamp()
+
+
+def _slice(matrix, meta, interval, period, start, end):
+    timestamps = matrix[0]
+    tz = meta.get('tz') or 'UTC'
+    lo, hi = 0, matrix.shape[1]
+
+    if start is not None or end is not None:
+        if start is not None:
+            lo = np.searchsorted(timestamps, _to_epoch(start, tz), side='left')
+        if end is not None:
+            # Like yfinance, the end date is exclusive
+            hi = np.searchsorted(timestamps, _to_epoch(end, tz), side='left')
+        return matrix[:, lo:hi]
+
+    if period == 'max':
+        return matrix
+
+    # Periods are anchored at the latest stored bar
+    anchor = pd.Timestamp(timestamps[-1], unit='s', tz='UTC').tz_convert(tz)
+    if period == 'ytd':
+        lo = np.searchsorted(timestamps, pd.Timestamp(year=anchor.year, month=1, day=1, tz=tz).timestamp(), side='left')
+        return matrix[:, lo:]
+
+    count, unit = _period_offset(period)
+    if count is None:
+        count, unit = 1, 'mo'
+    if unit == 'd' and not _is_intraday(interval):
+        return matrix[:, max(hi - count, 0):]
+    if unit == 'd':
+        begin = anchor - timedelta(days=count)
+    elif unit == 'wk':
+        begin = anchor - timedelta(weeks=count)
+    elif unit == 'mo':
+        begin = anchor - pd.DateOffset(months=count)
+    else:
+        begin = anchor - pd.DateOffset(years=count)
+    lo = np.searchsorted(timestamps, begin.timestamp(), side='right')
+    return matrix[:, lo:]
+
+
+def sidecar_path(symbol, interval, name, ext='json'):
+    """Path of a file kept next to a symbol's bars (e.g. indicator checkpoints)"""
+    return _paths(symbol, interval)[1][:-len('.json')] + f'.{name}.{ext}'
+
+
+def stored_symbols(interval='1d'):
+    """Symbols with bars in the store for an interval (as originally requested)"""
+    directory = os.path.join(BAR_STORE_DIR, interval)
+    if not os.path.isdir(directory):
+        return []
+    symbols = []
+    for name in sorted(os.listdir(directory)):
+        base, ext = os.path.splitext(name)
+        # Series metadata sits next to its bars (sidecars carry no fetch time)
+        if ext != '.json' or not os.path.exists(os.path.join(directory, base + '.npy')):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if 'fetched_at' in meta:
+            symbols.append(meta.get('symbol') or base)
+    return symbols
+
+
+def stored_bars(symbol, interval='1d'):
+    """
+    Get the stored bar matrix for a symbol without contacting upstream
+
+    Returns:
+        Tuple of (matrix, tz) like get_bars, or (None, None) if nothing is stored
+    """
+    matrix, meta = _load(symbol, interval)
+    if matrix is None or matrix.shape[1] == 0:
+        return None, None
+    return matrix, meta.get('tz')
+
+
+def get_bars(symbol, period='1y', interval='1d'):
+    """
+    Get the raw stored bar matrix for a symbol, synced to cover at least period
+
+    Returns:
+        Tuple of (matrix, tz): the full memory-mapped 6 x N matrix (timestamp,
+        open, high, low, close, volume) and the exchange timezone, or
+        (None, None) if no data is available
+    """
+    if not symbol:
+        return None, None
+    matrix, meta = _sync(symbol, interval, period, None)
+    if matrix is None or matrix.shape[1] == 0:
+        return None, None
+    return matrix, meta.get('tz')
+
+
+def get_history(symbol, period=None, interval='1d', start=None, end=None):
+    """
+    Get OHLCV history for a symbol through the local bar store
+
+    Args:
+        symbol: Stock ticker symbol
+        period: Time period to return (1d, 5d, 1mo, 3mo, 6mo, 1y, 2y, 5y, 10y, ytd, max).
+            Daily periods such as '5d' count trading sessions.
+        interval: Bar interval (1m, 5m, 1h, 1d, 1wk, ...)
+        start: Optional start date (inclusive), takes precedence over period
+        end: Optional end date (exclusive)
+
+    Returns:
+        DataFrame indexed by exchange-local timestamps with Open, High, Low,
+        Close and Volume columns (empty if no data is available)
+    """
+    if not symbol:
+        return pd.DataFrame(columns=COLUMNS)
+    if period is None and start is None:
+        period = '1mo'
+
+    matrix, meta = _sync(symbol, interval, period, start)
+    if matrix is None or matrix.shape[1] == 0:
+        return pd.DataFrame(columns=COLUMNS)
+
+    return _matrix_to_frame(_slice(matrix, meta, interval, period, start, end), meta.get('tz'))
+
+
+# Periods accepted by bulk downloads, with the calendar days each surely covers
+_DOWNLOAD_PERIODS = [('5d', 5), ('1mo', 28), ('3mo', 89), ('6mo', 181), ('1y', 365), ('2y', 730), ('5y', 1826)]
+
+
+def _bulk_refresh(symbols, interval):
+    """
+    Append new bars to stale stored series with one multi-symbol download
+
+    Only series that already cover their history are refreshed here; the
+    download must reach back to the completed bar before each series' last
+    stored bar so no gap is left and re-adjusted histories are noticed.
+    Those are left to the per-symbol sync. Returns the symbols that were
+    refreshed.
+    """
+    now = time.time()
+    stale = {}
+    for symbol in symbols:
+        matrix, meta = _load(symbol, interval)
+        if matrix is not None and matrix.shape[1] and now - meta.get('fetched_at', 0) >= _refresh_seconds(interval):
+            stale[symbol] = float(matrix[0, max(matrix.shape[1] - 2, 0)])
+    if not stale:
+        return set()
+
+    # Smallest upstream period reaching back to the oldest overlapping bar
+    days = (now - min(stale.values())) / 86400 + 1
+    period = next((name for name, span in _DOWNLOAD_PERIODS if span >= days), 'max')
+    try:
+        frame = get_provider().download(list(stale), period=period, interval=interval)
+    except Exception as e:
+        print(f"Error downloading bars for {len(stale)} symbols ({interval}): {e}")
+        return set()
+    if frame is None or frame.empty:
+        return set()
+
+    refreshed = set()
+    for symbol in stale:
+        try:
+            hist = pd.DataFrame({col: frame[col][symbol] for col in COLUMNS}).dropna(subset=['Close'])
+        except KeyError:
+            continue
+        with _get_lock((symbol.upper(), interval)):
+            matrix, meta = _load(symbol, interval)
+            if matrix is None or not matrix.shape[1]:
+                continue
+            # Bulk downloads are exchange-local and timezone-naive
+            if hist.index.tz is None:
+                hist.index = hist.index.tz_localize(meta.get('tz') or 'UTC')
+            newer = _frame_to_matrix(hist)
+            if newer.shape[1] == 0 or newer[0, 0] > matrix[0, -1]:
+                continue  # Would leave a gap; the per-symbol sync fetches it
+            if _revised(matrix, newer):
+                continue  # Re-adjusted upstream; the per-symbol sync rewrites it
+            matrix = np.hstack([matrix[:, matrix[0] < newer[0, 0]], newer])
+            meta['fetched_at'] = now
+            _write(symbol, interval, matrix, meta)
+            refreshed.add(symbol)
+    return refreshed
+
+
+def get_histories(symbols, period='1mo', interval='1d'):
+    """
+    Get OHLCV histories for several symbols through the local bar store
+
+    Stale daily series are brought up to date with one multi-symbol
+    download; symbols not stored yet (or needing older bars) are synced
+    individually on a small thread pool.
+
+    Args:
+        symbols: Stock ticker symbols
+        period: Time period to return for each symbol (see get_history)
+        interval: Bar interval
+
+    Returns:
+        Dictionary mapping each symbol to its history DataFrame (empty if no
+        data is available)
+    """
+    symbols = list(dict.fromkeys(symbol for symbol in symbols if symbol))
+    if not symbols:
+        return {}
+    if not _is_intraday(interval):
+        _bulk_refresh(symbols, interval)
+
+    def load(symbol):
+        try:
+            return get_history(symbol, period=period, interval=interval)
+        except Exception as e:
+            print(f"Error getting history for {symbol}: {e}")
+            return pd.DataFrame(columns=COLUMNS)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(FETCH_WORKERS, len(symbols))) as executor:
+        return dict(zip(symbols, executor.map(load, symbols)))
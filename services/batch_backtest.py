@@ -0,0 +1,311 @@
+"""
+Batch backtests across a universe of symbols.
+
+Histories are fetched through the bar store on a thread pool, packed into
+shared memory blocks of the price fields the strategy reads and scored by a pool of worker
+processes, so price arrays are never pickled. Results are yielded per symbol
+as soon as their block finishes, followed by a cross-sectional summary.
+
+    python -m services.batch_backtest sma_crossover AAPL MSFT NVDA --start 2015-01-01
+    python -m services.batch_backtest rsi --symbols-file nifty50.txt --param rsi_period=10
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import multiprocessing
+import concurrent.futures
+from multiprocessing import shared_memory
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from services import backtest_engine
+from services.bar_store import get_history
+from services.strategy_service import get_predefined_strategies
+from services.symbol_resolver import resolve_many, normalize
+from services.trade_ledger import span_years
+
+# Worker processes scoring symbols (defaults to one per core)
+WORKERS = int(os.environ.get('BATCH_BACKTEST_WORKERS', 0)) or os.cpu_count() or 1
+
+# Threads downloading histories while earlier blocks are scored
+FETCH_WORKERS = int(os.environ.get('BATCH_BACKTEST_FETCH_WORKERS', 8))
+
+# Symbols packed into one shared memory block (one worker task)
+BLOCK_SYMBOLS = 16
+
+# Largest universe accepted by one batch
+MAX_SYMBOLS = 2000
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Workers are started by a fork server that has only imported the
+            # engine. Forking the web process itself would copy locks held by
+            # its background threads into the children.
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            if 'forkserver' in methods:
+                context.set_forkserver_preload(['services.backtest_engine'])
+            _pool = concurrent.futures.ProcessPoolExecutor(max_workers=WORKERS, mp_context=context)
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def strategy_grid(strategy_type, parameters):
+    """
+    One-setting parameter grid for a predefined strategy
+
+    Raises:
+        ValueError: If the strategy or a parameter is not supported
+    """
+    strategy = next((s for s in get_predefined_strategies() if s['id'] == strategy_type), None)
+    if strategy is None:
+        raise ValueError(f'Unknown strategy type: {strategy_type}')
+    if strategy_type not in backtest_engine.BUILDERS:
+        raise ValueError(f'Strategy {strategy_type} cannot be run in batch')
+    parameters = parameters or {}
+    unknown = set(parameters) - set(strategy['parameters'])
+    if unknown:
+        raise ValueError(f"Unknown parameters: {', '.join(sorted(unknown))}")
+    grid = {}
+    for name, spec in strategy['parameters'].items():
+        value = parameters.get(name)
+        if isinstance(value, (dict, list, tuple)):
+            raise ValueError(f'{name} must be a single value')
+        grid[name] = backtest_engine.parameter_values(spec, value)
+    return grid
+
+
+def _fetch(symbol, start_date, end_date, fields=('close',)):
+    data = get_history(symbol, start=start_date, end=end_date)
+    if data.empty:
+        return None
+    close = data['Close'].to_numpy(dtype=np.float64)
+    keep = np.isfinite(close)
+    if not keep.any():
+        return None
+    dates = data.index[keep]
+    years = span_years(dates[0], dates[-1])
+    # (field x bar) matrix of the fields the strategy reads, close first
+    prices = np.stack([data[field.capitalize()].to_numpy(dtype=np.float64)[keep] for field in fields])
+    return prices, dates[0].strftime('%Y-%m-%d'), dates[-1].strftime('%Y-%m-%d'), years
+
+
+def _pack(series):
+    """Copy ((field x bar) prices, years) pairs into a new shared memory block"""
+    size = sum(prices.shape[1] for prices, _ in series)
+    rows = series[0][0].shape[0] if series else 1
+    block = shared_memory.SharedMemory(create=True, size=max(size * rows, 1) * 8)
+    packed = np.ndarray((rows, size), dtype=np.float64, buffer=block.buf)
+    layout = []
+    offset = 0
+    for prices, years in series:
+        length = prices.shape[1]
+        packed[:, offset:offset + length] = prices
+        layout.append((offset, length, years))
+        offset += length
+    del packed
+    return block, layout
+
+
+def summarize(results, elapsed=None):
+    """
+    Cross-sectional summary of per-symbol batch results
+
+    Args:
+        results: Per-symbol records yielded by ``batch_backtest``
+        elapsed: Optional wall time of the batch in seconds
+
+    Returns:
+        Dictionary with counts, mean/median metrics and the best and worst symbols
+    """
+    scored = [r for r in results if 'metrics' in r]
+    summary = {
+        'type': 'summary',
+        'symbols': len(results),
+        'completed': len(scored),
+        'failed': len(results) - len(scored),
+    }
+    if elapsed is not None:
+        summary['elapsed_seconds'] = round(elapsed, 3)
+    if not scored:
+        return summary
+
+    returns = np.array([r['metrics']['total_return'] for r in scored])
+    buy_hold = np.array([r['metrics']['buy_hold_return'] for r in scored])
+    drawdowns = np.array([r['metrics']['max_drawdown'] for r in scored])
+    win_rates = np.array([r['metrics']['win_rate'] for r in scored])
+    sharpe = np.array([r['metrics']['sharpe_ratio'] for r in scored])
+    order = np.argsort(-returns, kind='stable')
+    summary.update({
+        'mean_return': float(returns.mean()),
+        'median_return': float(np.median(returns)),
+        'std_return': float(returns.std()),
+        'mean_buy_hold_return': float(buy_hold.mean()),
+        'mean_max_drawdown': float(drawdowns.mean()),
+        'mean_win_rate': float(win_rates.mean()),
+        'mean_sharpe_ratio': float(sharpe.mean()),
+        'positive_fraction': float((returns > 0).mean()),
+        'beat_buy_hold_fraction': float((returns > buy_hold).mean()),
+        'best': [{'symbol': scored[i]['symbol'], 'total_return': float(returns[i])} for i in order[:5]],
+        'worst': [{'symbol': scored[i]['symbol'], 'total_return': float(returns[i])} for i in order[::-1][:5]],
+    })
+    return summary
+
+
+def batch_backtest(symbols, strategy_type, parameters, start_date=None, end_date=None):
+    """
+    Backtest one strategy setting across many symbols
+
+    The strategy and parameters are validated before anything is fetched.
+
+    Args:
+        symbols: List of user-entered symbols
+        strategy_type: Predefined strategy id
+        parameters: Dictionary of strategy parameters (defaults for omitted ones)
+        start_date: Start date for backtesting
+        end_date: End date for backtesting
+
+    Returns:
+        Generator of per-symbol records ({'type': 'result', ...}) in completion
+        order, ending with one {'type': 'summary', ...} record
+
+    Raises:
+        ValueError: If the strategy, parameters or symbol list are invalid
+    """
+    grid = strategy_grid(strategy_type, parameters)
+    fields = backtest_engine.price_fields(strategy_type, grid)
+    symbols = list(dict.fromkeys(normalize(s) for s in symbols or [] if normalize(s)))
+    if not symbols:
+        raise ValueError('No symbols given')
+    if len(symbols) > MAX_SYMBOLS:
+        raise ValueError(f'Too many symbols ({len(symbols)}, limit {MAX_SYMBOLS})')
+    return _run(symbols, strategy_type, grid, fields, start_date, end_date)
+
+
+def _run(symbols, strategy_type, grid, fields, start_date, end_date):
+    started = time.time()
+    parameters = {name: values[0] for name, values in grid.items()}
+    resolved = resolve_many(symbols)
+    results = []
+
+    def emit(record):
+        record = dict(record, type='result', strategy=strategy_type, parameters=parameters)
+        results.append(record)
+        return record
+
+    pool = _get_pool()
+    blocks = {}
+    fetches = {}
+    ready = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=FETCH_WORKERS) as fetcher:
+        for symbol in symbols:
+            listed = resolved.get(symbol) or symbol
+            fetches[fetcher.submit(_fetch, listed, start_date, end_date, fields)] = (symbol, listed)
+
+        pending = set(fetches)
+        try:
+            while pending:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    if future in fetches:
+                        symbol, listed = fetches.pop(future)
+                        try:
+                            fetched = future.result()
+                        except Exception as e:
+                            print(f"Error fetching data for {listed}: {e}")
+                            fetched = None
+                        if fetched is None:
+                            yield emit({'symbol': listed, 'input': symbol, 'error': 'No data available for this symbol and date range'})
+                        else:
+                            ready.append((listed, symbol) + fetched)
+                        continue
+
+                    block, batch = blocks.pop(future)
+                    try:
+                        scores = future.result()
+                    except Exception as e:
+                        print(f"Error in batch backtest worker: {e}")
+                        scores = [None] * len(batch)
+                        if isinstance(e, BrokenProcessPool):
+                            _reset_pool()
+                            pool = _get_pool()
+                    finally:
+                        block.close()
+                        block.unlink()
+                    for (listed, symbol, prices, first, last, _), metrics in zip(batch, scores):
+                        record = {'symbol': listed, 'input': symbol, 'bars': prices.shape[1], 'start_date': first, 'end_date': last}
+                        if metrics is None:
+                            record['error'] = 'Backtest failed'
+                        else:
+                            record['metrics'] = metrics
+                        yield emit(record)
+
+                # Hand full blocks to the workers, and the remainder once fetching is over
+                fetching = bool(fetches)
+                while len(ready) >= BLOCK_SYMBOLS or (ready and not fetching):
+                    batch, ready = ready[:BLOCK_SYMBOLS], ready[BLOCK_SYMBOLS:]
+                    block, layout = _pack([(item[2], item[5]) for item in batch])
+                    future = pool.submit(backtest_engine.score_shared, block.name, layout, strategy_type, grid, fields)
+                    blocks[future] = (block, batch)
+                    pending.add(future)
+        finally:
+            # Abandoned generator (e.g. client disconnected): release every block
+            for future, (block, _) in blocks.items():
+                future.cancel()
+                block.close()
+                block.unlink()
+
+    yield summarize(results, time.time() - started)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Backtest one strategy across many symbols (NDJSON output)')
+    parser.add_argument('strategy', help='predefined strategy id, e.g. sma_crossover')
+    parser.add_argument('symbols', nargs='*', help='symbols to backtest')
+    parser.add_argument('--symbols-file', help='file with one symbol per line')
+    parser.add_argument('--param', action='append', default=[], metavar='NAME=VALUE',
+                        help='strategy parameter (repeatable)')
+    parser.add_argument('--start', dest='start_date')
+    parser.add_argument('--end', dest='end_date')
+    parser.add_argument('--workers', type=int, help='worker processes (default: one per core)')
+    args = parser.parse_args(argv)
+
+    global WORKERS
+    if args.workers:
+        WORKERS = args.workers
+
+    symbols = list(args.symbols)
+    if args.symbols_file:
+        with open(args.symbols_file) as f:
+            symbols.extend(line.split('#')[0].strip() for line in f)
+    parameters = dict(item.split('=', 1) for item in args.param)
+
+    try:
+        records = batch_backtest(symbols, args.strategy, parameters, args.start_date, args.end_date)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    for record in records:
+        print(json.dumps(record), flush=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
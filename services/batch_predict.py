@@ -0,0 +1,187 @@
+"""
+Predictions for a whole watchlist in one pass.
+
+Histories come from the bar store, with stale symbols refreshed by a single
+bulk download. Indicators are computed for every symbol at once on
+(bar x symbol) arrays, grouped by history length so each column sees
+exactly the bars a single prediction would, and model features are read
+from the feature store. With a published universe model every symbol's
+latest features are scored in one inference call; otherwise each symbol's
+direction model comes from the model registry, so symbols predicted before
+skip training. The factors, model view and scoring are the ones
+``predict_stock`` uses, so a batch agrees with single predictions. LLM
+explanations are slow and cost tokens, so they are only generated for the
+symbols asked for.
+"""
+import os
+import concurrent.futures
+
+import numpy as np
+
+from services import universe_model
+from services.bar_store import get_histories
+from services.indicator_state import latest_indicators
+from services.feature_store import indicator_values, get_features, latest_rows
+from services.prediction_service import (mean_change, direction_target, technical_factors,
+                                         model_view, model_factors, score, explain)
+from services.symbol_resolver import resolve_many, normalize
+
+# Largest watchlist accepted by one batch
+MAX_SYMBOLS = int(os.environ.get('BATCH_PREDICT_MAX_SYMBOLS', 100))
+
+# Bars each prediction looks at (the same window as predict_stock)
+HISTORY_SESSIONS = 120
+
+# Threads waiting on model fits and explanations (fits themselves are
+# bounded by the model registry's pool)
+WORKERS = int(os.environ.get('BATCH_PREDICT_WORKERS', 8))
+
+
+def _score_group(listed, histories):
+    """Factors and model inputs of symbols sharing a history length, computed together"""
+    close = np.column_stack([histories[symbol]['Close'].to_numpy(dtype=np.float64) for symbol in listed])
+    volume = np.column_stack([histories[symbol]['Volume'].to_numpy(dtype=np.float64) for symbol in listed])
+    values = indicator_values(close)
+    target = direction_target(close)
+    price_changes = mean_change(close)
+    volume_changes = mean_change(volume)
+
+    scored = {}
+    for j, symbol in enumerate(listed):
+        hist = histories[symbol]
+        current_price = hist['Close'].iloc[-1]
+        # Same checkpointed values as single predictions, falling back to the batch's own
+        latest = latest_indicators(symbol) or {}
+        rsi = latest.get('rsi14', values['rsi'][-1, j])
+        factors = technical_factors(
+            current_price,
+            latest.get('sma20', values['sma20'][-1, j]),
+            latest.get('sma50', values['sma50'][-1, j]),
+            rsi,
+            latest.get('macd', values['macd'][-1, j]),
+            latest.get('macd_signal', values['signal'][-1, j]),
+            latest.get('bb_upper', values['upper'][-1, j]),
+            latest.get('bb_lower', values['lower'][-1, j]),
+            price_changes[j],
+            volume_changes[j]
+        )
+        scored[symbol] = {
+            'current_price': current_price,
+            'as_of': hist.index[-1].strftime('%Y-%m-%d'),
+            'factors': factors,
+            'rsi': rsi,
+            'price_changes': price_changes[j],
+            'index': hist.index,
+            'target': target[:, j],
+        }
+    return scored
+
+
+def _add_universe_views(scored):
+    """
+    Score every symbol's latest stored features with one universe model call
+
+    Returns:
+        False if no universe model is published
+    """
+    if universe_model.current() is None:
+        return False
+    symbols, rows, _ = latest_rows(list(scored))
+    complete = np.isfinite(rows).all(axis=1)
+    symbols = [symbol for symbol, ok in zip(symbols, complete) if ok]
+    if not symbols:
+        return True
+    for symbol, ml_prediction, ml_probability in zip(symbols, *universe_model.predict(rows[complete])):
+        item = scored[symbol]
+        factors, _ = model_factors(int(ml_prediction), float(ml_probability), item['rsi'], item['price_changes'])
+        item['factors'].extend(factors)
+    return True
+
+
+def _add_model_view(symbol, item):
+    try:
+        features = get_features(symbol, start=item['index'][0]).reindex(item['index']).to_numpy()
+        view = model_view(symbol, item['as_of'], features, item['target'])
+        if view is not None:
+            factors, _ = model_factors(*view, item['rsi'], item['price_changes'])
+            item['factors'].extend(factors)
+    except Exception as e:
+        # If ML fails, don't add ML factor
+        print(f"Error in machine learning prediction for {symbol}: {e}")
+
+
+def predict_many(symbols, explain_symbols=False):
+    """
+    Predict the movement of several stocks at once
+
+    Args:
+        symbols: User-entered stock symbols
+        explain_symbols: True to explain every prediction with the LLM, or a
+            list of the (user-entered) symbols to explain; False for none
+
+    Returns:
+        Dictionary with 'predictions': one entry per symbol in input order,
+        holding the prediction, confidence and analysis factors (plus
+        'explanation' when asked for) or an 'error' key
+
+    Raises:
+        ValueError: If no symbols or more than MAX_SYMBOLS are given
+    """
+    inputs = list(dict.fromkeys(normalize(symbol) for symbol in symbols or [] if normalize(symbol)))
+    if not inputs:
+        raise ValueError('No symbols given')
+    if len(inputs) > MAX_SYMBOLS:
+        raise ValueError(f'Too many symbols (limit {MAX_SYMBOLS})')
+    if explain_symbols is True:
+        explained = set(inputs)
+    else:
+        explained = {normalize(symbol) for symbol in explain_symbols or []}
+
+    # Map inputs to listed symbols (e.g. adds .NS for Indian stocks), then read every history
+    resolved = resolve_many(inputs)
+    listed_symbols = list(dict.fromkeys(resolved[symbol] for symbol in inputs if resolved.get(symbol)))
+    # A year keeps the store covering what the indicator checkpoints read
+    histories = {symbol: hist.iloc[-HISTORY_SESSIONS:]
+                 for symbol, hist in get_histories(listed_symbols, period='1y').items() if len(hist) > 1}
+
+    # Symbols with the same number of bars are computed as one matrix
+    groups = {}
+    for symbol in histories:
+        groups.setdefault(len(histories[symbol]), []).append(symbol)
+    scored = {}
+    for listed in groups.values():
+        scored.update(_score_group(listed, histories))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        # One inference pass with the universe model, else each symbol's own model
+        if not _add_universe_views(scored):
+            list(executor.map(lambda symbol: _add_model_view(symbol, scored[symbol]), scored))
+
+        predictions = []
+        explanations = {}
+        for symbol in inputs:
+            listed = resolved.get(symbol)
+            item = scored.get(listed)
+            if item is None:
+                predictions.append({'symbol': symbol, 'error': f'No data available for {symbol}'})
+                continue
+            prediction, confidence = score(item['factors'])
+            entry = {
+                'symbol': symbol,
+                'listed_symbol': listed,
+                'current_price': item['current_price'],
+                'prediction': prediction,
+                'confidence': confidence,
+                'analysis_factors': item['factors'],
+                'as_of': item['as_of'],
+            }
+            if symbol in explained:
+                explanations[symbol] = executor.submit(explain, listed, item['current_price'], item['factors'],
+                                                       prediction, confidence, item['as_of'])
+            predictions.append(entry)
+
+        for entry in predictions:
+            if entry['symbol'] in explanations:
+                entry['company_name'], entry['explanation'] = explanations[entry['symbol']].result()
+
+    return {'predictions': predictions}
@@ -0,0 +1,396 @@
+"""
+Shared caching subsystem.
+
+A ``Cache`` keeps values in a bounded store (LRU eviction by entry count and
+approximate byte size) under named namespaces, each with its own TTL. Expired
+entries are still served for a grace period while a single background refresh
+recomputes them (stale-while-revalidate), so callers never wait on upstream
+at TTL boundaries. Hit, miss, stale and eviction counters are kept per
+namespace.
+
+Two stores are available, selected with CACHE_BACKEND: 'memory' (per
+process) and 'sqlite', a file shared by every worker process on the host so
+a value computed by one gunicorn worker is reused by all of them.
+"""
+import os
+import json
+import time
+import uuid
+import pickle
+import sqlite3
+import threading
+import functools
+import concurrent.futures
+from collections import OrderedDict
+
+from services import DATA_DIR
+from services.singleflight import get_group
+
+DEFAULT_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 2048))
+DEFAULT_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES', 64 * 1024 * 1024))
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+CACHE_PATH = os.environ.get('CACHE_PATH', os.path.join(DATA_DIR, 'cache.sqlite'))
+
+# How long a process may hold the right to compute a key before others take over
+LEASE_SECONDS = 60
+
+# Default per-namespace settings: (ttl seconds, extra seconds stale values may be served)
+NAMESPACES = {
+    'news': (1800, 3600),
+    'sentiment': (1800, 3600),
+    'quotes': (60, 0),
+    'info': (300, 900),
+}
+
+
+def make_key(args=(), kwargs=None):
+    """Build a canonical cache key from call arguments"""
+    return json.dumps([list(args), sorted((kwargs or {}).items())], default=repr, separators=(',', ':'))
+
+
+def _estimate_size(value):
+    try:
+        return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return 1024
+
+
+class MemoryStore:
+    """In-process LRU store bounded by entry count and byte budget"""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        """Return (value, stored_at) or None, marking the entry as recently used"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0], entry[1]
+
+    def set(self, key, value, stored_at):
+        size = _estimate_size(value)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, stored_at, size)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted[2]
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def acquire_lease(self, key, seconds=LEASE_SECONDS):
+        """Claim the right to compute key; in-process callers are coalesced by single-flight"""
+        return True
+
+    def release_lease(self, key):
+        pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': 'memory',
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'evictions': self.evictions
+            }
+
+
+class SQLiteStore:
+    """
+    LRU store in a SQLite file shared by all processes on the host
+
+    Values are pickled. Least recently used rows are evicted when the entry
+    count or total byte size exceeds its budget. Leases let one process
+    compute a missing or expired key while the others wait for its result.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._token = uuid.uuid4().hex
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''CREATE TABLE IF NOT EXISTS cache_entries (
+                            key TEXT PRIMARY KEY,
+                            value BLOB NOT NULL,
+                            stored_at REAL NOT NULL,
+                            accessed_at REAL NOT NULL,
+                            size INTEGER NOT NULL)''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_cache_entries_accessed ON cache_entries (accessed_at)')
+        conn.execute('''CREATE TABLE IF NOT EXISTS cache_leases (
+                            key TEXT PRIMARY KEY,
+                            owner TEXT NOT NULL,
+                            expires_at REAL NOT NULL)''')
+        conn.commit()
+
+    @property
+    def _owner(self):
+        return f"{os.getpid()}:{self._token}"
+
+    def _connection(self):
+        # Connections must not be shared across a fork (gunicorn preload)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        conn = self._connection()
+        row = conn.execute('SELECT value, stored_at, accessed_at FROM cache_entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        # Only touch the LRU clock occasionally to keep reads cheap
+        if now - row[2] > 5:
+            conn.execute('UPDATE cache_entries SET accessed_at = ? WHERE key = ?', (now, key))
+            conn.commit()
+        try:
+            return pickle.loads(row[0]), row[1]
+        except Exception:
+            return None
+
+    def set(self, key, value, stored_at):
+        try:
+            blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            print(f"Error serializing cache entry {key}: {e}")
+            return
+        if len(blob) > self.max_bytes:
+            return
+        conn = self._connection()
+        conn.execute('INSERT OR REPLACE INTO cache_entries (key, value, stored_at, accessed_at, size) VALUES (?, ?, ?, ?, ?)',
+                     (key, sqlite3.Binary(blob), stored_at, time.time(), len(blob)))
+        count, total = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries').fetchone()
+        while count > self.max_entries or total > self.max_bytes:
+            oldest = conn.execute('SELECT key, size FROM cache_entries ORDER BY accessed_at LIMIT 1').fetchone()
+            if oldest is None:
+                break
+            conn.execute('DELETE FROM cache_entries WHERE key = ?', (oldest[0],))
+            count -= 1
+            total -= oldest[1]
+            self.evictions += 1
+        conn.commit()
+
+    def delete(self, key):
+        conn = self._connection()
+        conn.execute('DELETE FROM cache_entries WHERE key = ?', (key,))
+        conn.commit()
+
+    def clear(self):
+        conn = self._connection()
+        conn.execute('DELETE FROM cache_entries')
+        conn.commit()
+
+    def acquire_lease(self, key, seconds=LEASE_SECONDS):
+        """Claim the right to compute key across processes; False if another process holds it"""
+        conn = self._connection()
+        now = time.time()
+        with conn:
+            conn.execute('DELETE FROM cache_leases WHERE key = ? AND expires_at < ?', (key, now))
+            cursor = conn.execute('INSERT OR IGNORE INTO cache_leases (key, owner, expires_at) VALUES (?, ?, ?)',
+                                  (key, self._owner, now + seconds))
+        return cursor.rowcount == 1
+
+    def release_lease(self, key):
+        conn = self._connection()
+        with conn:
+            conn.execute('DELETE FROM cache_leases WHERE key = ? AND owner = ?', (key, self._owner))
+
+    def stats(self):
+        count, total = self._connection().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries').fetchone()
+        return {
+            'backend': 'sqlite',
+            'path': self.path,
+            'entries': count,
+            'bytes': total,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'evictions': self.evictions
+        }
+
+
+def create_store(backend=CACHE_BACKEND):
+    """Create the cache store named by CACHE_BACKEND ('memory' or 'sqlite')"""
+    if backend == 'sqlite':
+        return SQLiteStore()
+    if backend != 'memory':
+        raise ValueError(f'Unknown cache backend: {backend}')
+    return MemoryStore()
+
+
+class Cache:
+    """Namespaced TTL cache with stale-while-revalidate on top of a bounded store"""
+
+    def __init__(self, store=None, namespaces=None, refresh_workers=4):
+        self.store = store if store is not None else MemoryStore()
+        self._namespaces = dict(NAMESPACES)
+        self._namespaces.update(namespaces or {})
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._refresher = concurrent.futures.ThreadPoolExecutor(max_workers=refresh_workers,
+                                                                thread_name_prefix='cache-refresh')
+
+    def configure(self, namespace, ttl, stale_ttl=0):
+        """Set the TTL and stale grace period (seconds) for a namespace"""
+        self._namespaces[namespace] = (ttl, stale_ttl)
+
+    def _settings(self, namespace):
+        return self._namespaces.get(namespace, (300, 0))
+
+    def _count(self, namespace, counter):
+        with self._lock:
+            counters = self._counters.setdefault(namespace, {'hits': 0, 'stale_hits': 0, 'misses': 0, 'refreshes': 0, 'refresh_errors': 0})
+            counters[counter] += 1
+
+    def _lookup(self, namespace, key):
+        """Return (value, age) for a stored entry or None"""
+        entry = self.store.get(f"{namespace}:{key}")
+        if entry is None:
+            return None
+        value, stored_at = entry
+        return value, time.time() - stored_at
+
+    def get(self, namespace, key, default=None):
+        """Get a fresh value, or default if missing or expired"""
+        ttl, _ = self._settings(namespace)
+        entry = self._lookup(namespace, key)
+        if entry is None or entry[1] >= ttl:
+            self._count(namespace, 'misses')
+            return default
+        self._count(namespace, 'hits')
+        return entry[0]
+
+    def peek(self, namespace, key):
+        """Return (value, age in seconds) regardless of TTL, or None; not counted in stats"""
+        return self._lookup(namespace, key)
+
+    def set(self, namespace, key, value):
+        self.store.set(f"{namespace}:{key}", value, time.time())
+
+    def delete(self, namespace, key):
+        self.store.delete(f"{namespace}:{key}")
+
+    def _compute(self, namespace, key, should_cache, compute, args, kwargs, wait=True):
+        full_key = f"{namespace}:{key}"
+        ttl, _ = self._settings(namespace)
+
+        # Another process may already be computing this key; wait for its result
+        deadline = time.time() + LEASE_SECONDS
+        while not self.store.acquire_lease(full_key):
+            if not wait:
+                return None
+            time.sleep(0.05)
+            entry = self.store.get(full_key)
+            if entry is not None and time.time() - entry[1] < ttl:
+                return entry[0]
+            if time.time() > deadline:
+                break
+
+        try:
+            value = compute(*args, **kwargs)
+            if should_cache is None or should_cache(value):
+                self.set(namespace, key, value)
+            return value
+        finally:
+            self.store.release_lease(full_key)
+
+    def _refresh(self, namespace, key, should_cache, compute, args, kwargs):
+        try:
+            # Skip the refresh if another process is already doing it
+            self._compute(namespace, key, should_cache, compute, args, kwargs, wait=False)
+            self._count(namespace, 'refreshes')
+        except Exception as e:
+            self._count(namespace, 'refresh_errors')
+            print(f"Error refreshing cache entry {namespace}:{key}: {e}")
+
+    def get_or_compute(self, namespace, key, compute, *args, should_cache=None, **kwargs):
+        """
+        Get a cached value, computing it on a miss
+
+        Fresh entries are returned directly. Expired entries within the stale
+        grace period are returned immediately while one background refresh
+        runs. Misses are computed once per key, with concurrent callers
+        sharing the result.
+
+        Args:
+            namespace: Cache namespace (selects TTL settings)
+            key: Key within the namespace
+            compute: Function producing the value, called with *args/**kwargs
+            should_cache: Optional predicate deciding whether a result is stored
+
+        Returns:
+            The cached or computed value
+        """
+        ttl, stale_ttl = self._settings(namespace)
+        flight = get_group(f"cache:{namespace}")
+        full_key = f"{namespace}:{key}"
+
+        entry = self._lookup(namespace, key)
+        if entry is not None:
+            value, age = entry
+            if age < ttl:
+                self._count(namespace, 'hits')
+                return value
+            if age < ttl + stale_ttl:
+                self._count(namespace, 'stale_hits')
+                if not flight.in_flight(full_key):
+                    self._refresher.submit(flight.do, full_key, self._refresh, namespace, key,
+                                           should_cache, compute, args, kwargs)
+                return value
+
+        self._count(namespace, 'misses')
+        return flight.do(full_key, self._compute, namespace, key, should_cache, compute, args, kwargs)
+
+    def cached(self, namespace, should_cache=None):
+        """Decorator caching a function's results in a namespace, keyed by its arguments"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                key = f"{func.__name__}:{make_key(args, kwargs)}"
+                return self.get_or_compute(namespace, key, func, *args, should_cache=should_cache, **kwargs)
+            return wrapper
+        return decorator
+
+    def stats(self):
+        with self._lock:
+            namespaces = {name: dict(counters) for name, counters in self._counters.items()}
+        for name, counters in namespaces.items():
+            lookups = counters['hits'] + counters['stale_hits'] + counters['misses']
+            counters['hit_rate'] = round((counters['hits'] + counters['stale_hits']) / lookups, 4) if lookups else 0.0
+        return {'store': self.store.stats(), 'namespaces': namespaces}
+
+
+# Process-wide cache shared by the app and services
+cache = Cache(store=create_store())
@@ -0,0 +1,277 @@
+"""
+Persistent store of the engineered technical features.
+
+The model features (SMA ratios, RSI, MACD difference, Bollinger position,
+volume change and volatility) are derived from the same bars by single
+predictions, batch predictions and universe training. This module computes
+them once per symbol and new bar and keeps them next to the symbol's bars
+as a float32 (feature x bar) ``.npy`` matrix. Every feature is one
+contiguous row, aligned bar for bar with the bar store's matrix.
+
+Updates are incremental. When bars are appended (the bar store notifies
+the store on every write), only the new rows are computed, from a tail of
+WARMUP_BARS earlier bars. That is enough for the windows to fill and for
+the EMA and Wilder recursions to converge far below float32 precision. A
+rewritten history (a backfill, a split adjustment) is recomputed in full;
+a checksum of the stored bars' closes and volumes detects revised bars.
+
+Reads are point in time: a bar's features only use bars up to and
+including it, so slicing rows up to a date gives exactly what was known
+then, for backtests and training. ``latest_rows`` returns the last row of
+many symbols as one matrix for scoring.
+"""
+import os
+import json
+import zlib
+import threading
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from services import indicators
+from services.bar_store import add_listener, stored_bars, sidecar_path
+
+# Engineered features, in stored row (and model column) order
+FEATURES = ['Price_SMA20_Ratio', 'Price_SMA50_Ratio', 'SMA20_SMA50_Ratio',
+            'RSI_Scaled', 'MACD_Signal_Diff', 'Price_BB_Position',
+            'Volume_Change', 'Price_Volatility']
+
+# Earlier bars recomputed with each append so windows and recursions are warm
+WARMUP_BARS = 300
+
+# Intervals kept up to date as bars are written
+INTERVALS = ('1d',)
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def _get_lock(key):
+    with _locks_guard:
+        if key not in _locks:
+            _locks[key] = threading.Lock()
+        return _locks[key]
+
+
+def indicator_values(close):
+    """
+    Indicator series the features (and prediction factors) are built from
+
+    Args:
+        close: Close prices, 1-D or 2-D with one symbol per column
+
+    Returns:
+        Dictionary of sma20, sma50, rsi, macd, signal, upper and lower
+        arrays shaped like ``close``
+    """
+    _, upper, lower = indicators.bollinger(close, 20, 2)
+    macd, signal, _ = indicators.macd(close, 12, 26, 9)
+    return {
+        'sma20': indicators.sma(close, 20),
+        'sma50': indicators.sma(close, 50),
+        'rsi': indicators.rsi(close, 14),
+        'macd': macd,
+        'signal': signal,
+        'upper': upper,
+        'lower': lower,
+    }
+
+
+def pct_change(values, periods=1):
+    """Percent change over ``periods`` bars along axis 0 (NaN for the first bars)"""
+    values = np.asarray(values, dtype=np.float64)
+    change = np.full(values.shape, np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change[periods:] = values[periods:] / values[:-periods] - 1
+    return change
+
+
+def model_features(close, volume, values=None):
+    """
+    Compute the FEATURES from prices
+
+    Args:
+        close: Close prices, 1-D or 2-D with one symbol per column
+        volume: Volumes shaped like ``close``
+        values: Optional ``indicator_values(close)`` already computed
+
+    Returns:
+        Array with one more axis than ``close`` holding the FEATURES in
+        order (NaN until each feature's window is filled)
+    """
+    close = np.asarray(close, dtype=np.float64)
+    volume = np.asarray(volume, dtype=np.float64)
+    values = values or indicator_values(close)
+    with np.errstate(divide='ignore', invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        columns = [
+            close / values['sma20'],
+            close / values['sma50'],
+            values['sma20'] / values['sma50'],
+            values['rsi'] / 100,  # Scale RSI to 0-1
+            values['macd'] - values['signal'],
+            (close - values['lower']) / (values['upper'] - values['lower']),
+            indicators.sma(pct_change(volume, 5), 5),
+            indicators.rolling_std(pct_change(close, 1), 10),
+        ]
+    return np.stack(columns, axis=-1)
+
+
+def _paths(symbol, interval):
+    return sidecar_path(symbol, interval, 'features', 'npy'), sidecar_path(symbol, interval, 'features')
+
+
+def _load(symbol, interval):
+    matrix_path, meta_path = _paths(symbol, interval)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        matrix = np.load(matrix_path, mmap_mode='r')
+    except FileNotFoundError:
+        return None, {}
+    except (OSError, ValueError) as e:
+        print(f"Error reading features for {symbol} ({interval}): {e}")
+        return None, {}
+    # A writer swaps the matrix in before its metadata; treat a mismatch as missing
+    if meta.get('features') != FEATURES or matrix.shape != (len(FEATURES), meta.get('count')):
+        return None, {}
+    return matrix, meta
+
+
+def _write(symbol, interval, matrix, meta):
+    matrix_path, meta_path = _paths(symbol, interval)
+    suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(matrix_path + suffix, 'wb') as f:
+        np.save(f, np.ascontiguousarray(matrix, dtype=np.float32))
+    with open(meta_path + suffix, 'w') as f:
+        json.dump(meta, f)
+    os.replace(matrix_path + suffix, matrix_path)
+    os.replace(meta_path + suffix, meta_path)
+
+
+def _checksum(bars, count):
+    """CRC of the closes and volumes of the first ``count`` bars"""
+    crc = zlib.crc32(np.ascontiguousarray(bars[4, :count]).tobytes())
+    return zlib.crc32(np.ascontiguousarray(bars[5, :count]).tobytes(), crc)
+
+
+def _valid_rows(bars, meta):
+    """Leading stored rows still matching the bars (the last one may have been a forming bar)"""
+    count = meta.get('count', 0)
+    if not count or bars.shape[1] < count or bars[0, 0] != meta.get('first_timestamp') \
+            or bars[0, count - 1] != meta.get('last_timestamp') \
+            or _checksum(bars, count - 1) != meta.get('checksum'):
+        return 0
+    if bars[4, count - 1] != meta.get('last_close') or bars[5, count - 1] != meta.get('last_volume'):
+        return count - 1
+    return count
+
+
+def _update(symbol, interval, bars):
+    """Bring the stored features in line with ``bars``; returns the feature matrix"""
+    bars = np.asarray(bars)
+    total = bars.shape[1]
+    stored, meta = _load(symbol, interval)
+    valid = _valid_rows(bars, meta) if stored is not None else 0
+    if stored is not None and valid == total == meta['count']:
+        return stored
+
+    start = max(valid - WARMUP_BARS, 0)
+    fresh = model_features(bars[4, start:], bars[5, start:]).T[:, valid - start:]
+    matrix = np.hstack([np.asarray(stored[:, :valid]), fresh]) if valid else fresh
+    meta = {
+        'features': FEATURES,
+        'count': total,
+        'first_timestamp': float(bars[0, 0]),
+        'last_timestamp': float(bars[0, -1]),
+        'last_close': float(bars[4, -1]),
+        'last_volume': float(bars[5, -1]),
+        'checksum': _checksum(bars, total - 1),
+    }
+    _write(symbol, interval, matrix, meta)
+    return np.load(_paths(symbol, interval)[0], mmap_mode='r')
+
+
+def _on_bars(symbol, interval, matrix, meta):
+    if interval in INTERVALS and matrix.shape[1]:
+        with _get_lock((symbol.upper(), interval)):
+            _update(symbol, interval, matrix)
+
+
+def feature_matrix(symbol, interval='1d'):
+    """
+    Stored features of a symbol, updated first if its bars have changed
+
+    Never contacts upstream; only bars already in the bar store are used.
+
+    Returns:
+        Tuple of (float32 feature x bar matrix, bar timestamps in UTC epoch
+        seconds, exchange timezone), or (None, None, None) if no bars are stored
+    """
+    bars, tz = stored_bars(symbol, interval)
+    if bars is None:
+        return None, None, None
+    with _get_lock((symbol.upper(), interval)):
+        matrix = _update(symbol, interval, bars)
+    return matrix, np.asarray(bars[0]), tz
+
+
+def get_features(symbol, start=None, end=None, as_of=None, interval='1d'):
+    """
+    Point-in-time features of a symbol
+
+    Args:
+        symbol: Listed symbol (already in the bar store)
+        start: Optional first date (inclusive)
+        end: Optional end date (exclusive)
+        as_of: Optional date; only bars up to and including it are returned
+        interval: Bar interval
+
+    Returns:
+        DataFrame of the FEATURES indexed by exchange-local bar timestamps
+        (empty if no bars are stored)
+    """
+    matrix, timestamps, tz = feature_matrix(symbol, interval)
+    if matrix is None:
+        return pd.DataFrame(columns=FEATURES)
+    tz = tz or 'UTC'
+
+    def epoch(value):
+        stamp = pd.Timestamp(value)
+        return (stamp.tz_localize(tz) if stamp.tz is None else stamp).timestamp()
+
+    lo, hi = 0, len(timestamps)
+    if start is not None:
+        lo = np.searchsorted(timestamps, epoch(start), side='left')
+    if end is not None:
+        hi = np.searchsorted(timestamps, epoch(end), side='left')
+    if as_of is not None:
+        hi = min(hi, np.searchsorted(timestamps, epoch(pd.Timestamp(as_of) + pd.Timedelta(days=1)), side='left'))
+    index = pd.to_datetime(timestamps[lo:hi], unit='s', utc=True).tz_convert(tz)
+    return pd.DataFrame(np.array(matrix[:, lo:hi]).T, index=index, columns=FEATURES)
+
+
+def latest_rows(symbols, interval='1d'):
+    """
+    Last feature row of many symbols, for scoring them in one pass
+
+    Returns:
+        Tuple of (symbols found, float32 (symbols x features) matrix, last
+        bar timestamps); symbols without stored bars are left out
+    """
+    found, rows, stamps = [], [], []
+    for symbol in symbols:
+        matrix, timestamps, _ = feature_matrix(symbol, interval)
+        if matrix is None or not matrix.shape[1]:
+            continue
+        found.append(symbol)
+        rows.append(matrix[:, -1])
+        stamps.append(timestamps[-1])
+    if not found:
+        return [], np.empty((0, len(FEATURES)), dtype=np.float32), np.empty(0)
+    return found, np.stack(rows).astype(np.float32), np.asarray(stamps)
+
+
+# Keep features current as the bar store writes new bars
+add_listener(_on_bars)
@@ -0,0 +1,433 @@
+"""
+Streaming indicator state.
+
+Each state object takes one new value per bar and updates its indicator in
+constant time (ring buffers with running sums for windows, a single
+recursion step for EMA / Wilder smoothing). States are seeded from history
+with the vectorized functions in ``services.indicators`` and serialize to
+plain dictionaries, so the bar store can checkpoint them next to each
+symbol's bars: a refresh then costs one update per new bar rather than a
+pass over the whole history.
+
+The latest bar may still be forming and is replaced on refresh, so
+checkpoints only ever include bars up to the second-to-last one; the last
+bar is applied to a throwaway copy.
+"""
+import os
+import json
+import math
+import threading
+from collections import deque
+
+import numpy as np
+
+from services import indicators
+from services.bar_store import get_bars, sidecar_path
+
+NAN = float('nan')
+
+
+def _finite(value):
+    return value is not None and math.isfinite(value)
+
+
+class SMAState:
+    """Simple moving average over a fixed window"""
+
+    kind = 'sma'
+
+    def __init__(self, window):
+        self.window = window
+        self._values = deque(maxlen=window)
+        self._total = 0.0
+        self._updates = 0
+
+    @property
+    def value(self):
+        return self._total / self.window if len(self._values) == self.window else NAN
+
+    def update(self, x):
+        if len(self._values) == self.window:
+            self._total -= self._values[0]
+        self._values.append(x)
+        self._total += x
+        # Re-sum once per window to stop rounding error from accumulating
+        self._updates += 1
+        if self._updates >= self.window:
+            self._total = math.fsum(self._values)
+            self._updates = 0
+        return self.value
+
+    def seed(self, values):
+        self._values.clear()
+        self._values.extend(float(v) for v in values[-self.window:])
+        self._total = math.fsum(self._values)
+        self._updates = 0
+        return self
+
+    def to_dict(self):
+        return {'kind': self.kind, 'window': self.window, 'values': list(self._values)}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['window']).seed(data['values'])
+
+
+class RollingStdState:
+    """Rolling standard deviation (sliding Welford update)"""
+
+    kind = 'rolling_std'
+
+    def __init__(self, window, ddof=1):
+        self.window = window
+        self.ddof = ddof
+        self._values = deque(maxlen=window)
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._updates = 0
+
+    @property
+    def value(self):
+        if len(self._values) < self.window or self.window <= self.ddof:
+            return NAN
+        return math.sqrt(max(self._m2, 0.0) / (self.window - self.ddof))
+
+    def _recompute(self):
+        values = np.fromiter(self._values, dtype=np.float64, count=len(self._values))
+        self._mean = float(values.mean()) if len(values) else 0.0
+        self._m2 = float(((values - self._mean) ** 2).sum())
+        self._updates = 0
+
+    def update(self, x):
+        if len(self._values) < self.window:
+            # Growing window: standard Welford step
+            self._values.append(x)
+            delta = x - self._mean
+            self._mean += delta / len(self._values)
+            self._m2 += delta * (x - self._mean)
+        else:
+            old = self._values[0]
+            self._values.append(x)
+            old_mean = self._mean
+            self._mean += (x - old) / self.window
+            self._m2 += (x - old) * (x - self._mean + old - old_mean)
+        self._updates += 1
+        if self._updates >= self.window:
+            self._recompute()
+        return self.value
+
+    def seed(self, values):
+        self._values.clear()
+        self._values.extend(float(v) for v in values[-self.window:])
+        self._recompute()
+        return self
+
+    def to_dict(self):
+        return {'kind': self.kind, 'window': self.window, 'ddof': self.ddof, 'values': list(self._values)}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['window'], data.get('ddof', 1)).seed(data['values'])
+
+
+class EMAState:
+    """Exponential moving average (pandas ``adjust=False`` semantics)"""
+
+    kind = 'ema'
+
+    def __init__(self, span=None, alpha=None, value=None):
+        self.alpha = alpha if alpha is not None else 2.0 / (span + 1.0)
+        self._value = value
+
+    @property
+    def value(self):
+        return self._value if self._value is not None else NAN
+
+    def update(self, x):
+        self._value = x if self._value is None else self.alpha * x + (1.0 - self.alpha) * self._value
+        return self._value
+
+    def seed(self, values):
+        series = indicators.ema(values, alpha=self.alpha)
+        self._value = float(series[-1]) if len(series) and _finite(series[-1]) else None
+        return self
+
+    def to_dict(self):
+        return {'kind': self.kind, 'alpha': self.alpha, 'value': self._value}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(alpha=data['alpha'], value=data['value'])
+
+
+class WilderRSIState:
+    """Relative Strength Index with Wilder smoothing"""
+
+    kind = 'rsi'
+
+    def __init__(self, period=14):
+        self.period = period
+        self._reset()
+
+    def _reset(self):
+        self._prev = None
+        self._count = 0
+        self._avg_gain = 0.0
+        self._avg_loss = 0.0
+
+    @property
+    def value(self):
+        if self._count < self.period:
+            return NAN
+        if self._avg_loss == 0:
+            return 50.0 if self._avg_gain == 0 else 100.0
+        return 100.0 - 100.0 / (1.0 + self._avg_gain / self._avg_loss)
+
+    def update(self, close):
+        if self._prev is None:
+            self._prev = close
+            return NAN
+        delta = close - self._prev
+        self._prev = close
+        gain, loss = max(delta, 0.0), max(-delta, 0.0)
+        self._count += 1
+        if self._count <= self.period:
+            # Seed window: plain running mean of the first `period` changes
+            self._avg_gain += (gain - self._avg_gain) / self._count
+            self._avg_loss += (loss - self._avg_loss) / self._count
+        else:
+            self._avg_gain = (self._avg_gain * (self.period - 1) + gain) / self.period
+            self._avg_loss = (self._avg_loss * (self.period - 1) + loss) / self.period
+        return self.value
+
+    def seed(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        self._reset()
+        if len(values) <= self.period:
+            for value in values:
+                self.update(float(value))
+            return self
+        delta = np.diff(values)
+        self._avg_gain = float(indicators.wilder(np.clip(delta, 0.0, None), self.period)[-1])
+        self._avg_loss = float(indicators.wilder(np.clip(-delta, 0.0, None), self.period)[-1])
+        self._count = len(delta)
+        self._prev = float(values[-1])
+        return self
+
+    def to_dict(self):
+        return {'kind': self.kind, 'period': self.period, 'prev': self._prev, 'count': self._count,
+                'avg_gain': self._avg_gain, 'avg_loss': self._avg_loss}
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls(data['period'])
+        state._prev = data['prev']
+        state._count = data['count']
+        state._avg_gain = data['avg_gain']
+        state._avg_loss = data['avg_loss']
+        return state
+
+
+class MACDState:
+    """MACD line, signal line and histogram"""
+
+    kind = 'macd'
+
+    def __init__(self, fast_period=12, slow_period=26, signal_period=9):
+        self.fast_period = fast_period
+        self.slow_period = slow_period
+        self.signal_period = signal_period
+        self._fast = EMAState(fast_period)
+        self._slow = EMAState(slow_period)
+        self._signal = EMAState(signal_period)
+
+    @property
+    def value(self):
+        line = self._fast.value - self._slow.value
+        signal = self._signal.value
+        return line, signal, line - signal
+
+    def update(self, x):
+        line = self._fast.update(x) - self._slow.update(x)
+        signal = self._signal.update(line)
+        return line, signal, line - signal
+
+    def seed(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        self._fast.seed(values)
+        self._slow.seed(values)
+        line = indicators.ema(values, alpha=self._fast.alpha) - indicators.ema(values, alpha=self._slow.alpha)
+        self._signal.seed(line)
+        return self
+
+    def to_dict(self):
+        return {'kind': self.kind, 'fast_period': self.fast_period, 'slow_period': self.slow_period,
+                'signal_period': self.signal_period, 'fast': self._fast.to_dict(),
+                'slow': self._slow.to_dict(), 'signal': self._signal.to_dict()}
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls(data['fast_period'], data['slow_period'], data['signal_period'])
+        state._fast = EMAState.from_dict(data['fast'])
+        state._slow = EMAState.from_dict(data['slow'])
+        state._signal = EMAState.from_dict(data['signal'])
+        return state
+
+
+STATE_TYPES = {cls.kind: cls for cls in (SMAState, RollingStdState, EMAState, WilderRSIState, MACDState)}
+
+
+def state_from_dict(data):
+    """Rebuild any indicator state from its ``to_dict()`` form"""
+    return STATE_TYPES[data['kind']].from_dict(data)
+
+
+def default_states():
+    """Indicators shown by the analysis and prediction views"""
+    return {
+        'sma20': SMAState(20),
+        'sma50': SMAState(50),
+        'sma200': SMAState(200),
+        'std20': RollingStdState(20),
+        'rsi14': WilderRSIState(14),
+        'macd': MACDState(12, 26, 9),
+    }
+
+
+class IndicatorSet:
+    """A named group of indicator states fed from the same close series"""
+
+    def __init__(self, states=None):
+        self.states = states if states is not None else default_states()
+
+    def update(self, close):
+        for state in self.states.values():
+            state.update(close)
+        return self.values()
+
+    def seed(self, closes):
+        for state in self.states.values():
+            state.seed(closes)
+        return self
+
+    def values(self):
+        """Current values, with MACD and Bollinger Bands expanded into their parts"""
+        result = {}
+        for name, state in self.states.items():
+            if isinstance(state, MACDState):
+                result['macd'], result['macd_signal'], result['macd_hist'] = state.value
+            else:
+                result[name] = state.value
+        if 'sma20' in self.states and 'std20' in self.states:
+            result['bb_middle'] = result['sma20']
+            result['bb_upper'] = result['sma20'] + 2 * result['std20']
+            result['bb_lower'] = result['sma20'] - 2 * result['std20']
+        return result
+
+    def copy(self):
+        return IndicatorSet.from_dict(self.to_dict())
+
+    def to_dict(self):
+        return {name: state.to_dict() for name, state in self.states.items()}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls({name: state_from_dict(state) for name, state in data.items()})
+
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def _get_lock(key):
+    with _locks_guard:
+        if key not in _locks:
+            _locks[key] = threading.Lock()
+        return _locks[key]
+
+
+def _load_checkpoint(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"Error reading indicator checkpoint {path}: {e}")
+        return None
+
+
+def _save_checkpoint(path, checkpoint):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Error writing indicator checkpoint {path}: {e}")
+
+
+def _committed_state(timestamps, closes, checkpoint):
+    """
+    Restore the checkpointed state if it still matches the stored bars
+
+    Returns:
+        Tuple of (IndicatorSet, index of the next bar to apply), or None
+    """
+    if not checkpoint:
+        return None
+    ts = checkpoint.get('timestamp')
+    i = int(np.searchsorted(timestamps, ts)) if ts is not None else len(timestamps)
+    if i >= len(timestamps) - 1 or timestamps[i] != ts or closes[i] != checkpoint.get('close'):
+        return None
+    try:
+        return IndicatorSet.from_dict(checkpoint['states']), i + 1
+    except (KeyError, TypeError, ValueError) as e:
+        print(f"Error restoring indicator checkpoint: {e}")
+        return None
+
+
+def latest_indicators(symbol, interval='1d', period='1y'):
+    """
+    Latest indicator values for a symbol, updated incrementally from a checkpoint
+
+    Args:
+        symbol: Stock ticker symbol
+        interval: Bar interval
+        period: History the bar store should cover when seeding from scratch
+
+    Returns:
+        Dictionary with the last bar's timestamp and close plus sma20, sma50,
+        sma200, std20, rsi14, macd, macd_signal, macd_hist and bb_middle/upper/lower
+        (NaN when there is not enough history), or None if there are no bars
+    """
+    matrix, _ = get_bars(symbol, period=period, interval=interval)
+    if matrix is None:
+        return None
+    timestamps = np.asarray(matrix[0])
+    closes = np.asarray(matrix[4])
+    last = len(timestamps) - 1
+
+    path = sidecar_path(symbol, interval, 'indicators')
+    with _get_lock((symbol.upper(), interval)):
+        restored = _committed_state(timestamps, closes, _load_checkpoint(path))
+        if restored is None:
+            # Vectorized seed over every completed bar
+            state, pending = IndicatorSet().seed(closes[:last]), last
+        else:
+            state, pending = restored
+
+        # Commit completed bars (one O(1) update each); the last bar may still change
+        if pending < last or restored is None:
+            for close in closes[pending:last]:
+                state.update(float(close))
+            if last > 0:
+                _save_checkpoint(path, {'timestamp': float(timestamps[last - 1]),
+                                        'close': float(closes[last - 1]),
+                                        'states': state.to_dict()})
+
+    values = state.copy().update(float(closes[last]))
+    values['timestamp'] = float(timestamps[last])
+    values['close'] = float(closes[last])
+    return values
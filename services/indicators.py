@@ -0,0 +1,324 @@
+"""
+Technical indicators on plain NumPy arrays.
+
+Every function takes a 1-D float array of prices, or a 2-D array holding one
+series per column, and returns arrays of the same shape with NaN where the
+indicator is not yet defined. 2-D inputs are processed along axis 0 in one
+pass. Moving windows
+use cumulative sums, and the EMA / Wilder recursions are evaluated as
+closed-form linear filters over fixed-size blocks, so nothing loops per bar
+in Python. Blocks are sized so the exponential weights stay within float64
+range, and window sums are re-centred per chunk to avoid cancellation on
+long series.
+
+Callers holding pandas objects pass ``series.to_numpy(dtype=float)`` and wrap
+the result back with the original index.
+"""
+import numpy as np
+
+# Largest natural exponent used for in-block filter weights (e**300 ~ 1e130)
+_MAX_EXPONENT = 300.0
+
+# Bars per chunk when accumulating window sums
+_CHUNK = 1 << 13
+
+
+def _as_array(values):
+    return np.asarray(values, dtype=np.float64)
+
+
+def _first_finite(x):
+    """First row from which every column is finite (first finite index for 1-D)"""
+    finite = np.flatnonzero(np.isfinite(x).reshape(len(x), -1).all(axis=1))
+    return finite[0] if len(finite) else len(x)
+
+
+def linear_filter(values, decay, gain=None, initial=None):
+    """
+    Evaluate y[t] = decay * y[t-1] + gain * x[t] without a per-bar loop
+
+    The series is split into blocks short enough that decay**-k stays finite;
+    inside a block the recursion is a scaled cumulative sum, and only the
+    carry between blocks is propagated sequentially. A 2-D input is filtered
+    column by column (along axis 0) in one pass.
+
+    Non-finite inputs are skipped like missing values in pandas ``ewm``
+    (``adjust=False``): the output repeats the previous value over the gap,
+    and the next input is weighted against the state decayed across it (see
+    ``_filter_gaps``).
+
+    Args:
+        values: Input array, 1-D or 2-D
+        decay: Weight of the previous output, 0 <= decay < 1
+        gain: Weight of the new input (defaults to 1 - decay)
+        initial: Output before the first input (scalar or one per column);
+            defaults to values[0] with the first output equal to it (pandas
+            ``adjust=False`` semantics)
+
+    Returns:
+        Filtered array
+    """
+    x = _as_array(values)
+    if len(x) == 0:
+        return x.copy()
+    gain = 1.0 - decay if gain is None else gain
+    if not np.isfinite(x).all():
+        return _filter_gaps(x, decay, gain, initial)
+
+    if initial is None:
+        # Seed so that y[0] == x[0]
+        head = x[:1]
+        carry = x[0]
+        x = x[1:]
+    else:
+        head = x[:0]
+        carry = np.broadcast_to(np.asarray(initial, dtype=np.float64), x.shape[1:])
+    n = len(x)
+    if n == 0:
+        return head.copy()
+    if decay == 0.0:
+        return np.concatenate([head, gain * x])
+
+    block = max(1, min(n, int(_MAX_EXPONENT / -np.log(decay))))
+    blocks = -(-n // block)
+    columns = x.shape[1:]
+    padded = np.zeros((blocks * block,) + columns)
+    padded[:n] = x
+    padded = padded.reshape((blocks, block) + columns)
+
+    # Per-offset weights, shaped to broadcast over any trailing columns
+    k = np.arange(block, dtype=np.float64).reshape((block,) + (1,) * len(columns))
+    grow = decay ** -k
+    shrink = decay ** k
+    # Response of each block to its own inputs, starting from a zero state
+    local = np.cumsum(padded * (gain * grow), axis=1) * shrink
+
+    # Carry the state across block boundaries (one step per block, not per bar)
+    decay_block = decay ** block
+    carries = np.empty((blocks,) + columns)
+    for j in range(blocks):
+        carries[j] = carry
+        carry = local[j, -1] + decay_block * carry
+
+    out = local + carries[:, None] * (shrink * decay)
+    return np.concatenate([head, out.reshape((blocks * block,) + columns)[:n]])
+
+
+def _filter_gaps(x, decay, gain, initial):
+    """
+    ``linear_filter`` of an input with non-finite values
+
+    Each finite run is filtered in one pass. The first input after a gap of
+    m values is weighted against the state decayed over the gap, as in
+    pandas: y = (w * y_prev + gain * x) / (w + gain) * (decay + gain) with
+    w = decay**(m+1), which is the plain recursion when there is no gap.
+    Runs are stepped in Python, so this path is for occasional gaps only.
+    """
+    if x.ndim > 1:
+        columns = x.reshape(len(x), -1)
+        seeds = np.broadcast_to(np.asarray(np.nan if initial is None else initial, dtype=np.float64),
+                                x.shape[1:]).reshape(-1)
+        out = np.column_stack([linear_filter(columns[:, j], decay, gain, None if initial is None else seeds[j])
+                               for j in range(columns.shape[1])])
+        return out.reshape(x.shape)
+
+    out = np.full(x.shape, np.nan)
+    finite = np.flatnonzero(np.isfinite(x))
+    if not len(finite):
+        if initial is not None:
+            out[:] = initial
+        return out
+    # Runs of consecutive finite inputs, as [start, stop) pairs
+    breaks = np.flatnonzero(np.diff(finite) > 1)
+    starts = finite[np.concatenate(([0], breaks + 1))]
+    stops = finite[np.concatenate((breaks, [len(finite) - 1]))] + 1
+
+    state = None if initial is None else float(initial)
+    position = -1  # Bar of the last input folded into the state
+    if state is not None:
+        out[:starts[0]] = state
+    for start, stop in zip(starts, stops):
+        if state is None:
+            first = x[start]
+        else:
+            weight = decay ** (start - position)
+            first = (weight * state + gain * x[start]) / (weight + gain) * (decay + gain)
+            out[position + 1:start] = state
+        out[start] = first
+        if stop - start > 1:
+            out[start + 1:stop] = linear_filter(x[start + 1:stop], decay, gain, first)
+        state, position = out[stop - 1], stop - 1
+    out[position + 1:] = state
+    return out
+
+
+def ema(values, span=None, alpha=None, initial=None):
+    """
+    Exponential moving average (matches pandas ``ewm(adjust=False)``)
+
+    Args:
+        values: Price array; NaNs are skipped (the EMA is carried over them)
+        span: EMA span (alpha = 2 / (span + 1))
+        alpha: Smoothing factor, used instead of span
+        initial: Optional EMA value before the first price, e.g. to continue
+            from a saved state
+
+    Returns:
+        EMA array, NaN before the first finite input
+    """
+    x = _as_array(values)
+    if alpha is None:
+        alpha = 2.0 / (span + 1.0)
+    out = np.full(x.shape, np.nan)
+    start = _first_finite(x)
+    if start < len(x):
+        out[start:] = linear_filter(x[start:], 1.0 - alpha, alpha, initial)
+    return out
+
+
+def wilder(values, period, initial=None):
+    """
+    Wilder smoothing (EMA with alpha = 1 / period)
+
+    Without an initial value the average is seeded with the simple mean of
+    the first ``period`` finite inputs, as in Wilder's original definition.
+
+    Returns:
+        Smoothed array, NaN until the seed window is complete
+    """
+    x = _as_array(values)
+    out = np.full(x.shape, np.nan)
+    start = _first_finite(x)
+    if initial is not None:
+        if start < len(x):
+            out[start:] = linear_filter(x[start:], 1.0 - 1.0 / period, 1.0 / period, initial)
+        return out
+    seed_end = start + period
+    if seed_end > len(x):
+        return out
+    seed = x[start:seed_end].mean(axis=0)
+    out[seed_end - 1] = seed
+    if seed_end < len(x):
+        out[seed_end:] = linear_filter(x[seed_end:], 1.0 - 1.0 / period, 1.0 / period, seed)
+    return out
+
+
+def _window_sum(a, window):
+    """Sums of each full window of a (along axis 0)"""
+    if len(a) < window:
+        return np.empty((0,) + a.shape[1:])
+    s = np.concatenate((np.zeros((1,) + a.shape[1:]), np.cumsum(a, axis=0)))
+    return s[window:] - s[:-window]
+
+
+def _rolling_sums(x, window, squares=False):
+    """
+    Window sums of (x - c) and optionally (x - c)**2 with NaN counts
+
+    Each chunk is centred on its own mean before the cumulative sums, which
+    keeps the sums small on long trending series.
+    """
+    n = len(x)
+    total = np.full(x.shape, np.nan)
+    total_sq = np.full(x.shape, np.nan) if squares else None
+    centre = np.full(x.shape, np.nan)
+    valid = np.isfinite(x)
+
+    for start in range(0, n, _CHUNK):
+        stop = min(n, start + _CHUNK)
+        lo = max(0, start - window + 1)
+        seg = x[lo:stop]
+        seg_valid = valid[lo:stop]
+        # Mean of the finite values per column (0 for columns with none)
+        counts = seg_valid.sum(axis=0)
+        c = np.where(seg_valid, seg, 0.0).sum(axis=0) / np.maximum(counts, 1)
+        dev = np.where(seg_valid, seg - c, 0.0)
+
+        count = _window_sum(seg_valid.astype(np.float64), window)
+        sums = _window_sum(dev, window)
+        # Output positions covered by this chunk
+        first = max(start, window - 1)
+        offset = first - (lo + window - 1)
+        if first >= stop:
+            continue
+        span = slice(first, stop)
+        complete = count[offset:offset + stop - first] == window
+        total[span] = np.where(complete, sums[offset:offset + stop - first], np.nan)
+        centre[span] = c
+        if squares:
+            sq = _window_sum(dev * dev, window)
+            total_sq[span] = np.where(complete, sq[offset:offset + stop - first], np.nan)
+
+    return total, total_sq, centre
+
+
+def sma(values, window):
+    """
+    Simple moving average over a fixed window
+
+    Returns:
+        SMA array, NaN until a full window of finite values is available
+    """
+    x = _as_array(values)
+    if window <= 0 or window > len(x):
+        return np.full(x.shape, np.nan)
+    total, _, centre = _rolling_sums(x, window)
+    return total / window + centre
+
+
+def rolling_std(values, window, ddof=1):
+    """Rolling standard deviation (sample by default, like pandas)"""
+    x = _as_array(values)
+    if window <= ddof or window > len(x):
+        return np.full(x.shape, np.nan)
+    total, total_sq, _ = _rolling_sums(x, window, squares=True)
+    var = (total_sq - total * total / window) / (window - ddof)
+    return np.sqrt(np.clip(var, 0.0, None))
+
+
+def rsi(values, period=14):
+    """
+    Relative Strength Index with Wilder smoothing
+
+    Returns:
+        RSI array in [0, 100], NaN for the first ``period`` bars
+    """
+    x = _as_array(values)
+    out = np.full(x.shape, np.nan)
+    if len(x) <= period:
+        return out
+    delta = np.diff(x, axis=0)
+    avg_gain = wilder(np.clip(delta, 0.0, None), period)
+    avg_loss = wilder(np.clip(-delta, 0.0, None), period)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        value = 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+    # No losses in the window: 100, or 50 when the price did not move at all
+    value = np.where(avg_loss == 0, np.where(avg_gain == 0, 50.0, 100.0), value)
+    value[np.isnan(avg_gain) | np.isnan(avg_loss)] = np.nan
+    out[1:] = value
+    return out
+
+
+def macd(values, fast_period=12, slow_period=26, signal_period=9):
+    """
+    Moving Average Convergence Divergence
+
+    Returns:
+        Tuple of (macd line, signal line, histogram) arrays
+    """
+    x = _as_array(values)
+    line = ema(x, span=fast_period) - ema(x, span=slow_period)
+    signal = ema(line, span=signal_period)
+    return line, signal, line - signal
+
+
+def bollinger(values, window=20, num_std=2.0):
+    """
+    Bollinger Bands
+
+    Returns:
+        Tuple of (middle, upper, lower) band arrays
+    """
+    middle = sma(values, window)
+    width = rolling_std(values, window) * num_std
+    return middle, middle + width, middle - width
@@ -0,0 +1,375 @@
+"""
+Local job queue for long-running requests.
+
+Backtests and predictions can take seconds (a slow history fetch, a model
+fit), so the web routes submit them here and return a job id at once. A
+bounded thread pool runs the jobs; each job reports progress into its
+record, and clients poll the record (or subscribe to it as server-sent
+events). Records live in a SQLite file shared by every worker process on
+the host, whatever the cache backend, so any worker can answer for a job
+started by another, without an external broker.
+
+Identical jobs (same type and parameters) submitted while one is queued or
+running share that job instead of running twice. Each user may only have a
+limited number of active jobs across all processes, and finished records
+expire after JOB_RESULT_TTL seconds. Jobs of a worker process that exited
+are marked failed.
+"""
+import os
+import json
+import time
+import uuid
+import pickle
+import sqlite3
+import hashlib
+import threading
+import concurrent.futures
+from datetime import datetime
+
+from services import DATA_DIR
+
+# Threads running jobs in each web worker process
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 4))
+
+# Queued or running jobs a single user may have at once
+MAX_JOBS_PER_USER = int(os.environ.get('JOB_MAX_PER_USER', 3))
+
+# Queued or running jobs per process before submissions are refused
+MAX_PENDING_JOBS = int(os.environ.get('JOB_MAX_PENDING', 64))
+
+# Seconds a job record (and its result) is kept after its last update
+JOB_RESULT_TTL = int(os.environ.get('JOB_RESULT_TTL', 3600))
+
+# SQLite file holding the job records of every worker process
+JOB_DB_PATH = os.environ.get('JOB_DB_PATH', os.path.join(DATA_DIR, 'jobs.sqlite'))
+
+# Seconds an event stream stays open; under gunicorn's 30 s worker timeout,
+# and browsers reconnect to a closed stream on their own
+EVENTS_TIMEOUT = 25
+
+ACTIVE = ('queued', 'running')
+
+
+class JobLimitError(RuntimeError):
+    """A user or the queue has too many active jobs"""
+
+
+def _digest(job_type, params):
+    payload = json.dumps([job_type, params], sort_keys=True, default=repr, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobStore:
+    """
+    Job records in a SQLite file shared by the worker processes on the host
+
+    Records are pickled without their users; job membership is a separate
+    table that joins only ever insert into, so no update can drop a user.
+    """
+
+    def __init__(self, path=JOB_DB_PATH, ttl=JOB_RESULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        # Users are stored as given (no type affinity), so ids compare equal on the way out
+        conn.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                            id TEXT PRIMARY KEY,
+                            digest TEXT NOT NULL,
+                            owner NOT NULL,
+                            pid INTEGER NOT NULL,
+                            status TEXT NOT NULL,
+                            record BLOB NOT NULL,
+                            updated_at REAL NOT NULL)''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_digest ON jobs (digest, status)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_owner ON jobs (owner, status)')
+        conn.execute('''CREATE TABLE IF NOT EXISTS job_users (
+                            job_id TEXT NOT NULL,
+                            user_id NOT NULL,
+                            PRIMARY KEY (job_id, user_id))''')
+
+    def _connection(self):
+        # Connections must not be shared across a fork (gunicorn preload)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        return conn
+
+    def _reap(self, conn):
+        """Fail the active jobs of exited processes and drop expired records"""
+        now = time.time()
+        placeholders = ','.join('?' * len(ACTIVE))
+        rows = conn.execute(f'SELECT id, pid, record FROM jobs WHERE status IN ({placeholders})', ACTIVE).fetchall()
+        for job_id, pid, blob in rows:
+            if _alive(pid):
+                continue
+            record = pickle.loads(blob)
+            record.update(status='failed', error='The worker running this job exited', finished_at=_now())
+            conn.execute('UPDATE jobs SET status = ?, record = ?, updated_at = ? WHERE id = ?',
+                         ('failed', pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL), now, job_id))
+        expired = f'SELECT id FROM jobs WHERE status NOT IN ({placeholders}) AND updated_at < ?'
+        conn.execute(f'DELETE FROM job_users WHERE job_id IN ({expired})', ACTIVE + (now - self.ttl,))
+        conn.execute(f'DELETE FROM jobs WHERE id IN ({expired})', ACTIVE + (now - self.ttl,))
+
+    def claim(self, record, digest, user_id, max_per_user):
+        """
+        Join the active job with the same digest, or insert ``record``
+
+        Both happen in one immediate transaction, so two processes submitting
+        the same work at once still share one job.
+
+        Returns:
+            Tuple of (the joined record or None, the new record's snapshot or None)
+
+        Raises:
+            JobLimitError: If the user already has ``max_per_user`` active jobs
+        """
+        conn = self._transaction()
+        try:
+            self._reap(conn)
+            placeholders = ','.join('?' * len(ACTIVE))
+            row = conn.execute(f'SELECT id FROM jobs WHERE digest = ? AND status IN ({placeholders}) LIMIT 1',
+                               (digest,) + ACTIVE).fetchone()
+            if row is not None:
+                conn.execute('INSERT OR IGNORE INTO job_users (job_id, user_id) VALUES (?, ?)', (row[0], user_id))
+            else:
+                active, = conn.execute(f'SELECT COUNT(*) FROM jobs WHERE owner = ? AND status IN ({placeholders})',
+                                       (user_id,) + ACTIVE).fetchone()
+                if active >= max_per_user:
+                    raise JobLimitError(f'Too many active jobs (limit {max_per_user})')
+                conn.execute('INSERT INTO jobs (id, digest, owner, pid, status, record, updated_at) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             (record['id'], digest, user_id, os.getpid(), record['status'],
+                              pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL), time.time()))
+                conn.execute('INSERT INTO job_users (job_id, user_id) VALUES (?, ?)', (record['id'], user_id))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        if row is not None:
+            return self.get(row[0]), None
+        return None, dict(record, users=[user_id])
+
+    def save(self, record):
+        """Store a record's new status, progress or result (its users are kept)"""
+        self._connection().execute('UPDATE jobs SET status = ?, record = ?, updated_at = ? WHERE id = ?',
+                                   (record['status'], pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL),
+                                    time.time(), record['id']))
+
+    def get(self, job_id):
+        conn = self._connection()
+        row = conn.execute('SELECT status, record, updated_at FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None or (row[0] not in ACTIVE and time.time() - row[2] > self.ttl):
+            return None
+        users = [user for user, in conn.execute('SELECT user_id FROM job_users WHERE job_id = ? ORDER BY rowid',
+                                                (job_id,))]
+        return dict(pickle.loads(row[1]), users=users)
+
+    def active_counts(self):
+        """Active jobs per submitting user, across every process"""
+        placeholders = ','.join('?' * len(ACTIVE))
+        return dict(self._connection().execute(
+            f'SELECT owner, COUNT(*) FROM jobs WHERE status IN ({placeholders}) GROUP BY owner', ACTIVE).fetchall())
+
+
+class JobQueue:
+    """Bounded pool running registered job functions, with records kept in a JobStore"""
+
+    def __init__(self, workers=JOB_WORKERS, max_per_user=MAX_JOBS_PER_USER,
+                 max_pending=MAX_PENDING_JOBS, ttl=JOB_RESULT_TTL, path=JOB_DB_PATH):
+        self.workers = workers
+        self.max_per_user = max_per_user
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.store = JobStore(path, ttl)
+        self.submitted = 0
+        self.deduplicated = 0
+        self.completed = 0
+        self.failed = 0
+        self._functions = {}
+        self._executor = None
+        self._pid = None
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def register(self, job_type, func):
+        """
+        Register the function run for a job type
+
+        The function is called with the job's parameters as keyword arguments
+        plus ``progress``, a callback taking (fraction done, stage message).
+        A returned dictionary with an 'error' key marks the job as failed.
+        """
+        self._functions[job_type] = func
+
+    def _get_executor(self):
+        # Threads do not survive a fork, so each process builds its own pool
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers,
+                                                                   thread_name_prefix='job')
+            self._pid = os.getpid()
+            self._pending = 0
+        return self._executor
+
+    def _save(self, record):
+        self.store.save(record)
+        with self._changed:
+            self._changed.notify_all()
+
+    def get(self, job_id):
+        """The job's record (with the users who submitted it), or None if it is unknown or has expired"""
+        return self.store.get(job_id)
+
+    def submit(self, job_type, params, user_id):
+        """
+        Queue a job, or join an identical one that is still queued or running
+
+        Args:
+            job_type: Registered job type
+            params: JSON-serializable keyword arguments of the job function
+            user_id: Submitting user (for concurrency limits and access)
+
+        Returns:
+            Tuple of (job record, True if an in-flight job was reused)
+
+        Raises:
+            ValueError: If the job type is unknown
+            JobLimitError: If the user or the queue has too many active jobs
+        """
+        if job_type not in self._functions:
+            raise ValueError(f'Unknown job type: {job_type}')
+        params = params or {}
+        digest = _digest(job_type, params)
+
+        with self._lock:
+            executor = self._get_executor()
+            if self._pending >= self.max_pending:
+                raise JobLimitError('Job queue is full, try again shortly')
+            record = {
+                'id': uuid.uuid4().hex,
+                'type': job_type,
+                'params': params,
+                'status': 'queued',
+                'progress': 0.0,
+                'message': 'Queued',
+                'submitted_at': _now(),
+                'started_at': None,
+                'finished_at': None,
+                'result': None,
+                'error': None,
+            }
+            # Reuse an in-flight job with the same work from any process, or claim a slot
+            joined, snapshot = self.store.claim(record, digest, user_id, self.max_per_user)
+            if joined is not None:
+                self.deduplicated += 1
+                return joined, True
+            self._pending += 1
+            self.submitted += 1
+            executor.submit(self._run, record)
+        return snapshot, False
+
+    def _run(self, record):
+        def progress(fraction, message=None):
+            record['progress'] = round(min(max(float(fraction), 0.0), 1.0), 3)
+            if message:
+                record['message'] = message
+            self._save(record)
+
+        try:
+            record.update(status='running', started_at=_now(), message='Running')
+            self._save(record)
+            result = self._functions[record['type']](progress=progress, **record['params'])
+            if isinstance(result, dict) and 'error' in result:
+                record.update(status='failed', error=result['error'], result=result)
+            else:
+                record.update(status='done', result=result)
+        except Exception as e:
+            print(f"Error running {record['type']} job {record['id']}: {e}")
+            record.update(status='failed', error=str(e))
+        finally:
+            record.update(progress=1.0, message='Finished', finished_at=_now())
+            with self._lock:
+                if record['status'] == 'failed':
+                    self.failed += 1
+                else:
+                    self.completed += 1
+                self._pending -= 1
+            self._save(record)
+
+    def events(self, job_id, heartbeat=15, timeout=EVENTS_TIMEOUT):
+        """
+        Server-sent event stream of a job's progress
+
+        Yields one 'progress' event per change of status, progress or stage,
+        then a final 'done' event with the whole record. Comment lines keep
+        idle connections open. The stream closes after ``timeout`` seconds
+        so it never outlives a sync worker's timeout; EventSource clients
+        reconnect by themselves.
+        """
+        yield 'retry: 1000\n\n'
+        last = None
+        idle_since = time.time()
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            record = self.get(job_id)
+            if record is None:
+                yield f"event: error\ndata: {json.dumps({'error': 'Job not found'})}\n\n"
+                return
+            if record['status'] not in ACTIVE:
+                yield f"event: done\ndata: {json.dumps(record, default=str)}\n\n"
+                return
+            state = (record['status'], record['progress'], record['message'])
+            if state != last:
+                last = state
+                idle_since = time.time()
+                update = {'id': job_id, 'status': state[0], 'progress': state[1], 'message': state[2]}
+                yield f"event: progress\ndata: {json.dumps(update)}\n\n"
+            elif time.time() - idle_since >= heartbeat:
+                idle_since = time.time()
+                yield ': keep-alive\n\n'
+            # Local jobs wake the stream on every update; others are polled
+            with self._changed:
+                self._changed.wait(0.5)
+
+    def stats(self):
+        counts = self.store.active_counts()
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'active': sum(counts.values()),
+                'users_active': len(counts),
+                'pending': self._pending,
+                'submitted': self.submitted,
+                'deduplicated': self.deduplicated,
+                'completed': self.completed,
+                'failed': self.failed,
+            }
+
+
+# Process-wide queue shared by the web routes
+jobs = JobQueue()
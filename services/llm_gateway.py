@@ -0,0 +1,205 @@
+"""
+Gateway for LLM completions with a content-addressed response cache.
+
+Every Groq call goes through ``complete``. A response is stored on disk under
+the SHA-256 of the model, the sampling parameters and the prompt with its
+whitespace normalized, so an identical request, such as the explanation of a
+prediction whose factors have not changed, is answered from disk instantly
+and costs no tokens. Responses about market data are tied to the date of
+the bar they describe (``as_of``), so they are only reused until a new bar
+arrives; others expire after a TTL. Concurrent identical requests share one
+upstream call, and failures are never cached.
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+
+import groq
+
+from services import DATA_DIR
+from services.singleflight import get_group
+
+LLM_CACHE_DIR = os.environ.get('LLM_CACHE_DIR', os.path.join(DATA_DIR, 'llm_cache'))
+
+# Seconds a response is reused (the bar date expires market responses sooner)
+LLM_CACHE_TTL = int(os.environ.get('LLM_CACHE_TTL', 7 * 86400))
+
+# Cached responses kept on disk (oldest removed first)
+LLM_CACHE_MAX_FILES = int(os.environ.get('LLM_CACHE_MAX_FILES', 20000))
+
+# Writes between sweeps of expired and excess responses
+_PRUNE_EVERY = 200
+
+DEFAULT_MODEL = 'llama3-70b-8192'
+
+
+def normalize(text):
+    """Prompt text with runs of whitespace collapsed, so indentation does not change the key"""
+    return re.sub(r'\s+', ' ', text or '').strip()
+
+
+def cache_key(messages, model, **params):
+    """SHA-256 of the model, sampling parameters and normalized messages"""
+    payload = {
+        'model': model,
+        'params': params,
+        'messages': [[message['role'], normalize(message['content'])] for message in messages],
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+
+class LLMGateway:
+    """Groq chat completions behind a content-addressed disk cache"""
+
+    def __init__(self, directory=LLM_CACHE_DIR, ttl=LLM_CACHE_TTL, max_files=LLM_CACHE_MAX_FILES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_files = max_files
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.tokens_used = 0
+        self.tokens_saved = 0
+        self._writes = 0
+        self._client = None
+        self._lock = threading.Lock()
+        self._flight = get_group('llm')
+
+    def _get_client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = groq.Groq(api_key=os.environ.get('GROQ_API_KEY'))
+            return self._client
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    def _read(self, key, as_of):
+        try:
+            with open(self._path(key)) as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Error reading LLM cache entry {key}: {e}")
+            return None
+        if entry.get('expires_at', 0) <= time.time() or entry.get('as_of') != as_of:
+            return None
+        return entry
+
+    def _write(self, key, entry):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error writing LLM cache entry {key}: {e}")
+            return
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % _PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+
+    def prune(self):
+        """Remove expired responses, then the oldest ones over the file limit"""
+        now = time.time()
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    mtime = os.path.getmtime(path)
+                    if mtime + self.ttl <= now:
+                        os.remove(path)
+                    else:
+                        files.append((mtime, path))
+                except FileNotFoundError:
+                    continue  # Removed by another process
+        for _, path in sorted(files)[:max(len(files) - self.max_files, 0)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _call(self, key, messages, model, params, as_of, ttl):
+        # Another process may have stored the response in the meantime
+        entry = self._read(key, as_of)
+        if entry is not None:
+            with self._lock:
+                self.hits += 1
+                self.tokens_saved += entry.get('tokens', 0)
+            return entry
+        response = self._get_client().chat.completions.create(messages=messages, model=model, stream=False, **params)
+        usage = getattr(response, 'usage', None)
+        entry = {
+            'content': response.choices[0].message.content,
+            'model': model,
+            'as_of': as_of,
+            'tokens': getattr(usage, 'total_tokens', 0) or 0,
+            'created_at': time.time(),
+            'expires_at': time.time() + ttl,
+        }
+        with self._lock:
+            self.misses += 1
+            self.tokens_used += entry['tokens']
+        self._write(key, entry)
+        return entry
+
+    def complete(self, messages, model=DEFAULT_MODEL, as_of=None, ttl=None, **params):
+        """
+        Get a chat completion, from the cache when the same request was answered before
+
+        Args:
+            messages: Chat messages (dictionaries with 'role' and 'content')
+            model: Groq model name
+            as_of: Date of the bar the prompt describes; a cached response
+                is only reused for the same date
+            ttl: Seconds the response may be reused (LLM_CACHE_TTL by default)
+            **params: Sampling parameters passed to the API (temperature,
+                max_tokens, top_p, ...)
+
+        Returns:
+            The response text
+
+        Raises:
+            Exception: Whatever the Groq client raises (failures are not cached)
+        """
+        key = cache_key(messages, model, **params)
+        entry = self._read(key, as_of)
+        if entry is not None:
+            with self._lock:
+                self.hits += 1
+                self.tokens_saved += entry.get('tokens', 0)
+            return entry['content']
+        try:
+            entry = self._flight.do(key, self._call, key, messages, model, params, as_of, ttl or self.ttl)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+        return entry['content']
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'errors': self.errors,
+                'hit_rate': round(self.hits / requests, 4) if requests else 0.0,
+                'tokens_used': self.tokens_used,
+                'tokens_saved': self.tokens_saved,
+            }
+
+
+# Process-wide gateway shared by the AI services
+gateway = LLMGateway()
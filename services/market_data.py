@@ -0,0 +1,329 @@
+"""
+Market data provider layer.
+
+Every service reads history, quote snapshots, ticker info and news through the
+provider returned by ``get_provider()``. The default backend talks to Yahoo via
+yfinance; the replay backend serves recorded fixtures from disk (with optional
+injected latency) so the app can run offline in CI and capacity tests, and the
+record backend captures those fixtures from live traffic.
+
+The backend is chosen with the MARKET_DATA_PROVIDER environment variable
+('yfinance', 'replay' or 'record').
+"""
+import os
+import re
+import json
+import time
+import random
+import threading
+from datetime import timedelta
+import pandas as pd
+
+from services import DATA_DIR
+
+FIXTURES_DIR = os.environ.get('MARKET_DATA_FIXTURES', os.path.join(DATA_DIR, 'fixtures'))
+
+OHLCV_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+
+def _stack_histories(symbols, histories):
+    """Combine per-symbol history frames into one (field, symbol) column frame"""
+    frames = {}
+    for symbol, hist in zip(symbols, histories):
+        if hist is not None and not hist.empty:
+            hist = hist[[col for col in OHLCV_COLUMNS if col in hist.columns]]
+            if hist.index.tz is not None:
+                hist = hist.tz_localize(None)
+            frames[symbol] = hist
+    if not frames:
+        return pd.DataFrame(columns=pd.MultiIndex.from_product([OHLCV_COLUMNS, list(symbols)]))
+    return pd.concat(frames, axis=1).swaplevel(axis=1).sort_index(axis=1)
+
+
+class MarketDataProvider:
+    """Interface shared by all market data backends"""
+
+    name = 'base'
+
+    # Offline providers never touch the network; scrapers check this flag
+    offline = False
+
+    def history(self, symbol, period=None, interval='1d', start=None, end=None):
+        """Return an OHLCV DataFrame indexed by exchange-local timestamps"""
+        raise NotImplementedError
+
+    def info(self, symbol):
+        """Return the ticker info dictionary (yfinance ``.info`` layout)"""
+        raise NotImplementedError
+
+    def news(self, symbol):
+        """Return a list of raw news items (yfinance ``.news`` layout)"""
+        raise NotImplementedError
+
+    def download(self, symbols, period='5d', interval='1d'):
+        """
+        Download history for several symbols at once
+
+        Returns:
+            DataFrame with (field, symbol) MultiIndex columns over the union of
+            all symbols' bar dates (exchange-local, timezone-naive), NaN where a
+            symbol did not trade
+        """
+        return _stack_histories(symbols, [self.history(symbol, period=period, interval=interval) for symbol in symbols])
+
+    def quote(self, symbol):
+        """
+        Get a snapshot of the latest price for a symbol
+
+        Returns:
+            Dictionary with price, previous close, change, change percent, the
+            session's high/low and volume, or None if no recent bars are available
+        """
+        hist = self.history(symbol, period='5d')
+        if hist is None or hist.empty:
+            return None
+        current = float(hist['Close'].iloc[-1])
+        prev_close = float(hist['Close'].iloc[-2]) if len(hist) > 1 else float(hist['Open'].iloc[-1])
+        change = current - prev_close
+        return {
+            'symbol': symbol,
+            'price': current,
+            'previous_close': prev_close,
+            'change': change,
+            'change_percent': (change / prev_close) * 100 if prev_close else 0.0,
+            'day_high': float(hist['High'].iloc[-1]),
+            'day_low': float(hist['Low'].iloc[-1]),
+            'volume': int(hist['Volume'].iloc[-1]) if pd.notna(hist['Volume'].iloc[-1]) else 0,
+            'timestamp': hist.index[-1].strftime('%Y-%m-%d %H:%M:%S')
+        }
+
+
+class YFinanceProvider(MarketDataProvider):
+    """Live Yahoo Finance backend"""
+
+    name = 'yfinance'
+
+    def history(self, symbol, period=None, interval='1d', start=None, end=None):
+        import yfinance as yf
+        ticker = yf.Ticker(symbol)
+        if start is not None or end is not None:
+            return ticker.history(start=start, end=end, interval=interval)
+        return ticker.history(period=period or '1mo', interval=interval)
+
+    def download(self, symbols, period='5d', interval='1d'):
+        import yfinance as yf
+        frame = yf.download(list(symbols), period=period, interval=interval, group_by='column',
+                            auto_adjust=True, ignore_tz=True, progress=False, threads=True)
+        if frame is None:
+            return pd.DataFrame(columns=pd.MultiIndex.from_product([OHLCV_COLUMNS, list(symbols)]))
+        return frame
+
+    def info(self, symbol):
+        import yfinance as yf
+        return yf.Ticker(symbol).info or {}
+
+    def news(self, symbol):
+        import yfinance as yf
+        return yf.Ticker(symbol).news or []
+
+
+def _fixture_dir(fixtures_dir, symbol):
+    return os.path.join(fixtures_dir, re.sub(r'[^A-Za-z0-9._^=-]', '_', symbol.upper()))
+
+
+class ReplayProvider(MarketDataProvider):
+    """
+    Offline backend replaying fixtures recorded by RecordingProvider
+
+    Fixture layout (one directory per symbol):
+        <fixtures_dir>/<SYMBOL>/history_<interval>.csv
+        <fixtures_dir>/<SYMBOL>/info.json
+        <fixtures_dir>/<SYMBOL>/news.json
+
+    Periods are anchored at the last recorded bar so fixtures stay usable
+    long after they were captured.
+    """
+
+    name = 'replay'
+    offline = True
+
+    def __init__(self, fixtures_dir=None, latency_ms=None, jitter_ms=None):
+        self.fixtures_dir = fixtures_dir or FIXTURES_DIR
+        self.latency_ms = float(os.environ.get('MARKET_DATA_LATENCY_MS', 0) if latency_ms is None else latency_ms)
+        self.jitter_ms = float(os.environ.get('MARKET_DATA_JITTER_MS', 0) if jitter_ms is None else jitter_ms)
+        self._frames = {}
+        self._lock = threading.Lock()
+
+    def _delay(self):
+        delay = self.latency_ms + (random.uniform(0, self.jitter_ms) if self.jitter_ms else 0)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+
+    def _load_json(self, symbol, filename, default):
+        path = os.path.join(_fixture_dir(self.fixtures_dir, symbol), filename)
+        if not os.path.exists(path):
+            return default
+        with open(path) as f:
+            return json.load(f)
+
+    def _load_history(self, symbol, interval):
+        key = (symbol.upper(), interval)
+        with self._lock:
+            if key in self._frames:
+                return self._frames[key]
+
+        path = os.path.join(_fixture_dir(self.fixtures_dir, symbol), f'history_{interval}.csv')
+        if os.path.exists(path):
+            frame = pd.read_csv(path, index_col=0)
+            frame.index = pd.to_datetime(frame.index, utc=True)
+            tz = self._load_json(symbol, 'meta.json', {}).get('tz')
+            if tz:
+                frame.index = frame.index.tz_convert(tz)
+            frame = frame.sort_index()
+        else:
+            frame = pd.DataFrame(columns=OHLCV_COLUMNS)
+
+        with self._lock:
+            self._frames[key] = frame
+        return frame
+
+    def history(self, symbol, period=None, interval='1d', start=None, end=None):
+        self._delay()
+        return self._replay_history(symbol, period, interval, start, end)
+
+    def download(self, symbols, period='5d', interval='1d'):
+        # A bulk download is a single upstream round trip
+        self._delay()
+        return _stack_histories(symbols, [self._replay_history(symbol, period, interval, None, None) for symbol in symbols])
+
+    def _replay_history(self, symbol, period, interval, start, end):
+        frame = self._load_history(symbol, interval)
+        if frame.empty:
+            return frame.copy()
+
+        tz = frame.index.tz
+        if start is not None or end is not None:
+            if start is not None:
+                start = pd.Timestamp(start)
+                frame = frame[frame.index >= (start.tz_localize(tz) if start.tz is None else start)]
+            if end is not None:
+                end = pd.Timestamp(end)
+                frame = frame[frame.index < (end.tz_localize(tz) if end.tz is None else end)]
+            return frame.copy()
+
+        period = period or '1mo'
+        if period == 'max':
+            return frame.copy()
+        anchor = frame.index[-1]
+        if period == 'ytd':
+            return frame[frame.index.year == anchor.year].copy()
+        match = re.match(r'^(\d+)(d|wk|mo|y)$', period)
+        count, unit = (int(match.group(1)), match.group(2)) if match else (1, 'mo')
+        if unit == 'd':
+            return frame.iloc[-count:].copy()
+        if unit == 'wk':
+            begin = anchor - timedelta(weeks=count)
+        elif unit == 'mo':
+            begin = anchor - pd.DateOffset(months=count)
+        else:
+            begin = anchor - pd.DateOffset(years=count)
+        return frame[frame.index > begin].copy()
+
+    def info(self, symbol):
+        self._delay()
+        return self._load_json(symbol, 'info.json', {})
+
+    def news(self, symbol):
+        self._delay()
+        return self._load_json(symbol, 'news.json', [])
+
+
+class RecordingProvider(MarketDataProvider):
+    """Pass-through backend that saves every response as a replay fixture"""
+
+    name = 'record'
+
+    def __init__(self, upstream=None, fixtures_dir=None):
+        self.upstream = upstream or YFinanceProvider()
+        self.fixtures_dir = fixtures_dir or FIXTURES_DIR
+        self._lock = threading.Lock()
+
+    def _write_json(self, symbol, filename, data):
+        directory = _fixture_dir(self.fixtures_dir, symbol)
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, filename), 'w') as f:
+            json.dump(data, f, default=str)
+
+    def history(self, symbol, period=None, interval='1d', start=None, end=None):
+        hist = self.upstream.history(symbol, period=period, interval=interval, start=start, end=end)
+        if hist is None or hist.empty:
+            return hist
+
+        directory = _fixture_dir(self.fixtures_dir, symbol)
+        path = os.path.join(directory, f'history_{interval}.csv')
+        with self._lock:
+            os.makedirs(directory, exist_ok=True)
+            frame = hist[[col for col in OHLCV_COLUMNS if col in hist.columns]]
+            if os.path.exists(path):
+                # Merge with previously recorded bars, newest values win
+                existing = pd.read_csv(path, index_col=0)
+                existing.index = pd.to_datetime(existing.index, utc=True)
+                recorded = frame.copy()
+                recorded.index = recorded.index.tz_convert('UTC') if recorded.index.tz is not None else recorded.index.tz_localize('UTC')
+                frame = pd.concat([existing, recorded])
+                frame = frame[~frame.index.duplicated(keep='last')].sort_index()
+            frame.to_csv(path)
+            if hist.index.tz is not None:
+                self._write_json(symbol, 'meta.json', {'tz': str(hist.index.tz)})
+        return hist
+
+    def info(self, symbol):
+        info = self.upstream.info(symbol)
+        if info:
+            self._write_json(symbol, 'info.json', info)
+        return info
+
+    def news(self, symbol):
+        news = self.upstream.news(symbol)
+        if news:
+            self._write_json(symbol, 'news.json', news)
+        return news
+
+
+# Registry of available backends, keyed by MARKET_DATA_PROVIDER value
+_provider_factories = {
+    'yfinance': YFinanceProvider,
+    'replay': ReplayProvider,
+    'record': RecordingProvider,
+}
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def register_provider(name, factory):
+    """Register a provider factory under a name usable in MARKET_DATA_PROVIDER"""
+    _provider_factories[name] = factory
+
+
+def set_provider(provider):
+    """Install a provider instance (or registered provider name) for all services"""
+    global _provider
+    if isinstance(provider, str):
+        provider = _provider_factories[provider]()
+    with _provider_lock:
+        _provider = provider
+    return provider
+
+
+def get_provider():
+    """Get the active market data provider, creating it from the environment on first use"""
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                name = os.environ.get('MARKET_DATA_PROVIDER', 'yfinance')
+                if name not in _provider_factories:
+                    raise ValueError(f'Unknown market data provider: {name}')
+                _provider = _provider_factories[name]()
+    return _provider
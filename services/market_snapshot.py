@@ -0,0 +1,206 @@
+"""
+Global market snapshot.
+
+Market indices and the six Yahoo market lists are the same for every user, so
+a background refresher rebuilds them on a fixed cadence into one snapshot in
+the shared cache. Request handlers only read the latest snapshot and never
+wait on upstream. With a shared cache backend, a lease ensures only one
+worker process rebuilds the snapshot per cycle; the others adopt its result.
+"""
+import os
+import time
+import threading
+import concurrent.futures
+from datetime import datetime
+
+from services.cache import cache
+from services.stock_service import get_market_indices
+from services.yahoo_scraper import get_yahoo_market_stocks
+
+# Seconds between snapshot rebuilds
+REFRESH_SECONDS = int(os.environ.get('MARKET_SNAPSHOT_REFRESH_SECONDS', 120))
+
+# Snapshot field -> get_yahoo_market_stocks category
+CATEGORIES = {
+    'most_active': 'most-active',
+    'trending': 'trending',
+    'gainers': 'gainers',
+    'losers': 'losers',
+    'week52_gainers': '52-week-gainers',
+    'week52_losers': '52-week-losers',
+}
+
+_NAMESPACE = 'snapshot'
+_KEY = 'market'
+_LEASE_KEY = f"{_NAMESPACE}:{_KEY}:refresh"
+
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(CATEGORIES) + 1, thread_name_prefix='snapshot')
+
+
+def _to_float(value):
+    return float(value) if value not in ('N/A', '') else 0.0
+
+
+def _normalize_stocks(stocks):
+    """Ensure numeric fields of scraped stock rows are floats"""
+    for stock in stocks:
+        try:
+            for field in ('price', 'change', 'change_percent'):
+                if field in stock:
+                    stock[field] = _to_float(stock[field])
+        except (ValueError, TypeError) as e:
+            print(f"Error converting stock data values: {e}")
+    return stocks
+
+
+def empty_snapshot():
+    """Snapshot served before the first refresh has completed"""
+    snapshot = {field: [] for field in CATEGORIES}
+    snapshot['indices'] = {}
+    snapshot['updated_at'] = None
+    return snapshot
+
+
+def build_snapshot(previous=None):
+    """
+    Fetch indices and every market list in parallel
+
+    Args:
+        previous: Last good snapshot; its sections are kept when a fetch fails
+
+    Returns:
+        Snapshot dictionary with 'indices', one list per category and 'updated_at'
+    """
+    previous = previous or empty_snapshot()
+
+    indices_future = _executor.submit(get_market_indices)
+    futures = {field: _executor.submit(get_yahoo_market_stocks, category) for field, category in CATEGORIES.items()}
+
+    snapshot = {}
+    try:
+        indices = indices_future.result()
+    except Exception as e:
+        print(f"Error refreshing market indices: {e}")
+        indices = None
+    snapshot['indices'] = indices or previous['indices']
+
+    for field, future in futures.items():
+        try:
+            stocks = future.result()
+        except Exception as e:
+            print(f"Error refreshing {CATEGORIES[field]} stocks: {e}")
+            stocks = None
+        # Scraper errors come back as dicts; keep serving the last good list
+        snapshot[field] = _normalize_stocks(stocks) if isinstance(stocks, list) and stocks else previous[field]
+
+    snapshot['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return snapshot
+
+
+class MarketSnapshotRefresher:
+    """Daemon thread rebuilding the market snapshot every ``interval`` seconds"""
+
+    def __init__(self, interval=REFRESH_SECONDS):
+        self.interval = interval
+        self.refreshes = 0
+        self.errors = 0
+        self.last_duration = None
+        self._latest = None
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        # Threads do not survive a fork, so a refresher started before it is dead
+        return self._thread is not None and self._thread.is_alive() and self._pid == os.getpid()
+
+    def start(self):
+        """Start the refresher thread in this process if it is not already running"""
+        with self._lock:
+            if self.running:
+                return
+            self._stop.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='market-snapshot', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def latest(self):
+        """The most recent snapshot built by any process, or None"""
+        entry = cache.peek(_NAMESPACE, _KEY)
+        if entry is not None:
+            self._latest = entry[0]
+        return self._latest
+
+    def refresh(self, force=False):
+        """
+        Rebuild the snapshot if it is due and no other process is rebuilding it
+
+        Returns:
+            True if this call rebuilt the snapshot
+        """
+        entry = cache.peek(_NAMESPACE, _KEY)
+        if entry is not None:
+            self._latest = entry[0]
+            if not force and entry[1] < self.interval:
+                return False
+
+        if not cache.store.acquire_lease(_LEASE_KEY, seconds=max(self.interval, 60)):
+            return False
+        try:
+            started = time.time()
+            snapshot = build_snapshot(self._latest)
+            cache.set(_NAMESPACE, _KEY, snapshot)
+            self._latest = snapshot
+            self.refreshes += 1
+            self.last_duration = round(time.time() - started, 3)
+            return True
+        finally:
+            cache.store.release_lease(_LEASE_KEY)
+
+    def _run(self):
+        # Poll more often than the cadence so a worker notices promptly when
+        # the process that owned the refresh has gone away
+        poll = min(self.interval, 15)
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                self.errors += 1
+                print(f"Error refreshing market snapshot: {e}")
+            self._stop.wait(poll)
+
+    def stats(self):
+        snapshot = self._latest
+        return {
+            'interval': self.interval,
+            'running': self.running,
+            'refreshes': self.refreshes,
+            'errors': self.errors,
+            'last_duration': self.last_duration,
+            'updated_at': snapshot.get('updated_at') if snapshot else None
+        }
+
+
+refresher = MarketSnapshotRefresher()
+
+
+def start_refresher():
+    """Start the background refresher for this process (idempotent)"""
+    refresher.start()
+
+
+def get_market_snapshot():
+    """
+    Get the latest global market snapshot without touching upstream
+
+    Returns:
+        Snapshot dictionary; sections are empty until the first refresh completes
+    """
+    # Workers forked after startup start their own refresher on first use
+    refresher.start()
+    return refresher.latest() or empty_snapshot()
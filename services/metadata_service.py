@@ -0,0 +1,252 @@
+"""
+Ticker metadata store.
+
+Slow-changing ticker fields (name, sector, industry, market cap, beta,
+52-week stats, valuation ratios, description) are fetched from the
+provider's ``.info`` at most once per symbol per TTL (a day by default) and
+persisted to a JSON file, so restarts and other worker processes reuse them.
+Expired records keep being served while a background batch refreshes them,
+and quote paths only ever read names without blocking.
+"""
+import os
+import json
+import time
+import threading
+import concurrent.futures
+
+from services import DATA_DIR
+from services.market_data import get_provider
+from services.singleflight import get_group
+
+METADATA_PATH = os.environ.get('METADATA_PATH', os.path.join(DATA_DIR, 'metadata.json'))
+METADATA_TTL_SECONDS = int(os.environ.get('METADATA_TTL_SECONDS', 24 * 3600))
+
+# Record field -> yfinance ``.info`` keys, first present key wins
+INFO_FIELDS = {
+    'name': ('shortName', 'longName'),
+    'long_name': ('longName', 'shortName'),
+    'sector': ('sector',),
+    'industry': ('industry',),
+    'exchange': ('exchange',),
+    'currency': ('currency',),
+    'market_cap': ('marketCap',),
+    'beta': ('beta',),
+    'fifty_two_week_high': ('fiftyTwoWeekHigh',),
+    'fifty_two_week_low': ('fiftyTwoWeekLow',),
+    'fifty_two_week_change': ('52WeekChange', 'fiftyTwoWeekChange'),
+    'pe_ratio': ('trailingPE',),
+    'eps': ('trailingEps',),
+    'dividend_yield': ('dividendYield',),
+    'book_value': ('bookValue',),
+    'avg_volume': ('averageVolume',),
+    'description': ('longBusinessSummary',),
+}
+
+_records = {}
+_names = {}
+_pending = set()
+_loaded = False
+_lock = threading.Lock()
+_write_lock = threading.Lock()
+_flight = get_group('metadata')
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix='metadata')
+
+
+def _record_from_info(symbol, info):
+    record = {'symbol': symbol}
+    for field, keys in INFO_FIELDS.items():
+        record[field] = next((info[key] for key in keys if info.get(key) is not None), None)
+    record['fetched_at'] = time.time()
+    return record
+
+
+def _read_file():
+    try:
+        with open(METADATA_PATH) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"Error reading metadata store: {e}")
+        return {}
+
+
+def _ensure_loaded():
+    global _loaded
+    if _loaded:
+        return
+    records = _read_file()
+    with _lock:
+        if not _loaded:
+            for symbol, record in records.items():
+                _records.setdefault(symbol, record)
+            _loaded = True
+
+
+def _save(records):
+    """Merge records into the file, keeping the newer copy when another process wrote one too"""
+    with _write_lock:
+        merged = _read_file()
+        for symbol, record in records.items():
+            current = merged.get(symbol)
+            if current is None or current.get('fetched_at', 0) <= record['fetched_at']:
+                merged[symbol] = record
+        os.makedirs(os.path.dirname(os.path.abspath(METADATA_PATH)), exist_ok=True)
+        tmp_path = f"{METADATA_PATH}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(merged, f, default=str)
+        os.replace(tmp_path, METADATA_PATH)
+
+
+def _persist(records):
+    if not records:
+        return
+    try:
+        _save(records)
+    except OSError as e:
+        print(f"Error writing metadata store: {e}")
+
+
+def _is_fresh(record):
+    return time.time() - record.get('fetched_at', 0) < METADATA_TTL_SECONDS
+
+
+def _fetch(symbol):
+    info = get_provider().info(symbol) or {}
+    record = _record_from_info(symbol, info)
+    with _lock:
+        _records[symbol] = record
+    return record
+
+
+def _fetch_many(symbols):
+    """Fetch records for several symbols in parallel and persist them in one write"""
+    futures = {symbol: _executor.submit(_flight.do, symbol, _fetch, symbol) for symbol in symbols}
+    records = {}
+    for symbol, future in futures.items():
+        try:
+            records[symbol] = future.result()
+        except Exception as e:
+            print(f"Error fetching metadata for {symbol}: {e}")
+    _persist(records)
+    return records
+
+
+def _refresh_in_background(symbols):
+    with _lock:
+        symbols = [symbol for symbol in symbols if symbol not in _pending]
+        _pending.update(symbols)
+    if not symbols:
+        return
+
+    def run():
+        try:
+            _fetch_many(symbols)
+        finally:
+            with _lock:
+                _pending.difference_update(symbols)
+
+    threading.Thread(target=run, name='metadata-refresh', daemon=True).start()
+
+
+def get_metadata_many(symbols, wait=True):
+    """
+    Get metadata records for several symbols
+
+    Fresh records come from memory (or the on-disk store). Expired records are
+    returned as-is and refreshed in one background batch.
+
+    Args:
+        symbols: List of stock ticker symbols
+        wait: Fetch symbols with no record at all before returning; when False
+            they are fetched in the background and omitted from the result
+
+    Returns:
+        Dictionary mapping symbol to its metadata record
+    """
+    _ensure_loaded()
+    result = {}
+    missing = []
+    stale = []
+    with _lock:
+        for symbol in dict.fromkeys(symbols):
+            record = _records.get(symbol)
+            if record is None:
+                missing.append(symbol)
+                continue
+            result[symbol] = record
+            if not _is_fresh(record):
+                stale.append(symbol)
+
+    if stale:
+        _refresh_in_background(stale)
+    if missing:
+        if wait:
+            result.update(_fetch_many(missing))
+        else:
+            _refresh_in_background(missing)
+    return result
+
+
+def get_metadata(symbol):
+    """
+    Get the metadata record for one symbol
+
+    Returns:
+        Record dictionary (fields are None when the provider has no value);
+        raises if the symbol has never been fetched and the fetch fails
+    """
+    _ensure_loaded()
+    with _lock:
+        record = _records.get(symbol)
+    if record is None:
+        record = _flight.do(symbol, _fetch, symbol)
+        _persist({symbol: record})
+    elif not _is_fresh(record):
+        _refresh_in_background([symbol])
+    return record
+
+
+def get_company_name(symbol, default=None):
+    """Display name for a symbol from the metadata store"""
+    record = get_metadata(symbol)
+    return record.get('name') or default or symbol
+
+
+def seed_names(names):
+    """Add known symbol -> name pairs (e.g. from the watchlist table) to the cache"""
+    with _lock:
+        for symbol, name in names.items():
+            if name:
+                _names.setdefault(symbol, name)
+
+
+def get_names(symbols):
+    """
+    Get company names for a list of symbols without blocking on upstream
+
+    Args:
+        symbols: List of stock ticker symbols
+
+    Returns:
+        Dictionary mapping each symbol to its cached name (or the symbol itself
+        while the name is still being fetched)
+    """
+    _ensure_loaded()
+    result = {}
+    unknown = []
+    with _lock:
+        for symbol in symbols:
+            record = _records.get(symbol)
+            if record is not None and record.get('name'):
+                result[symbol] = record['name']
+            elif symbol in _names:
+                result[symbol] = _names[symbol]
+            else:
+                result[symbol] = symbol
+                if record is None:
+                    unknown.append(symbol)
+
+    if unknown:
+        get_metadata_many(unknown, wait=False)
+    return result
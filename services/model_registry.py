@@ -0,0 +1,175 @@
+"""
+Registry of fitted prediction models.
+
+A model fitted on a symbol's history stays valid until a new bar arrives, so
+fitted objects are kept under a key of (symbol, feature-set version, last
+bar date): in memory with LRU eviction, and pickled to disk so other worker
+processes and restarts reuse them. Concurrent requests for the same key
+share one fit, and cold fits run on a bounded pool so a burst of new symbols
+cannot occupy every CPU. Fitting a model for a new bar removes the files of
+the symbol's older bars.
+"""
+import os
+import re
+import pickle
+import threading
+import concurrent.futures
+from collections import OrderedDict
+
+from services import DATA_DIR
+from services.singleflight import get_group
+
+MODEL_DIR = os.environ.get('MODEL_DIR', os.path.join(DATA_DIR, 'models'))
+
+# Fitted models kept in memory per process
+MODEL_CACHE_SIZE = int(os.environ.get('MODEL_CACHE_SIZE', 256))
+
+# Pickled models kept on disk (least recently used files are removed first)
+MODEL_DISK_LIMIT = int(os.environ.get('MODEL_DISK_LIMIT', 2000))
+
+# Threads fitting models concurrently in each process
+MODEL_FIT_WORKERS = int(os.environ.get('MODEL_FIT_WORKERS', 2))
+
+
+def _safe(value):
+    return re.sub(r'[^A-Za-z0-9._^=-]', '_', str(value).upper())
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass  # Already removed by another process
+
+
+class ModelRegistry:
+    """Fitted models by (symbol, version, last bar date), cached in memory and on disk"""
+
+    def __init__(self, directory=MODEL_DIR, max_models=MODEL_CACHE_SIZE, max_files=MODEL_DISK_LIMIT,
+                 workers=MODEL_FIT_WORKERS):
+        self.directory = directory
+        self.max_models = max_models
+        self.max_files = max_files
+        self.workers = workers
+        self.hits = 0
+        self.disk_hits = 0
+        self.fits = 0
+        self.evictions = 0
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        self._flight = get_group('models')
+        self._executor = None
+        self._pid = None
+
+    def _get_executor(self):
+        # Threads do not survive a fork, so each process builds its own pool
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers,
+                                                                       thread_name_prefix='model-fit')
+                self._pid = os.getpid()
+            return self._executor
+
+    def _path(self, symbol, version, as_of):
+        return os.path.join(self.directory, f"{_safe(symbol)}-v{_safe(version)}-{_safe(as_of)}.pkl")
+
+    def _remember(self, key, model, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+            self._models[key] = model
+            self._models.move_to_end(key)
+            while len(self._models) > self.max_models:
+                self._models.popitem(last=False)
+                self.evictions += 1
+
+    def _load(self, path):
+        try:
+            with open(path, 'rb') as f:
+                model = pickle.load(f)
+            os.utime(path)  # Mark as recently used for disk eviction
+            return model
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Error loading model {path}: {e}")
+            return None
+
+    def _save(self, path, symbol, version, model):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+            self._prune(path, f"{_safe(symbol)}-v{_safe(version)}-")
+        except OSError as e:
+            print(f"Error saving model {path}: {e}")
+
+    def _prune(self, keep, prefix):
+        """Remove the symbol's models for older bars, then the least recently used files over the limit"""
+        files = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.pkl') or entry.path == keep:
+                continue
+            if entry.name.startswith(prefix):
+                _remove(entry.path)
+                continue
+            try:
+                files.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                pass  # Pruned by a concurrent save
+        excess = len(files) + 1 - self.max_files
+        for _, path in sorted(files)[:max(excess, 0)]:
+            _remove(path)
+
+    def _load_or_fit(self, key, path, fit, args):
+        model = self._load(path)
+        if model is not None:
+            self._remember(key, model, 'disk_hits')
+            return model
+        # Fit on the bounded pool; the waiting request thread holds no CPU
+        model = self._get_executor().submit(fit, *args).result()
+        self._save(path, key[0], key[1], model)
+        self._remember(key, model, 'fits')
+        return model
+
+    def get_or_fit(self, symbol, version, as_of, fit, *args):
+        """
+        Get the fitted model for a symbol's bars up to ``as_of``, fitting it once if needed
+
+        Args:
+            symbol: Listed symbol
+            version: Feature-set version; bump it whenever features or
+                training change so stale models are not reused
+            as_of: Date of the last bar the model was fitted on
+            fit: Function returning the fitted object (must be picklable),
+                called with *args on the fit pool
+
+        Returns:
+            The fitted object
+        """
+        key = (symbol, str(version), str(as_of))
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self._models.move_to_end(key)
+                self.hits += 1
+                return model
+        path = self._path(symbol, version, as_of)
+        return self._flight.do(':'.join(key), self._load_or_fit, key, path, fit, args)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'models': len(self._models),
+                'max_models': self.max_models,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'fits': self.fits,
+                'evictions': self.evictions,
+                'fit_workers': self.workers,
+            }
+
+
+# Process-wide registry shared by the prediction services
+registry = ModelRegistry()
@@ -0,0 +1,308 @@
+"""
+Portfolio backtests.
+
+Symbols from exchanges with different trading calendars (e.g. US listings and
+``.NS`` stocks) are aligned on one calendar-date index as a dense
+(date x symbol) price matrix plus a mask of the dates each symbol actually
+traded. A predefined strategy's signals are computed for every column at once
+on each symbol's own trading days, positions are held across the other
+markets' holidays, and the portfolio is reset to its target weights on a
+rebalancing schedule. Equity, drawdown and per-asset contribution are matrix
+operations over the whole grid.
+"""
+import concurrent.futures
+
+import numpy as np
+import pandas as pd
+
+from services import backtest_engine
+from services.bar_store import get_history
+from services.batch_backtest import strategy_grid
+from services.symbol_resolver import resolve_many, normalize
+from services.trade_ledger import span_years
+
+# Rebalancing schedules (pandas period codes; None rebalances only at the start)
+REBALANCE_FREQUENCIES = {
+    'none': None,
+    'daily': 'D',
+    'weekly': 'W',
+    'monthly': 'M',
+    'quarterly': 'Q',
+}
+
+# Largest number of assets in one portfolio backtest
+MAX_ASSETS = 100
+
+_FETCH_WORKERS = 8
+
+
+def _ffill(matrix, mask=None):
+    """Carry the last valid value of each column forward (valid = finite unless a mask is given)"""
+    valid = np.isfinite(matrix) if mask is None else mask
+    rows = np.where(valid, np.arange(len(matrix))[:, None], 0)
+    np.maximum.accumulate(rows, axis=0, out=rows)
+    return matrix[rows, np.arange(matrix.shape[1])]
+
+
+def _column_frame(histories, column):
+    """(date x symbol) frame of one history column on exchange-local calendar dates"""
+    columns = {}
+    for symbol, data in histories.items():
+        index = data.index.tz_localize(None) if data.index.tz is not None else data.index
+        values = pd.Series(data[column].to_numpy(dtype=np.float64), index=index.normalize())
+        columns[symbol] = values[~values.index.duplicated(keep='last')]
+    return pd.DataFrame(columns).sort_index()
+
+
+def align_prices(histories):
+    """
+    Align close prices of several symbols on one calendar-date index
+
+    Args:
+        histories: Dictionary mapping symbols to ``get_history`` DataFrames
+
+    Returns:
+        Tuple of (dates, prices, mask): the union of exchange-local trading
+        dates, a (date x symbol) float matrix with NaN where a symbol did not
+        trade, and the boolean mask of the dates each symbol traded
+    """
+    frame = _column_frame(histories, 'Close')
+    prices = frame.to_numpy(dtype=np.float64)
+    return frame.index, prices, np.isfinite(prices)
+
+
+def align_fields(histories, dates, fields):
+    """
+    Align other price fields (open, high, low, volume) like ``align_prices``
+
+    Args:
+        histories: Dictionary mapping symbols to ``get_history`` DataFrames
+        dates: Date index returned by ``align_prices``
+        fields: Field names (close is skipped)
+
+    Returns:
+        Dictionary mapping each field to its (date x symbol) float matrix
+    """
+    return {field: _column_frame(histories, field.capitalize()).reindex(dates).to_numpy(dtype=np.float64)
+            for field in fields if field != 'close'}
+
+
+def _own_calendar(prices, mask):
+    """
+    Stack each column's traded prices from row 0, in its own trading-day order
+
+    Returns:
+        Tuple of (packed, own): the packed matrix, its tail padded with each
+        column's last price, and the mask of rows holding real bars
+    """
+    counts = mask.sum(axis=0)
+    own = np.arange(int(counts.max()))[:, None] < counts
+    packed = np.full(own.shape, np.nan)
+    # Column-major boolean indexing keeps each column's values in time order
+    packed.T[own.T] = prices.T[mask.T]
+    return _ffill(packed), own
+
+
+def matrix_signals(strategy_type, parameters, prices, mask, fields=None):
+    """
+    Strategy signals for every column of an aligned price matrix
+
+    Indicators run on each symbol's own trading days; on dates a symbol does
+    not trade its last signal is held.
+
+    Args:
+        fields: Optional dictionary of other aligned price fields (see
+            ``align_fields``), for custom rules
+
+    Returns:
+        int8 (date x symbol) matrix of signals
+    """
+    packed, own = _own_calendar(prices, mask)
+    # Other fields are packed on the same trading days as the close
+    packed_fields = {field: _own_calendar(values, mask)[0] for field, values in (fields or {}).items()}
+    packed_signals = backtest_engine.strategy_signals(strategy_type, packed, parameters, packed_fields)
+    signals = np.zeros(prices.shape, dtype=np.int8)
+    signals.T[mask.T] = packed_signals.T[own.T]
+    return _ffill(signals, mask)
+
+
+def rebalance_dates(dates, frequency):
+    """Boolean array marking the dates the portfolio is reset to its target weights"""
+    code = REBALANCE_FREQUENCIES[frequency]
+    starts = np.zeros(len(dates), dtype=bool)
+    if len(dates):
+        starts[0] = True
+    if code == 'D':
+        starts[:] = True
+    elif code is not None:
+        periods = dates.to_period(code)
+        starts[1:] = periods[1:] != periods[:-1]
+    return starts
+
+
+def simulate(prices, mask, signals, weights, starts):
+    """
+    Portfolio equity and per-asset P&L for given signals and target weights
+
+    Each asset has a sleeve worth its target weight of the portfolio at every
+    rebalancing date. Between rebalances a sleeve grows with the asset's
+    return while the previous day's signal is long (falls when short) and
+    holds cash while flat.
+
+    Args:
+        prices: (date x symbol) close matrix with NaN where not traded
+        mask: Boolean matrix of traded dates
+        signals: int8 signal matrix
+        weights: Target weight per symbol (summing to 1)
+        starts: Boolean array of rebalancing dates (the first date included)
+
+    Returns:
+        Tuple of (equity, pnl): portfolio value per date starting at 1, and
+        the (date x symbol) P&L matrix in units of starting capital
+    """
+    filled = _ffill(prices, mask)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = np.nan_to_num(filled[1:] / filled[:-1] - 1.0, nan=0.0, posinf=0.0, neginf=0.0)
+    # Today's return is earned by yesterday's signal; a sleeve cannot fall below zero
+    step = np.maximum(returns * signals[:-1], -1.0)
+    growth = np.vstack([np.ones(len(weights)), np.cumprod(1.0 + step, axis=0)])
+
+    first = np.flatnonzero(starts)
+    period = np.cumsum(starts) - 1
+    base = growth[first]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        relative = np.nan_to_num(growth / base[period])
+        # Portfolio growth over each rebalancing period, compounded across periods
+        period_growth = (np.nan_to_num(growth[first[1:]] / base[:-1]) * weights).sum(axis=1)
+    start_value = np.concatenate([[1.0], np.cumprod(period_growth)])
+
+    holdings = start_value[period][:, None] * weights * relative
+    equity = holdings.sum(axis=1)
+    pnl = np.zeros(prices.shape)
+    pnl[1:] = holdings[:-1] * step
+    return equity, pnl
+
+
+def _fetch(symbol, start_date, end_date):
+    return get_history(symbol, start=start_date, end=end_date)
+
+
+def backtest_portfolio(symbols, strategy_type, parameters, start_date, end_date, weights=None, rebalance='monthly'):
+    """
+    Backtest a strategy on a multi-asset portfolio
+
+    Args:
+        symbols: List of user-entered symbols
+        strategy_type: Predefined strategy id
+        parameters: Dictionary of strategy parameters (defaults for omitted ones)
+        start_date: Start date for backtesting
+        end_date: End date for backtesting
+        weights: Optional dictionary of target weights per input symbol
+            (normalized to sum to 1; equal weights by default)
+        rebalance: One of REBALANCE_FREQUENCIES
+
+    Returns:
+        Dictionary with portfolio metrics, per-asset contribution and chart data
+    """
+    try:
+        try:
+            grid = strategy_grid(strategy_type, parameters)
+            fields = backtest_engine.price_fields(strategy_type, grid)
+        except ValueError as e:
+            return {'error': str(e)}
+        if rebalance not in REBALANCE_FREQUENCIES:
+            return {'error': f'Unknown rebalance frequency: {rebalance}'}
+        symbols = list(dict.fromkeys(normalize(s) for s in symbols or [] if normalize(s)))
+        if not symbols:
+            return {'error': 'No symbols given'}
+        if len(symbols) > MAX_ASSETS:
+            return {'error': f'Too many symbols ({len(symbols)}, limit {MAX_ASSETS})'}
+
+        targets = {normalize(k): float(v) for k, v in (weights or {}).items()}
+        if any(w < 0 for w in targets.values()):
+            return {'error': 'Weights must not be negative'}
+
+        resolved = resolve_many(symbols)
+        listed = {symbol: resolved.get(symbol) or symbol for symbol in symbols}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=_FETCH_WORKERS) as executor:
+            futures = {symbol: executor.submit(_fetch, listed[symbol], start_date, end_date) for symbol in symbols}
+
+        histories = {}
+        skipped = []
+        for symbol, future in futures.items():
+            try:
+                data = future.result()
+            except Exception as e:
+                print(f"Error fetching data for {listed[symbol]}: {e}")
+                data = pd.DataFrame()
+            if data.empty or not np.isfinite(data['Close'].to_numpy(dtype=np.float64)).any():
+                skipped.append(listed[symbol])
+            else:
+                histories[symbol] = data
+        if not histories:
+            return {'error': 'No data available for these symbols and date range.'}
+
+        inputs = list(histories)
+        dates, prices, mask = align_prices(histories)
+        target = np.array([targets.get(symbol, 0.0 if targets else 1.0) for symbol in inputs])
+        if target.sum() <= 0:
+            return {'error': 'Weights must not all be zero'}
+        target = target / target.sum()
+
+        signal_parameters = {name: values[0] for name, values in grid.items()}
+        signals = matrix_signals(strategy_type, signal_parameters, prices, mask,
+                                 align_fields(histories, dates, fields))
+        starts = rebalance_dates(dates, rebalance)
+        equity, pnl = simulate(prices, mask, signals, target, starts)
+
+        drawdown = 1.0 - equity / np.maximum.accumulate(equity)
+        years = span_years(dates[0], dates[-1]) if len(dates) > 1 else 0.0
+        total_return = equity[-1] - 1.0
+        cagr = equity[-1] ** (1.0 / years) - 1.0 if years > 0 and equity[-1] > 0 else 0.0
+
+        # Per-asset statistics from whole-matrix reductions
+        filled = _ffill(prices, mask)
+        first_row = mask.argmax(axis=0)
+        last_row = len(mask) - 1 - mask[::-1].argmax(axis=0)
+        columns = np.arange(len(inputs))
+        buy_hold = filled[last_row, columns] / filled[first_row, columns] - 1.0
+        contribution = pnl.sum(axis=0)
+        exposure = (signals[:-1] != 0).sum(axis=0) / max(len(dates) - 1, 1)
+
+        assets = []
+        for j, symbol in enumerate(inputs):
+            assets.append({
+                'symbol': listed[symbol],
+                'weight': float(target[j]),
+                'contribution': float(contribution[j]),
+                'buy_hold_return': float(buy_hold[j]),
+                'exposure': float(exposure[j]),
+                'trading_days': int(mask[:, j].sum()),
+                'first_date': dates[first_row[j]].strftime('%Y-%m-%d'),
+            })
+
+        return {
+            'symbols': [listed[s] for s in inputs],
+            'skipped': skipped,
+            'strategy': strategy_type,
+            'parameters': signal_parameters,
+            'rebalance': rebalance,
+            'start_date': start_date,
+            'end_date': end_date,
+            'metrics': {
+                'total_return': float(total_return),
+                'cagr': float(cagr),
+                'max_drawdown': float(drawdown.max()),
+                'rebalances': int(starts.sum()),
+            },
+            'assets': assets,
+            'chart_data': {
+                'dates': [date.strftime('%Y-%m-%d') for date in dates],
+                'equity': equity.tolist(),
+                'drawdown': drawdown.tolist(),
+            },
+        }
+
+    except Exception as e:
+        print(f"Error backtesting portfolio {symbols}: {e}")
+        return {'error': str(e)}
@@ -0,0 +1,454 @@
+"""
+Stock movement prediction.
+
+Combines technical indicator signals with a direction model (the offline
+universe model from ``services.universe_model``, or a small model fitted on
+the symbol's recent history), simulates a Monte Carlo fan of future prices
+(``services.forecast``) and asks the LLM for a plain-language explanation.
+Runs outside the request cycle as a job (see ``services.jobs``);
+``progress`` reports each stage to the job record.
+"""
+import warnings
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from services import indicators, forecast, universe_model
+from services.bar_store import get_history
+from services.feature_store import indicator_values, pct_change, get_features
+from services.indicator_state import latest_indicators
+from services.llm_gateway import gateway
+from services.metadata_service import get_metadata
+from services.model_registry import registry
+from services.symbol_resolver import canonical_symbol
+
+# Trading days covered by the forecast fan
+FORECAST_HORIZON = 30
+
+# Longest forecast accepted
+MAX_HORIZON = 252
+
+# Trading days a directional view covers (the one-week projection it was tuned for)
+VIEW_DAYS = 7
+
+# Largest total log return a view may add to a forecast
+MAX_VIEW_TILT = 0.07
+
+# Version of the model features and training; bump it when either changes so
+# models fitted the old way are not reused
+FEATURE_VERSION = 2
+
+
+def _no_progress(fraction, message=None):
+    pass
+
+
+def mean_change(values, periods=5):
+    """Average ``periods``-bar percent change over the last ``periods`` bars (per column)"""
+    values = np.asarray(values, dtype=np.float64)
+    with np.errstate(invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # All-NaN columns give NaN
+        return np.nanmean(pct_change(values, periods)[-periods:], axis=0) * 100
+
+
+def direction_target(close, horizon=7):
+    """1 where the close ``horizon`` bars later is higher, else 0 (also for the last bars)"""
+    close = np.asarray(close, dtype=np.float64)
+    target = np.zeros(close.shape, dtype=np.int64)
+    target[:-horizon] = close[horizon:] > close[:-horizon]
+    return target
+
+
+def technical_factors(current_price, sma20, sma50, rsi, macd, signal, upper_band, lower_band,
+                      price_changes, volume_change):
+    """Signals of the technical indicators, as weighted analysis factors"""
+    prediction_factors = []
+    
+    # RSI signals
+    if rsi > 70:
+        prediction_factors.append({"factor": "RSI", "signal": "bearish", "value": rsi, "weight": 0.3})
+    elif rsi < 30:
+        prediction_factors.append({"factor": "RSI", "signal": "bullish", "value": rsi, "weight": 0.3})
+    else:
+        prediction_factors.append({"factor": "RSI", "signal": "neutral", "value": rsi, "weight": 0.1})
+    
+    # Moving average signals
+    if current_price > sma20 and sma20 > sma50:
+        prediction_factors.append({"factor": "Moving Averages", "signal": "bullish", "value": f"Price > SMA20 > SMA50", "weight": 0.25})
+    elif current_price < sma20 and sma20 < sma50:
+        prediction_factors.append({"factor": "Moving Averages", "signal": "bearish", "value": f"Price < SMA20 < SMA50", "weight": 0.25})
+    else:
+        prediction_factors.append({"factor": "Moving Averages", "signal": "neutral", "value": f"Mixed signals", "weight": 0.1})
+    
+    # MACD signals
+    if macd > signal and macd > 0:
+        prediction_factors.append({"factor": "MACD", "signal": "bullish", "value": f"MACD({macd:.2f}) > Signal({signal:.2f})", "weight": 0.25})
+    elif macd < signal and macd < 0:
+        prediction_factors.append({"factor": "MACD", "signal": "bearish", "value": f"MACD({macd:.2f}) < Signal({signal:.2f})", "weight": 0.25})
+    else:
+        prediction_factors.append({"factor": "MACD", "signal": "neutral", "value": f"MACD({macd:.2f}), Signal({signal:.2f})", "weight": 0.1})
+    
+    # Bollinger Bands signals
+    if current_price > upper_band:
+        prediction_factors.append({"factor": "Bollinger Bands", "signal": "bearish", "value": f"Price({current_price:.2f}) > Upper({upper_band:.2f})", "weight": 0.2})
+    elif current_price < lower_band:
+        prediction_factors.append({"factor": "Bollinger Bands", "signal": "bullish", "value": f"Price({current_price:.2f}) < Lower({lower_band:.2f})", "weight": 0.2})
+    else:
+        prediction_factors.append({"factor": "Bollinger Bands", "signal": "neutral", "value": f"Within bands", "weight": 0.1})
+    
+    # Price change momentum
+    if price_changes > 1:
+        prediction_factors.append({"factor": "Price Momentum", "signal": "bullish", "value": f"{price_changes:.2f}%", "weight": 0.2})
+    elif price_changes < -1:
+        prediction_factors.append({"factor": "Price Momentum", "signal": "bearish", "value": f"{price_changes:.2f}%", "weight": 0.2})
+    else:
+        prediction_factors.append({"factor": "Price Momentum", "signal": "neutral", "value": f"{price_changes:.2f}%", "weight": 0.1})
+    
+    # Volume Analysis
+    if volume_change > 20 and price_changes > 0:
+        prediction_factors.append({"factor": "Volume Trend", "signal": "bullish", "value": f"{volume_change:.2f}%", "weight": 0.15})
+    elif volume_change > 20 and price_changes < 0:
+        prediction_factors.append({"factor": "Volume Trend", "signal": "bearish", "value": f"{volume_change:.2f}%", "weight": 0.15})
+    else:
+        prediction_factors.append({"factor": "Volume Trend", "signal": "neutral", "value": f"{volume_change:.2f}%", "weight": 0.05})
+    
+    return prediction_factors
+
+
+def _fit_model(X, y):
+    """Fit the feature scaler and direction classifier on the oldest 80% of rows"""
+    from sklearn.preprocessing import StandardScaler
+    
+    # Scale the features
+    scaler = StandardScaler()
+    X_scaled = scaler.fit_transform(X)
+    
+    # Split data (use most recent data for validation)
+    split_idx = int(len(X_scaled) * 0.8)
+    X_train, y_train = X_scaled[:split_idx], y[:split_idx]
+    
+    # Try more advanced model if enough data
+    if len(X) > 100:
+        from sklearn.ensemble import RandomForestClassifier
+        model = RandomForestClassifier(n_estimators=100, random_state=42)
+    else:
+        # Use logistic regression for smaller datasets
+        from sklearn.linear_model import LogisticRegression
+        model = LogisticRegression(random_state=42)
+    model.fit(X_train, y_train)
+    return scaler, model
+
+
+def model_view(symbol, as_of, features, target):
+    """
+    The direction model's view of a symbol's last bar
+
+    Uses the published universe model (``services.universe_model``) when
+    there is one, so only inference runs; otherwise the symbol's own model
+    from the registry.
+
+    Args:
+        symbol: Listed symbol
+        as_of: Date of the last bar (keys the fitted model)
+        features: Feature rows of the symbol's bars (``services.feature_store``)
+        target: ``direction_target`` of the same bars
+
+    Returns:
+        Tuple of (predicted class, probability of a rise), or None if there
+        are too few complete rows to fit a model
+    """
+    complete = np.isfinite(features).all(axis=1)
+    if universe_model.current() is not None:
+        if not complete[-1]:
+            return None
+        view = universe_model.predict(features[-1:])
+        return int(view[0][0]), float(view[1][0])
+    if complete.sum() <= 30:  # Only use ML if we have enough data
+        return None
+    X, y = features[complete], target[complete]
+    # Reuse the model fitted on these exact bars; fit it once otherwise
+    scaler, model = registry.get_or_fit(symbol, FEATURE_VERSION, as_of, _fit_model, X, y)
+    
+    # Make prediction for current data
+    current_features_scaled = scaler.transform(X[-1:])
+    ml_prediction = model.predict(current_features_scaled)[0]
+    ml_probability = model.predict_proba(current_features_scaled)[0][1]  # Probability of going up
+    return int(ml_prediction), float(ml_probability)
+
+
+def model_factors(ml_prediction, ml_probability, rsi, price_changes):
+    """
+    Analysis factors of the model's view and the sentiment proxy
+
+    Returns:
+        Tuple of (factors, daily drift of the view over VIEW_DAYS; see ``view_drift``)
+    """
+    # Add ML prediction to factors
+    ml_signal = "bullish" if ml_prediction == 1 else "bearish"
+    prediction_factors = [{
+        "factor": "Machine Learning Model", 
+        "signal": ml_signal, 
+        "value": f"{ml_probability:.2f} probability", 
+        "weight": 0.35  # Give ML prediction higher weight
+    }]
+    
+    # Include sentiment analysis from news
+    # This is a simplified approximation using technical indicators as proxy for sentiment
+    sentiment_score = 0
+    if rsi < 30:  # Oversold condition often indicates negative sentiment
+        sentiment_score = -0.5
+    elif rsi > 70:  # Overbought condition often indicates positive sentiment
+        sentiment_score = 0.5
+    
+    # Adjust sentiment based on recent price momentum
+    if price_changes > 3:  # Strong positive momentum
+        sentiment_score += 0.3
+    elif price_changes < -3:  # Strong negative momentum
+        sentiment_score -= 0.3
+    
+    # Add sentiment factor
+    sentiment_signal = "bullish" if sentiment_score > 0.2 else "bearish" if sentiment_score < -0.2 else "neutral"
+    prediction_factors.append({
+        "factor": "Market Sentiment", 
+        "signal": sentiment_signal, 
+        "value": f"{sentiment_score:.2f} score", 
+        "weight": 0.25
+    })
+    
+    # Daily tilt over VIEW_DAYS from the model's confidence and sentiment
+    ml_weight = abs(ml_probability - 0.5) * 2  # 0 to 1 scale
+    ml_adjustment = 0.008 * ml_weight if ml_prediction == 1 else -0.008 * ml_weight
+    sentiment_adjustment = sentiment_score * 0.002
+    drift = ml_adjustment + sentiment_adjustment
+    return prediction_factors, drift
+
+
+def view_drift(drift, horizon):
+    """
+    Daily tilt of the simulated returns for a directional view
+
+    A view's daily drift holds for VIEW_DAYS. Its total move (capped at
+    MAX_VIEW_TILT) is spread over the horizon rather than added to every
+    simulated day, so long forecasts are driven by the history, not by the
+    heuristic.
+    """
+    total = float(np.clip(drift * VIEW_DAYS, -MAX_VIEW_TILT, MAX_VIEW_TILT))
+    return total * min(horizon, VIEW_DAYS) / VIEW_DAYS / horizon
+
+
+def score(prediction_factors):
+    """Overall direction ('up' or 'down') and its confidence in percent"""
+    bullish_score = sum([factor["weight"] for factor in prediction_factors if factor["signal"] == "bullish"])
+    bearish_score = sum([factor["weight"] for factor in prediction_factors if factor["signal"] == "bearish"])
+    
+    # Determine final prediction
+    prediction = "up" if bullish_score > bearish_score else "down"
+    confidence = max(bullish_score, bearish_score) / sum([factor["weight"] for factor in prediction_factors]) * 100
+    return prediction, round(confidence, 1)
+
+
+def explain(symbol, current_price, prediction_factors, prediction, confidence, as_of=None):
+    """
+    Plain-language explanation of a prediction from the LLM
+
+    Falls back to a generic sentence when the LLM is unavailable. Responses
+    are cached by the LLM gateway, so the same prediction on the same bar is
+    only explained once.
+
+    Args:
+        as_of: Date of the last bar the prediction used; the cached
+            explanation is reused until a newer bar arrives
+
+    Returns:
+        Tuple of (company name, explanation)
+    """
+    # Get stock info for context
+    try:
+        stock_info = get_metadata(symbol)
+        company_name = stock_info.get('long_name') or symbol
+        sector = stock_info.get('sector') or 'Unknown Sector'
+        industry = stock_info.get('industry') or 'Unknown Industry'
+    except Exception as e:
+        print(f"Error getting stock info: {e}")
+        company_name = symbol
+        sector = "Unknown Sector"
+        industry = "Unknown Industry"
+    
+    # Format analysis factors for AI prompt
+    factors_text = "\n".join([f"- {factor['factor']}: {factor['signal'].upper()} ({factor['value']})" for factor in prediction_factors])
+    
+    # Generate AI explanation using Groq
+    try:
+        prompt = f"""
+        You are a financial analyst providing an explanation for a stock prediction.
+        
+        Stock: {company_name} ({symbol})
+        Sector: {sector}
+        Industry: {industry}
+        Current Price: ${current_price:.2f}
+        
+        Technical Analysis Factors:
+        {factors_text}
+        
+        Overall Prediction: Stock will likely go {prediction.upper()} with {confidence:.1f}% confidence.
+        
+        Based on this information, provide a detailed but concise explanation of why {symbol} is predicted to go {prediction}. 
+        Focus on the most important technical indicators and their implications. 
+        Explain in clear terms that a retail investor would understand.
+        
+        Structure your explanation in these sections:
+        1. Summary (2-3 sentences)
+        2. Key Technical Indicators (bullet points explaining the most important signals)
+        3. Market Context (1-2 sentences about market conditions)
+        4. Conclusion (1-2 sentences with outlook)
+        
+        Keep your total response under 400 words and focus on being educational and insightful.
+        """
+        
+        explanation = gateway.complete(
+            messages=[
+                {"role": "system", "content": "You are a financial analyst providing stock predictions."},
+                {"role": "user", "content": prompt}
+            ],
+            model="llama3-70b-8192",
+            as_of=as_of,
+            temperature=0.5,
+            max_tokens=600,
+            top_p=1
+        )
+    except Exception as e:
+        print(f"Error generating AI explanation: {e}")
+        explanation = f"Based on technical analysis, {symbol} is predicted to go {prediction} with {confidence:.1f}% confidence. Key factors include RSI, moving averages, MACD, and recent price momentum."
+    return company_name, explanation
+
+
+def predict_stock(symbol, horizon=None, progress=_no_progress):
+    """
+    Predict a stock's movement over the next week and explain it
+
+    Args:
+        symbol: User-entered stock symbol
+        horizon: Trading days to forecast (FORECAST_HORIZON by default)
+        progress: Optional callback taking (fraction done, stage message)
+
+    Returns:
+        Dictionary with the prediction, confidence, explanation, analysis
+        factors and visualization data, or with an 'error' key
+    """
+    try:
+        horizon = min(max(int(horizon or FORECAST_HORIZON), 1), MAX_HORIZON)
+        
+        # Map the input to its listed symbol (e.g. adds .NS for Indian stocks)
+        symbol = canonical_symbol(symbol)
+        
+        # Get stock data
+        progress(0.1, 'Fetching price history')
+        hist = get_history(symbol, period="120d")  # Get more historical data for better prediction
+        
+        if hist.empty:
+            return {
+                "error": f"No data available for {symbol}. For Indian stocks, try adding .NS or .BO suffix."
+            }
+        
+        # Prepare historical data for visualization
+        dates = hist.index.strftime('%Y-%m-%d').tolist()
+        historical_prices = hist['Close'].tolist()
+        
+        # Calculate technical indicators
+        progress(0.3, 'Computing indicators')
+        close = hist['Close'].to_numpy(dtype=np.float64)
+        volume = hist['Volume'].to_numpy(dtype=np.float64)
+        values = indicator_values(close)
+        
+        # Recent values for analysis, updated incrementally from the indicator checkpoint
+        current_price = hist['Close'].iloc[-1]
+        latest = latest_indicators(symbol) or {}
+        rsi = latest.get('rsi14', values['rsi'][-1])
+        price_changes = mean_change(close)  # 5-day average change
+        prediction_factors = technical_factors(
+            current_price,
+            latest.get('sma20', values['sma20'][-1]),
+            latest.get('sma50', values['sma50'][-1]),
+            rsi,
+            latest.get('macd', values['macd'][-1]),
+            latest.get('macd_signal', values['signal'][-1]),
+            latest.get('bb_upper', values['upper'][-1]),
+            latest.get('bb_lower', values['lower'][-1]),
+            price_changes,
+            mean_change(volume)
+        )
+        
+        # Simple Machine Learning Model
+        progress(0.5, 'Running model')
+        
+        # Without a model the simulated returns are tilted by the recent trend
+        drift = 0.002 * (1 if price_changes > 0 else -1)
+        try:
+            # Stored features of these bars, computed once per new bar
+            features = get_features(symbol, start=hist.index[0]).reindex(hist.index).to_numpy()
+            view = model_view(symbol, dates[-1], features, direction_target(close))
+            if view is not None:
+                factors, drift = model_factors(*view, rsi, price_changes)
+                prediction_factors.extend(factors)
+        except Exception as e:
+            # If ML fails, don't add ML factor; keep the trend tilt
+            print(f"Error in machine learning prediction: {e}")
+        
+        # Monte Carlo fan of future prices, seeded by the last bar so refreshes agree
+        progress(0.7, 'Simulating price paths')
+        fan = forecast.forecast_fan(close, horizon, drift=view_drift(drift, horizon),
+                                    seed=forecast.seed_for(symbol, dates[-1]))
+        
+        prediction, confidence = score(prediction_factors)
+        
+        # Generate AI explanation using Groq
+        progress(0.8, 'Generating explanation')
+        company_name, explanation = explain(symbol, current_price, prediction_factors, prediction, confidence,
+                                            as_of=dates[-1])
+        
+        # Format dates for future projection (trading days)
+        last_date = pd.Timestamp(dates[-1])
+        future_dates = pd.bdate_range(last_date + pd.Timedelta(days=1), periods=horizon).strftime('%Y-%m-%d').tolist()
+        
+        # Forecast series are None over the history except the last actual
+        # price, which connects them to the historical line
+        def future_series(values):
+            series = [None] * len(dates)
+            series[-1] = float(current_price)
+            return series + list(values)
+        
+        # Combine historical and future data for visualization
+        visualization_data = {
+            "dates": dates + future_dates,
+            "prices": historical_prices + [None] * horizon,  # Historical prices with None for future dates
+            "predicted": future_series(fan['bands'][50]),  # Median simulated path
+            "bands": {f"p{p}": future_series(band) for p, band in fan['bands'].items()}
+        }
+        
+        result = {
+            "symbol": symbol,
+            "company_name": company_name,
+            "current_price": current_price,
+            "prediction": prediction,
+            "confidence": confidence,
+            "explanation": explanation,
+            "analysis_factors": prediction_factors,
+            "visualization_data": visualization_data,
+            "forecast": {
+                "horizon": horizon,
+                "paths": fan['paths'],
+                "prob_up": fan['prob_up'],
+                "expected_price": fan['expected']
+            },
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+        
+        return result
+        
+    except Exception as e:
+        print(f"Error in stock prediction: {e}")
+        return {
+            "error": f"Failed to analyze {symbol}: {str(e)}",
+            "symbol": symbol
+        }
@@ -0,0 +1,108 @@
+"""
+Bulk quote engine.
+
+All requested symbols are fetched in one multi-symbol download and price,
+change and change percent are computed as column operations over the result,
+so quote latency no longer grows with the number of symbols. Quotes are kept
+briefly in the shared cache so every worker reuses them.
+"""
+import numpy as np
+from datetime import datetime
+
+from services.cache import cache
+from services.market_data import get_provider
+from services.metadata_service import get_names
+
+
+def _last_two_sessions(values):
+    """
+    Row indices of the last and second-to-last valid value in each column
+
+    Symbols on different exchanges have gaps on each other's holidays, so the
+    sessions are located per column rather than taking the last two rows.
+    """
+    valid = ~np.isnan(values)
+    rows = np.arange(values.shape[0])[:, None]
+    last = np.where(valid, rows, -1).max(axis=0, initial=-1)
+    prev = np.where(valid & (rows < last), rows, -1).max(axis=0, initial=-1)
+    return last, prev
+
+
+def get_quotes(symbols, names=None, period='5d'):
+    """
+    Get the latest quote for several symbols with a single download
+
+    Args:
+        symbols: List of stock ticker symbols
+        names: Optional mapping of symbol to display name; other names come
+            from the metadata cache
+        period: Lookback window for the download (must span two sessions)
+
+    Returns:
+        Dictionary mapping symbol to quote data; symbols without data are omitted
+    """
+    symbols = list(dict.fromkeys(symbols))
+    if not symbols:
+        return {}
+
+    result = {}
+    missing = []
+    for symbol in symbols:
+        quote = cache.get('quotes', symbol)
+        if quote is not None:
+            result[symbol] = dict(quote)
+        else:
+            missing.append(symbol)
+
+    if missing:
+        result.update(_download_quotes(missing, period))
+
+    cached_names = get_names(list(result.keys()))
+    if names:
+        cached_names.update({symbol: name for symbol, name in names.items() if name})
+    for symbol, quote in result.items():
+        quote['name'] = cached_names.get(symbol, symbol)
+
+    return {symbol: result[symbol] for symbol in symbols if symbol in result}
+
+
+def _download_quotes(symbols, period):
+    frame = get_provider().download(symbols, period=period)
+    if frame is None or frame.empty:
+        return {}
+
+    close = frame['Close'].reindex(columns=symbols).to_numpy(dtype=np.float64)
+    open_ = frame['Open'].reindex(columns=symbols).to_numpy(dtype=np.float64)
+    volume = frame['Volume'].reindex(columns=symbols).to_numpy(dtype=np.float64)
+
+    last, prev = _last_two_sessions(close)
+    cols = np.arange(len(symbols))
+    last_row = np.clip(last, 0, None)
+    current = close[last_row, cols]
+
+    # Fall back to the session open when only one session is available
+    prev_close = np.where(prev >= 0, close[np.clip(prev, 0, None), cols], open_[last_row, cols])
+    change = current - prev_close
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change_percent = np.where(prev_close != 0, change / prev_close * 100, 0.0)
+    last_volume = np.nan_to_num(volume[last_row, cols]).astype(np.int64)
+
+    current = np.round(current, 2)
+    change = np.round(change, 2)
+    change_percent = np.round(change_percent, 2)
+
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    result = {}
+    for i, symbol in enumerate(symbols):
+        if last[i] < 0:
+            continue
+        result[symbol] = {
+            'symbol': symbol,
+            'price': float(current[i]),
+            'change': float(change[i]),
+            'change_percent': float(change_percent[i]),
+            'volume': int(last_volume[i]),
+            'timestamp': timestamp
+        }
+        cache.set('quotes', symbol, result[symbol])
+    return {symbol: dict(quote) for symbol, quote in result.items()}
@@ -0,0 +1,506 @@
+"""
+Incremental re-evaluation of saved strategies.
+
+A saved strategy keeps the terminal state of its backtest next to its
+metrics: the streaming indicator states behind its signal and the trade
+ledger (position, equity, drawdown peak, open trade and the running sums of
+the ratio metrics). Refreshing it to today then only applies the bars after
+the stored end date, one O(1) update each, and gives the same metrics as
+rerunning the backtest from ``start_date``.
+
+Only completed sessions are committed: histories are read up to yesterday,
+so a bar that may still be forming never enters a stored state. A state is
+rebuilt from the full history when it no longer matches the bars (e.g. a
+split revised the adjusted closes) or the strategy has no streaming form
+(custom rules).
+
+A nightly roller applies new bars to every user's saved strategies in one
+pass over the bar store, fetching each symbol once. Each night is claimed
+in the app database first, so with several worker processes (and a cron
+job) only one of them runs it:
+
+    python -m services.saved_strategies --database stocksense.db
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import threading
+import concurrent.futures
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+from services import backtest_engine
+from services.bar_store import get_history
+from services.batch_backtest import strategy_grid
+from services.indicator_state import SMAState, RollingStdState, WilderRSIState, MACDState, state_from_dict
+from services.strategy_dsl import compile_rule, RuleError
+from services.symbol_resolver import canonical_symbol, resolve_many, normalize
+from services.trade_ledger import RunningLedger, span_years
+
+# Bumped whenever the stored state layout changes; older states are rebuilt
+STATE_VERSION = 1
+
+# Local hour after which the nightly roll-forward runs
+ROLL_HOUR = int(os.environ.get('SAVED_STRATEGY_ROLL_HOUR', 2))
+
+# Threads reading histories from the bar store during a roll-forward
+FETCH_WORKERS = 8
+
+DEFAULT_DATABASE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'stocksense.db')
+
+# Nights the roll-forward has been claimed, one row each
+_ROLL_TABLE = 'strategy_roll_runs'
+
+
+def _indicator_states(strategy_type, parameters):
+    """Streaming indicator states of a predefined strategy, or None if it has no streaming form"""
+    if strategy_type == 'sma_crossover':
+        return {'short': SMAState(parameters['short_window']), 'long': SMAState(parameters['long_window'])}
+    if strategy_type == 'rsi':
+        return {'rsi': WilderRSIState(parameters['rsi_period'])}
+    if strategy_type == 'macd':
+        return {'macd': MACDState(parameters['fast_period'], parameters['slow_period'], parameters['signal_period'])}
+    if strategy_type == 'bollinger':
+        return {'middle': SMAState(parameters['window']), 'std': RollingStdState(parameters['window'])}
+    return None
+
+
+def _signal(strategy_type, parameters, states, close, bar):
+    """Signal at one bar from the updated indicator states (rules of ``backtest_strategy``)"""
+    if strategy_type == 'sma_crossover':
+        return int(bar >= parameters['short_window'] and states['short'].value > states['long'].value)
+    if strategy_type == 'rsi':
+        value = states['rsi'].value
+        return int(value < parameters['oversold'] and not value > parameters['overbought'])
+    if strategy_type == 'macd':
+        line, signal_line, _ = states['macd'].value
+        if bar < parameters['signal_period']:
+            return 0
+        return 1 if line > signal_line else -1 if line < signal_line else 0
+    if strategy_type == 'bollinger':
+        middle = states['middle'].value
+        width = states['std'].value * parameters['num_std']
+        return int(close < middle - width) - int(close > middle + width)
+    raise ValueError(f'Strategy {strategy_type} has no streaming form')
+
+
+def _history_signals(strategy_type, parameters, data):
+    if strategy_type == 'custom':
+        rule = compile_rule(parameters['code'])
+        fields = {field: data[field.capitalize()].to_numpy(dtype=np.float64) for field in rule.fields}
+        return rule.signals(fields)
+    return backtest_engine.strategy_signals(strategy_type, data['Close'].to_numpy(dtype=np.float64), parameters)
+
+
+def _typed_parameters(strategy_type, parameters):
+    """Saved parameters with defaults filled in and values cast to their types"""
+    grid = strategy_grid(strategy_type, parameters)
+    return {name: values[0] for name, values in grid.items()}
+
+
+def _identity(symbol, strategy_type, parameters, start_date):
+    # A stored state is only reused for the backtest it was computed for
+    return json.dumps([symbol, strategy_type, parameters, start_date], sort_keys=True)
+
+
+def _dates(data):
+    return np.asarray(data.index.strftime('%Y-%m-%d'))
+
+
+def _today():
+    return date.today().strftime('%Y-%m-%d')
+
+
+def _metrics(ledger, first_date, last_date):
+    years = span_years(first_date, last_date) if first_date and last_date else 0.0
+    metrics = ledger.metrics(years)
+    if ledger.bars and ledger.first_close:
+        buy_hold = ledger.close / ledger.first_close - 1.0
+        metrics['buy_hold_return'] = float(buy_hold) if np.isfinite(buy_hold) else 0.0
+    else:
+        metrics['buy_hold_return'] = 0.0
+    return metrics
+
+
+def _full_state(identity, strategy_type, parameters, data, end_date):
+    """Terminal state of a backtest over a whole history (vectorized)"""
+    data = data[np.isfinite(data['Close'].to_numpy(dtype=np.float64))]
+    close = data['Close'].to_numpy(dtype=np.float64)
+    signals = _history_signals(strategy_type, parameters, data)
+    dates = _dates(data)
+    states = _indicator_states(strategy_type, parameters)
+    if states is not None:
+        for state in states.values():
+            state.seed(close)
+    return {
+        'version': STATE_VERSION,
+        'identity': identity,
+        'first_date': dates[0] if len(dates) else None,
+        'last_date': dates[-1] if len(dates) else None,
+        'end_date': end_date,
+        'indicators': {name: state.to_dict() for name, state in states.items()} if states is not None else None,
+        'ledger': RunningLedger.from_history(close, signals).to_dict(),
+    }
+
+
+def _roll(state, strategy_type, parameters, data, end_date):
+    """
+    Apply the bars after a state's last date
+
+    Returns:
+        Tuple of (state, bars applied), or None if the state does not match
+        the bars and has to be rebuilt
+    """
+    if state.get('indicators') is None or state.get('last_date') is None:
+        return None
+    dates = _dates(data)
+    close = data['Close'].to_numpy(dtype=np.float64)
+    i = int(np.searchsorted(dates, state['last_date']))
+    ledger = RunningLedger.from_dict(state['ledger'])
+    # The stored last bar must still be there with the same close
+    if i >= len(dates) or dates[i] != state['last_date'] or not np.isclose(close[i], ledger.close, rtol=1e-9):
+        return None
+    new_close = close[i + 1:]
+    if not np.isfinite(new_close).all():
+        return None
+
+    states = {name: state_from_dict(value) for name, value in state['indicators'].items()}
+    for price in new_close:
+        price = float(price)
+        for indicator in states.values():
+            indicator.update(price)
+        ledger.update(price, _signal(strategy_type, parameters, states, price, ledger.bars))
+
+    rolled = dict(state,
+                  last_date=dates[-1],
+                  end_date=end_date,
+                  indicators={name: indicator.to_dict() for name, indicator in states.items()},
+                  ledger=ledger.to_dict())
+    return rolled, len(new_close)
+
+
+def _fetch(symbol, start_date, end_date):
+    try:
+        return get_history(symbol, start=start_date, end=end_date)
+    except Exception as e:
+        print(f"Error fetching data for {symbol}: {e}")
+        return pd.DataFrame()
+
+
+def _end_bound(end_date=None):
+    # Exclusive end: never past today, so today's (possibly forming) bar is left out
+    today = _today()
+    return min(end_date, today) if end_date else today
+
+
+def evaluate(symbol, strategy_type, parameters, start_date, end_date=None, state=None, data=None):
+    """
+    Bring a saved strategy's backtest up to date
+
+    Applies only the bars after ``state``'s last date when the state is still
+    valid, otherwise backtests the whole range once.
+
+    Args:
+        symbol: Saved (user-entered) symbol
+        strategy_type: Strategy id
+        parameters: Saved strategy parameters
+        start_date: Backtest start date
+        end_date: Exclusive end date (defaults to today; capped at today)
+        state: Stored terminal state, or None
+        data: Optional history of the listed symbol covering the bars needed
+            (the whole range for a rebuild)
+
+    Returns:
+        Dictionary with metrics, state, end_date, bars_applied and rebuilt,
+        or with an 'error' key
+    """
+    try:
+        try:
+            parameters = _typed_parameters(strategy_type, parameters)
+        except ValueError as e:
+            return {'error': str(e)}
+        listed = canonical_symbol(symbol)
+        end_date = _end_bound(end_date)
+        identity = _identity(listed, strategy_type, parameters, start_date)
+
+        if state and state.get('version') == STATE_VERSION and state.get('identity') == identity:
+            history = data if data is not None else _fetch(listed, state['last_date'], end_date)
+            if not history.empty:
+                history = history[_dates(history) < end_date]
+            rolled = _roll(state, strategy_type, parameters, history, end_date) if not history.empty else None
+            if rolled is not None:
+                state, applied = rolled
+                ledger = RunningLedger.from_dict(state['ledger'])
+                return {'metrics': _metrics(ledger, state['first_date'], state['last_date']), 'state': state,
+                        'end_date': end_date, 'bars_applied': applied, 'rebuilt': False}
+
+        if data is None or (len(data) and _dates(data)[0] > start_date):
+            data = _fetch(listed, start_date, end_date)
+        else:
+            data = data[_dates(data) >= start_date]
+        if not data.empty:
+            data = data[_dates(data) < end_date]
+        if data.empty:
+            return {'error': f'No data available for this symbol ({listed}) and date range.'}
+        try:
+            state = _full_state(identity, strategy_type, parameters, data, end_date)
+        except RuleError as e:
+            return {'error': f'Invalid custom strategy: {e}'}
+        ledger = RunningLedger.from_dict(state['ledger'])
+        return {'metrics': _metrics(ledger, state['first_date'], state['last_date']), 'state': state,
+                'end_date': end_date, 'bars_applied': ledger.bars, 'rebuilt': True}
+
+    except Exception as e:
+        print(f"Error evaluating saved strategy for {symbol}: {e}")
+        return {'error': str(e)}
+
+
+def _connect(database):
+    conn = sqlite3.connect(database)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _load_state(row):
+    try:
+        return json.loads(row['state']) if row['state'] else None
+    except ValueError:
+        return None
+
+
+def _store(conn, strategy_id, result):
+    conn.execute(
+        'UPDATE saved_strategies SET metrics = ?, end_date = ?, state = ?, updated_at = ? WHERE id = ?',
+        (json.dumps(result['metrics']), result['end_date'], json.dumps(result['state']),
+         datetime.now().strftime('%Y-%m-%d %H:%M:%S'), strategy_id)
+    )
+
+
+def refresh_saved_strategy(database, strategy_id, user_id=None):
+    """
+    Roll one saved strategy forward to today and store its new metrics and state
+
+    Args:
+        database: Path of the application database
+        strategy_id: saved_strategies row id
+        user_id: Owner the row must belong to (any owner if None)
+
+    Returns:
+        Dictionary describing the refreshed strategy, or with an 'error' key
+    """
+    conn = _connect(database)
+    try:
+        query = 'SELECT * FROM saved_strategies WHERE id = ?'
+        args = (strategy_id,)
+        if user_id is not None:
+            query += ' AND user_id = ?'
+            args += (user_id,)
+        row = conn.execute(query, args).fetchone()
+        if row is None:
+            return {'error': 'Strategy not found'}
+
+        result = evaluate(row['symbol'], row['strategy_type'], json.loads(row['parameters']),
+                          row['start_date'], state=_load_state(row))
+        if 'error' in result:
+            return result
+        with conn:
+            _store(conn, row['id'], result)
+        return {
+            'id': row['id'],
+            'name': row['name'],
+            'symbol': row['symbol'],
+            'strategy_type': row['strategy_type'],
+            'start_date': row['start_date'],
+            'end_date': result['end_date'],
+            'metrics': result['metrics'],
+            'bars_applied': result['bars_applied'],
+            'rebuilt': result['rebuilt'],
+        }
+    finally:
+        conn.close()
+
+
+def roll_forward_all(database):
+    """
+    Roll every saved strategy forward in one pass over the bar store
+
+    Strategies are grouped by listed symbol and each symbol's history is read
+    once, from the earliest bar any of its strategies needs.
+
+    Returns:
+        Summary dictionary with counts of rolled, rebuilt and failed strategies
+    """
+    started = time.time()
+    end_date = _end_bound()
+    conn = _connect(database)
+    try:
+        rows = conn.execute('SELECT * FROM saved_strategies').fetchall()
+        inputs = list(dict.fromkeys(normalize(row['symbol']) for row in rows if normalize(row['symbol'])))
+        resolved = resolve_many(inputs) if inputs else {}
+
+        groups = {}
+        for row in rows:
+            listed = resolved.get(normalize(row['symbol'])) or normalize(row['symbol'])
+            state = _load_state(row)
+            # A streaming state needs its last bar onwards; anything else the whole range
+            streaming = state and state.get('indicators') and state.get('last_date')
+            groups.setdefault(listed, []).append((row, state, state['last_date'] if streaming else row['start_date']))
+
+        summary = {'strategies': len(rows), 'symbols': len(groups), 'rolled': 0, 'rebuilt': 0, 'failed': 0, 'bars_applied': 0}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+            futures = {executor.submit(_fetch, listed, min(item[2] for item in items), end_date): listed
+                       for listed, items in groups.items()}
+            for future in concurrent.futures.as_completed(futures):
+                data = future.result()
+                for row, state, _ in groups[futures[future]]:
+                    result = evaluate(row['symbol'], row['strategy_type'], json.loads(row['parameters']),
+                                      row['start_date'], end_date, state=state, data=data)
+                    if 'error' in result:
+                        summary['failed'] += 1
+                        print(f"Error rolling saved strategy {row['id']} forward: {result['error']}")
+                        continue
+                    with conn:
+                        _store(conn, row['id'], result)
+                    summary['rebuilt' if result['rebuilt'] else 'rolled'] += 1
+                    summary['bars_applied'] += result['bars_applied']
+        summary['elapsed_seconds'] = round(time.time() - started, 3)
+        return summary
+    finally:
+        conn.close()
+
+
+def claim_night(database, night):
+    """
+    Claim one night's roll-forward for this process
+
+    The claim is a row in the app database inserted inside an immediate
+    transaction, so exactly one process (on any backend) gets it.
+
+    Returns:
+        True if this call claimed the night, False if it was already claimed
+    """
+    conn = sqlite3.connect(database, timeout=30, isolation_level=None)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(f'CREATE TABLE IF NOT EXISTS {_ROLL_TABLE} '
+                         '(night TEXT PRIMARY KEY, pid INTEGER, claimed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)')
+            cursor = conn.execute(f'INSERT OR IGNORE INTO {_ROLL_TABLE} (night, pid) VALUES (?, ?)',
+                                  (night, os.getpid()))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return cursor.rowcount == 1
+    finally:
+        conn.close()
+
+
+class NightlyRoller:
+    """Daemon thread rolling saved strategies forward once a day after ``hour``"""
+
+    def __init__(self, database, hour=ROLL_HOUR):
+        self.database = database
+        self.hour = hour
+        self.runs = 0
+        self.errors = 0
+        self.last_run = None
+        self.last_summary = None
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        # Threads do not survive a fork, so a roller started before it is dead
+        return self._thread is not None and self._thread.is_alive() and self._pid == os.getpid()
+
+    def start(self):
+        """Start the roller thread in this process if it is not already running"""
+        with self._lock:
+            if self.running:
+                return
+            self._stop.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='strategy-roller', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_once(self):
+        """
+        Roll forward if tonight's run is due and no other process has claimed it
+
+        Returns:
+            The run summary, or None if nothing ran
+        """
+        now = datetime.now()
+        if now.hour < self.hour:
+            return None
+        night = now.strftime('%Y-%m-%d')
+        if self.last_run == night:
+            return None
+        # Claimed in the app database, so only one process runs per night
+        if not claim_night(self.database, night):
+            self.last_run = night
+            return None
+        self.last_run = night
+        self.last_summary = roll_forward_all(self.database)
+        self.runs += 1
+        return self.last_summary
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                self.errors += 1
+                print(f"Error rolling saved strategies forward: {e}")
+            self._stop.wait(300)
+
+    def stats(self):
+        return {
+            'hour': self.hour,
+            'running': self.running,
+            'runs': self.runs,
+            'errors': self.errors,
+            'last_run': self.last_run,
+            'last_summary': self.last_summary,
+        }
+
+
+_roller = None
+_roller_lock = threading.Lock()
+
+
+def start_roller(database):
+    """Start the nightly roll-forward for this process (idempotent)"""
+    global _roller
+    with _roller_lock:
+        if _roller is None:
+            _roller = NightlyRoller(database)
+    _roller.start()
+    return _roller
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Roll every saved strategy forward to today')
+    parser.add_argument('--database', default=DEFAULT_DATABASE)
+    parser.add_argument('--force', action='store_true', help='run even if tonight was already claimed')
+    args = parser.parse_args(argv)
+    if not claim_night(args.database, date.today().strftime('%Y-%m-%d')) and not args.force:
+        print(json.dumps({'skipped': 'already run tonight'}))
+        return 0
+    print(json.dumps(roll_forward_all(args.database)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,372 @@
+"""
+Stock search index.
+
+Built once per process from a local listings file (symbol, name, exchange)
+covering US and NSE/BSE listings, so autocomplete never touches the network.
+Symbols are looked up in a flattened prefix trie (every symbol prefix maps to
+its best-ranked listings) and names through a sorted token vocabulary for
+word-prefix matches, with a character trigram index as a fuzzy fallback.
+
+The listings file is read from LISTINGS_PATH (default data/listings.csv) and
+falls back to the small seed shipped in services/data/listings.csv. Refresh
+it from the exchanges' published symbol directories with:
+
+    python -m services.search_index refresh
+"""
+import os
+import re
+import csv
+import sys
+import json
+import heapq
+import bisect
+import argparse
+import itertools
+import threading
+from collections import Counter
+
+from services import DATA_DIR
+
+SEED_LISTINGS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'listings.csv')
+LISTINGS_PATH = os.environ.get('LISTINGS_PATH', os.path.join(DATA_DIR, 'listings.csv'))
+
+# Listings kept per symbol prefix; prefix hits beyond this are never ranked first
+PREFIX_FANOUT = 50
+
+# Name tokens examined per query word, name matches ranked per query, and
+# trigram postings too common to be useful
+MAX_TOKEN_EXPANSION = 200
+MAX_NAME_CANDIDATES = 100
+MAX_GRAM_POSTINGS = 1000
+
+US_LISTINGS_URLS = [
+    'https://www.nasdaqtrader.com/dynamic/SymDir/nasdaqlisted.txt',
+    'https://www.nasdaqtrader.com/dynamic/SymDir/otherlisted.txt',
+]
+NSE_LISTINGS_URL = 'https://archives.nseindia.com/content/equities/EQUITY_L.csv'
+BSE_LISTINGS_URL = ('https://api.bseindia.com/BseIndiaAPI/api/ListofScripData/w'
+                    '?Group=&Scripcode=&industry=&segment=Equity&status=Active')
+
+# otherlisted.txt exchange codes
+US_EXCHANGES = {'A': 'NYSE American', 'N': 'NYSE', 'P': 'NYSE Arca', 'Z': 'Cboe BZX', 'V': 'IEX'}
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+
+def _tokens(text):
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _trigrams(text):
+    text = f"  {' '.join(_tokens(text))} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _base_symbol(symbol):
+    """Symbol without its exchange suffix (RELIANCE.NS -> RELIANCE)"""
+    return symbol.rsplit('.', 1)[0] if '.' in symbol else symbol
+
+
+def read_listings(path):
+    """Read a listings CSV into a list of {symbol, name, exchange} dictionaries"""
+    with open(path, newline='', encoding='utf-8') as f:
+        return [
+            {'symbol': row['symbol'].strip().upper(), 'name': row['name'].strip(), 'exchange': row.get('exchange', '').strip()}
+            for row in csv.DictReader(f)
+            if row.get('symbol')
+        ]
+
+
+def write_listings(path, listings):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=['symbol', 'name', 'exchange'])
+        writer.writeheader()
+        writer.writerows(listings)
+    os.replace(tmp_path, path)
+
+
+class SearchIndex:
+    """In-memory ranked search over symbols and company names"""
+
+    def __init__(self, listings, popular=()):
+        self.symbols = []
+        self.names = []
+        self.exchanges = []
+        seen = set()
+        for listing in listings:
+            if listing['symbol'] in seen:
+                continue
+            seen.add(listing['symbol'])
+            self.symbols.append(listing['symbol'])
+            self.names.append(listing['name'] or listing['symbol'])
+            self.exchanges.append(listing.get('exchange', ''))
+
+        self._popular = set(popular)
+        self._bases = [_base_symbol(symbol) for symbol in self.symbols]
+        self._names_lower = [name.lower() for name in self.names]
+        self._static_rank = [(symbol not in self._popular, len(symbol), symbol) for symbol in self.symbols]
+        self._rank_pos = [0] * len(self.symbols)
+        for pos, i in enumerate(sorted(range(len(self.symbols)), key=self._static_rank.__getitem__)):
+            self._rank_pos[i] = pos
+        self._build_prefixes()
+        self._build_tokens()
+        self._build_trigrams()
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def _build_prefixes(self):
+        prefixes = {}
+        for i, (symbol, base) in enumerate(zip(self.symbols, self._bases)):
+            keys = {symbol[:k] for k in range(1, len(symbol) + 1)}
+            keys.update(base[:k] for k in range(1, len(base) + 1))
+            for key in keys:
+                prefixes.setdefault(key, []).append(i)
+        rank = self._static_rank.__getitem__
+        self._prefixes = {key: sorted(ids, key=rank)[:PREFIX_FANOUT] for key, ids in prefixes.items()}
+
+    def _build_tokens(self):
+        postings = {}
+        self._name_tokens = []
+        for i, name in enumerate(self.names):
+            tokens = _tokens(name)
+            self._name_tokens.append(tokens)
+            for token in set(tokens):
+                postings.setdefault(token, []).append(i)
+        self._vocabulary = sorted(postings)
+        # Postings are kept in rank order so the best matches can be taken first
+        rank = self._rank_pos.__getitem__
+        self._postings = [sorted(postings[token], key=rank) for token in self._vocabulary]
+
+    def _build_trigrams(self):
+        grams = {}
+        for i, name in enumerate(self.names):
+            for gram in _trigrams(f"{self._bases[i]} {name}"):
+                grams.setdefault(gram, []).append(i)
+        self._grams = grams
+
+    def _token_matches(self, word):
+        """Postings of every name token starting with word"""
+        start = bisect.bisect_left(self._vocabulary, word)
+        postings = []
+        for j in range(start, min(start + MAX_TOKEN_EXPANSION, len(self._vocabulary))):
+            if not self._vocabulary[j].startswith(word):
+                break
+            postings.append(self._postings[j])
+        return postings
+
+    def _fuzzy_matches(self, query):
+        """Listing id -> fraction of the query's trigrams found in its symbol or name"""
+        grams = _trigrams(query)
+        counts = Counter()
+        for gram in grams:
+            ids = self._grams.get(gram)
+            if ids and len(ids) <= MAX_GRAM_POSTINGS:
+                counts.update(ids)
+        threshold = max(2, len(grams) // 2)
+        return {i: count / len(grams) for i, count in counts.items() if count >= threshold}
+
+    def _score(self, i, symbol_query, name_query, words):
+        symbol, base = self.symbols[i], self._bases[i]
+        if symbol == symbol_query or base == symbol_query:
+            score = 1000
+        elif symbol.startswith(symbol_query) or base.startswith(symbol_query):
+            score = 800 - (len(base) - len(symbol_query))
+        elif self._names_lower[i].startswith(name_query):
+            score = 600
+        elif words and all(any(token.startswith(word) for token in self._name_tokens[i]) for word in words):
+            score = 400
+        else:
+            score = 0
+        if score and symbol in self._popular:
+            score += 50
+        return score
+
+    def search(self, query, limit=10):
+        """
+        Rank listings matching a symbol or company name query
+
+        Args:
+            query: Free-text query (symbol prefix or words from the name)
+            limit: Maximum number of results
+
+        Returns:
+            List of {symbol, name, exchange} dictionaries, best match first
+        """
+        name_query = ' '.join(_tokens(query))
+        symbol_query = query.strip().upper()
+        if not name_query:
+            return []
+        words = name_query.split()
+
+        candidates = set(self._prefixes.get(symbol_query, ()))
+        if len(words) == 1 and words[0].upper() != symbol_query:
+            candidates.update(self._prefixes.get(words[0].upper(), ()))
+
+        # Name matches come from the rarest query word; _score checks the others
+        word_postings = [self._token_matches(word) for word in words if len(word) >= 2 or len(words) > 1]
+        if word_postings:
+            rarest = min(word_postings, key=lambda postings: sum(map(len, postings)))
+            merged = heapq.merge(*rarest, key=self._rank_pos.__getitem__)
+            candidates.update(itertools.islice(merged, MAX_NAME_CANDIDATES * len(rarest)))
+
+        scores = {i: self._score(i, symbol_query, name_query, words) for i in candidates}
+
+        if sum(1 for score in scores.values() if score > 0) < limit and len(name_query) >= 3:
+            for i, similarity in self._fuzzy_matches(name_query).items():
+                if scores.get(i, 0) <= 0:
+                    scores[i] = int(300 * similarity) + (50 if self.symbols[i] in self._popular else 0)
+
+        ranked = sorted((i for i, score in scores.items() if score > 0),
+                        key=lambda i: (-scores[i], self._static_rank[i]))
+        return [self._result(i) for i in ranked[:limit]]
+
+    def _result(self, i):
+        return {'symbol': self.symbols[i], 'name': self.names[i], 'exchange': self.exchanges[i]}
+
+    def popular(self, per_exchange_group=5):
+        """Popular US and Indian listings, used when the query is empty"""
+        popular = [i for i, symbol in enumerate(self.symbols) if symbol in self._popular]
+        indian = [i for i in popular if self.exchanges[i] in ('NSE', 'BSE')]
+        other = [i for i in popular if self.exchanges[i] not in ('NSE', 'BSE')]
+        return [self._result(i) for i in other[:per_exchange_group] + indian[:per_exchange_group]]
+
+
+def load_listings(path=None):
+    """Listings from the configured file merged with the shipped seed"""
+    seed = read_listings(SEED_LISTINGS_PATH)
+    path = path or LISTINGS_PATH
+    if not os.path.exists(path):
+        return seed
+    try:
+        return read_listings(path) + seed
+    except (OSError, KeyError, csv.Error) as e:
+        print(f"Error reading listings from {path}: {e}")
+        return seed
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def _create_index(path=None):
+    popular = [listing['symbol'] for listing in read_listings(SEED_LISTINGS_PATH)]
+    return SearchIndex(load_listings(path), popular=popular)
+
+
+def build_search_index(path=None):
+    """(Re)build the process-wide search index from the listings file"""
+    global _index
+    index = _create_index(path)
+    with _index_lock:
+        _index = index
+    return index
+
+
+def get_search_index():
+    """Get the process-wide search index, building it on first use"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = _create_index()
+    return _index
+
+
+def _fetch_us_listings(session):
+    listings = []
+    for url in US_LISTINGS_URLS:
+        response = session.get(url, timeout=30)
+        response.raise_for_status()
+        rows = csv.DictReader(response.text.splitlines(), delimiter='|')
+        for row in rows:
+            symbol = row.get('Symbol') or row.get('ACT Symbol') or ''
+            if not symbol or row.get('Test Issue') == 'Y' or '$' in symbol or symbol.startswith('File Creation Time'):
+                continue
+            exchange = 'NASDAQ' if 'Market Category' in row else US_EXCHANGES.get(row.get('Exchange'), 'US')
+            # Yahoo writes share classes with a dash (BRK.B -> BRK-B)
+            listings.append({'symbol': symbol.replace('.', '-'), 'name': row['Security Name'].strip(), 'exchange': exchange})
+    return listings
+
+
+def _fetch_nse_listings(session):
+    response = session.get(NSE_LISTINGS_URL, timeout=30)
+    response.raise_for_status()
+    rows = csv.DictReader(response.text.splitlines())
+    return [
+        {'symbol': f"{row['SYMBOL'].strip()}.NS", 'name': row['NAME OF COMPANY'].strip(), 'exchange': 'NSE'}
+        for row in rows if row.get('SYMBOL')
+    ]
+
+
+def _fetch_bse_listings(session):
+    response = session.get(BSE_LISTINGS_URL, timeout=30, headers={'Referer': 'https://www.bseindia.com/'})
+    response.raise_for_status()
+    return [
+        {'symbol': f"{row['scrip_id'].strip()}.BO", 'name': (row.get('Scrip_Name') or row.get('Issuer_Name') or '').strip(), 'exchange': 'BSE'}
+        for row in json.loads(response.text) if row.get('scrip_id')
+    ]
+
+
+def refresh_listings(path=None):
+    """
+    Download US, NSE and BSE symbol directories into the listings file
+
+    Sources that fail are skipped; their listings from the previous file are kept.
+
+    Returns:
+        Number of listings written
+    """
+    import requests
+
+    path = path or LISTINGS_PATH
+    previous = read_listings(path) if os.path.exists(path) else []
+    session = requests.Session()
+    session.headers['User-Agent'] = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36'
+
+    sources = [('US', _fetch_us_listings, lambda e: e not in ('NSE', 'BSE')),
+               ('NSE', _fetch_nse_listings, lambda e: e == 'NSE'),
+               ('BSE', _fetch_bse_listings, lambda e: e == 'BSE')]
+    listings = []
+    for label, fetch, owns in sources:
+        try:
+            fetched = fetch(session)
+            print(f"Fetched {len(fetched)} {label} listings")
+        except Exception as e:
+            fetched = [listing for listing in previous if owns(listing['exchange'])]
+            print(f"Error fetching {label} listings, keeping {len(fetched)} previous: {e}")
+        listings.extend(fetched)
+
+    if not listings:
+        raise RuntimeError('No listings could be downloaded')
+    write_listings(path, listings)
+    return len(listings)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Manage the stock search listings')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    refresh = subcommands.add_parser('refresh', help='download listings from the exchanges')
+    refresh.add_argument('--output', default=LISTINGS_PATH)
+    search = subcommands.add_parser('search', help='run a query against the index')
+    search.add_argument('query')
+    search.add_argument('--limit', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    if args.command == 'refresh':
+        try:
+            count = refresh_listings(args.output)
+        except RuntimeError as e:
+            print(f"Error refreshing listings: {e}")
+            return 1
+        print(f"Wrote {count} listings to {args.output}")
+    else:
+        for result in get_search_index().search(args.query, limit=args.limit):
+            print(f"{result['symbol']:<16} {result['exchange']:<14} {result['name']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""
+Single-flight request coalescing.
+
+When several threads ask for the same key at once, only the first one runs
+the upstream call; the others wait for and share its result (or exception).
+Each group counts how many calls were executed and how many were coalesced.
+"""
+import threading
+import functools
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """A group of in-flight calls deduplicated by key"""
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) unless a call for key is already in flight, then share its result"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.executed += 1
+                leader = True
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def in_flight(self, key):
+        with self._lock:
+            return key in self._calls
+
+    def stats(self):
+        with self._lock:
+            return {
+                'executed': self.executed,
+                'coalesced': self.coalesced,
+                'in_flight': len(self._calls)
+            }
+
+
+_groups = {}
+_groups_lock = threading.Lock()
+
+
+def get_group(name):
+    """Get (or create) the named single-flight group"""
+    with _groups_lock:
+        if name not in _groups:
+            _groups[name] = SingleFlight(name)
+        return _groups[name]
+
+
+def call_key(name, args, kwargs):
+    """Build a stable key for a function call from its name and arguments"""
+    return f"{name}:{args!r}:{sorted(kwargs.items())!r}"
+
+
+def single_flight(func):
+    """Decorator coalescing concurrent calls with identical arguments"""
+    group = get_group(f"{func.__module__}.{func.__name__}")
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return group.do(call_key(func.__name__, args, kwargs), func, *args, **kwargs)
+    return wrapper
+
+
+def get_stats():
+    """Executed/coalesced counters for every single-flight group"""
+    with _groups_lock:
+        groups = list(_groups.values())
+    return {group.name: group.stats() for group in groups}
@@ -1,13 +1,20 @@
-import yfinance as yf
 import pandas as pd
 import json
 import numpy as np
 from datetime import datetime, timedelta
-import concurrent.futures
 
+from services.bar_store import get_history
+from services.market_data import get_provider
+from services.metadata_service import seed_names, get_metadata
+from services.search_index import get_search_index
+from services.quote_service import get_quotes
+from services.singleflight import single_flight
+from services.cache import cache
+
+@single_flight
 def get_stock_data(symbol, period='1y', interval='1d'):
     """
-    Fetch historical stock data using yfinance
+    Fetch historical stock data through the local bar store
     
     Args:
         symbol: Stock ticker symbol
@@ -18,9 +25,8 @@ def get_stock_data(symbol, period='1y', interval='1d'):
         Dictionary with historical data formatted for charts
     """
     try:
-        # Get historical data from yfinance
-        ticker = yf.Ticker(symbol)
-        hist = ticker.history(period=period, interval=interval)
+        # Get historical data from the bar store (only new bars hit the network)
+        hist = get_history(symbol, period=period, interval=interval)
         
         if hist.empty:
             return {'error': f'No data available for {symbol}. Please check the symbol and try again.'}
@@ -86,6 +92,12 @@ def get_stock_data(symbol, period='1y', interval='1d'):
         print(f"Error fetching stock data for {symbol}: {e}")
         return {'error': f'Error fetching data for {symbol}: {str(e)}'}
 
+def _field(record, key, default='N/A'):
+    """Record value, or a display default when the provider has none"""
+    value = record.get(key)
+    return default if value is None else value
+
+@cache.cached('info', should_cache=lambda info: 'error' not in info)
 def get_stock_info(symbol):
     """
     Get detailed information about a stock
@@ -97,37 +109,36 @@ def get_stock_info(symbol):
         Dictionary with stock information
     """
     try:
-        ticker = yf.Ticker(symbol)
-        info = ticker.info
+        metadata = get_metadata(symbol)
         
-        # Get real-time price
-        hist = ticker.history(period='1d')
-        current_price = hist['Close'].iloc[-1] if not hist.empty else None
+        # Get real-time price and session stats
+        quote = get_provider().quote(symbol) or {}
+        current_price = quote.get('price')
         
         # Format the data
         stock_info = {
             'symbol': symbol,
-            'name': info.get('shortName', info.get('longName', symbol)),
-            'sector': info.get('sector', 'N/A'),
-            'industry': info.get('industry', 'N/A'),
-            'market_cap': info.get('marketCap', 'N/A'),
-            'pe_ratio': info.get('trailingPE', 'N/A'),
-            'eps': info.get('trailingEps', 'N/A'),
-            'dividend_yield': info.get('dividendYield', 'N/A'),
+            'name': metadata.get('name') or symbol,
+            'sector': _field(metadata, 'sector'),
+            'industry': _field(metadata, 'industry'),
+            'market_cap': _field(metadata, 'market_cap'),
+            'pe_ratio': _field(metadata, 'pe_ratio'),
+            'eps': _field(metadata, 'eps'),
+            'dividend_yield': _field(metadata, 'dividend_yield'),
             'price': current_price,
-            'day_high': info.get('dayHigh', 'N/A'),
-            'day_low': info.get('dayLow', 'N/A'),
-            'fifty_two_week_high': info.get('fiftyTwoWeekHigh', 'N/A'),
-            'fifty_two_week_low': info.get('fiftyTwoWeekLow', 'N/A'),
-            'volume': info.get('volume', 'N/A'),
-            'avg_volume': info.get('averageVolume', 'N/A'),
-            'beta': info.get('beta', 'N/A'),
-            'description': info.get('longBusinessSummary', 'No description available')
+            'day_high': _field(quote, 'day_high'),
+            'day_low': _field(quote, 'day_low'),
+            'fifty_two_week_high': _field(metadata, 'fifty_two_week_high'),
+            'fifty_two_week_low': _field(metadata, 'fifty_two_week_low'),
+            'volume': _field(quote, 'volume'),
+            'avg_volume': _field(metadata, 'avg_volume'),
+            'beta': _field(metadata, 'beta'),
+            'description': _field(metadata, 'description', 'No description available')
         }
         
         # Calculate additional metrics if data is available
-        if current_price and info.get('bookValue'):
-            stock_info['price_to_book'] = round(current_price / info['bookValue'], 2)
+        if current_price and metadata.get('book_value'):
+            stock_info['price_to_book'] = round(current_price / metadata['book_value'], 2)
         
         return stock_info
     
@@ -143,136 +154,16 @@ def search_stocks(query):
         query: Search query string
     
     Returns:
-        List of matching stocks with symbol and name
+        List of matching stocks with symbol, name and exchange
     """
     try:
-        # Popular US stocks with more comprehensive list
-        us_stocks = [
-            {'symbol': 'AAPL', 'name': 'Apple Inc.'},
-            {'symbol': 'MSFT', 'name': 'Microsoft Corporation'},
-            {'symbol': 'GOOGL', 'name': 'Alphabet Inc. (Google)'},
-            {'symbol': 'GOOG', 'name': 'Alphabet Inc. Class C'},
-            {'symbol': 'AMZN', 'name': 'Amazon.com, Inc.'},
-            {'symbol': 'META', 'name': 'Meta Platforms, Inc. (Facebook)'},
-            {'symbol': 'TSLA', 'name': 'Tesla, Inc.'},
-            {'symbol': 'NVDA', 'name': 'NVIDIA Corporation'},
-            {'symbol': 'JPM', 'name': 'JPMorgan Chase & Co.'},
-            {'symbol': 'V', 'name': 'Visa Inc.'},
-            {'symbol': 'JNJ', 'name': 'Johnson & Johnson'},
-            {'symbol': 'UNH', 'name': 'UnitedHealth Group Inc.'},
-            {'symbol': 'WMT', 'name': 'Walmart Inc.'},
-            {'symbol': 'PG', 'name': 'Procter & Gamble Co.'},
-            {'symbol': 'MA', 'name': 'Mastercard Inc.'},
-            {'symbol': 'HD', 'name': 'Home Depot Inc.'},
-            {'symbol': 'BAC', 'name': 'Bank of America Corp.'},
-            {'symbol': 'XOM', 'name': 'Exxon Mobil Corporation'},
-            {'symbol': 'AVGO', 'name': 'Broadcom Inc.'},
-            {'symbol': 'COST', 'name': 'Costco Wholesale Corporation'},
-            {'symbol': 'CSCO', 'name': 'Cisco Systems, Inc.'},
-            {'symbol': 'ADBE', 'name': 'Adobe Inc.'},
-            {'symbol': 'NFLX', 'name': 'Netflix, Inc.'},
-            {'symbol': 'DIS', 'name': 'The Walt Disney Company'},
-            {'symbol': 'PEP', 'name': 'PepsiCo, Inc.'},
-            {'symbol': 'INTC', 'name': 'Intel Corporation'},
-            {'symbol': 'AMD', 'name': 'Advanced Micro Devices, Inc.'},
-            {'symbol': 'QCOM', 'name': 'Qualcomm Incorporated'},
-            {'symbol': 'PYPL', 'name': 'PayPal Holdings, Inc.'},
-            {'symbol': 'SBUX', 'name': 'Starbucks Corporation'}
-        ]
-        
-        # Popular Indian stocks with more comprehensive list and accurate symbols
-        indian_stocks = [
-            {'symbol': 'RELIANCE.NS', 'name': 'Reliance Industries Limited'},
-            {'symbol': 'TCS.NS', 'name': 'Tata Consultancy Services Limited'},
-            {'symbol': 'HDFCBANK.NS', 'name': 'HDFC Bank Limited'},
-            {'symbol': 'INFY.NS', 'name': 'Infosys Limited'},
-            {'symbol': 'HINDUNILVR.NS', 'name': 'Hindustan Unilever Limited'},
-            {'symbol': 'ICICIBANK.NS', 'name': 'ICICI Bank Limited'},
-            {'symbol': 'SBIN.NS', 'name': 'State Bank of India'},
-            {'symbol': 'BHARTIARTL.NS', 'name': 'Bharti Airtel Limited'},
-            {'symbol': 'KOTAKBANK.NS', 'name': 'Kotak Mahindra Bank Limited'},
-            {'symbol': 'ITC.NS', 'name': 'ITC Limited'},
-            {'symbol': 'TATAMOTORS.NS', 'name': 'Tata Motors Limited'},
-            {'symbol': 'BAJFINANCE.NS', 'name': 'Bajaj Finance Limited'},
-            {'symbol': 'AXISBANK.NS', 'name': 'Axis Bank Limited'},
-            {'symbol': 'MARUTI.NS', 'name': 'Maruti Suzuki India Limited'},
-            {'symbol': 'HCLTECH.NS', 'name': 'HCL Technologies Limited'},
-            {'symbol': 'WIPRO.NS', 'name': 'Wipro Limited'},
-            {'symbol': 'SUNPHARMA.NS', 'name': 'Sun Pharmaceutical Industries Limited'},
-            {'symbol': 'ASIANPAINT.NS', 'name': 'Asian Paints Limited'},
-            {'symbol': 'ONGC.NS', 'name': 'Oil and Natural Gas Corporation Limited'},
-            {'symbol': 'TITAN.NS', 'name': 'Titan Company Limited'},
-            {'symbol': 'BAJAJFINSV.NS', 'name': 'Bajaj Finserv Limited'},
-            {'symbol': 'ADANIENT.NS', 'name': 'Adani Enterprises Limited'},
-            {'symbol': 'TATASTEEL.NS', 'name': 'Tata Steel Limited'},
-            {'symbol': 'NTPC.NS', 'name': 'NTPC Limited'},
-            {'symbol': 'POWERGRID.NS', 'name': 'Power Grid Corporation of India Limited'},
-            {'symbol': 'TVSMOTOR.NS', 'name': 'TVS Motor Company Limited'},
-            {'symbol': 'TECHM.NS', 'name': 'Tech Mahindra Limited'},
-            {'symbol': 'ULTRACEMCO.NS', 'name': 'UltraTech Cement Limited'},
-            {'symbol': 'NESTLEIND.NS', 'name': 'Nestle India Limited'},
-            {'symbol': 'DRREDDY.NS', 'name': 'Dr. Reddy\'s Laboratories Limited'}
-        ]
-        
-        all_stocks = us_stocks + indian_stocks
-        
-        # Filter stocks based on query
+        # Served from the in-memory listings index; no network access
+        index = get_search_index()
         if query:
-            query = query.lower()
-            
-            # First, try to find exact matches for symbols (prioritize these)
-            exact_symbol_matches = [
-                stock for stock in all_stocks
-                if stock['symbol'].lower() == query
-            ]
-            
-            # Then find partial matches in symbols and names
-            partial_matches = [
-                stock for stock in all_stocks
-                if (query in stock['symbol'].lower() or query in stock['name'].lower()) 
-                and stock not in exact_symbol_matches
-            ]
-            
-            # Combine results, with exact matches first
-            filtered_stocks = exact_symbol_matches + partial_matches
-            
-            # If we have fewer than 5 results, try to search using yfinance
-            if len(filtered_stocks) < 5:
-                try:
-                    # Try to get more results using yfinance search
-                    # First check if it's a valid ticker
-                    try:
-                        ticker = yf.Ticker(query)
-                        info = ticker.info
-                        if 'shortName' in info or 'longName' in info:
-                            name = info.get('shortName', info.get('longName', query))
-                            symbol_result = {'symbol': query, 'name': name}
-                            if symbol_result not in filtered_stocks:
-                                filtered_stocks.append(symbol_result)
-                    except:
-                        pass
-                    
-                    # Try to search for Indian stocks if query might be for Indian market
-                    if '.ns' not in query.lower() and len(query) >= 2:
-                        indian_query = f"{query}.ns"
-                        try:
-                            ticker = yf.Ticker(indian_query)
-                            info = ticker.info
-                            if 'shortName' in info or 'longName' in info:
-                                name = info.get('shortName', info.get('longName', indian_query))
-                                symbol_result = {'symbol': indian_query.upper(), 'name': name}
-                                if symbol_result not in filtered_stocks:
-                                    filtered_stocks.append(symbol_result)
-                        except:
-                            pass
-                except Exception as e:
-                    print(f"Error searching with yfinance: {e}")
-            
-            return filtered_stocks[:10]  # Limit to 10 results
+            return index.search(query, limit=10)  # Limit to 10 results
         
         # If no query, return a mix of popular US and Indian stocks
-        popular_mix = us_stocks[:5] + indian_stocks[:5]
-        return popular_mix
+        return index.popular()
     
     except Exception as e:
         print(f"Error searching stocks: {e}")
@@ -295,41 +186,24 @@ def get_market_indices():
     
     result = {}
     
-    # Fetch all indices at once for better performance
+    # Fetch all indices with a single bulk download
     try:
-        tickers = yf.Tickers(' '.join(indices.keys()))
-        for symbol, name in indices.items():
-            try:
-                ticker = tickers.tickers[symbol]
-                hist = ticker.history(period='2d')
-                
-                if not hist.empty:
-                    current = hist['Close'].iloc[-1]
-                    prev_close = hist['Close'].iloc[-2] if len(hist) > 1 else hist['Open'].iloc[-1]
-                    change = current - prev_close
-                    change_percent = (change / prev_close) * 100
-                    
-                    result[symbol] = {
-                        'name': name,
-                        'price': round(current, 2),
-                        'change': round(change, 2),
-                        'change_percent': round(change_percent, 2),
-                        'volume': int(hist['Volume'].iloc[-1]),
-                        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    }
-            except Exception as e:
-                print(f"Error processing data for {symbol}: {e}")
+        quotes = get_quotes(list(indices.keys()), names=indices)
+        for symbol in indices:
+            if symbol in quotes:
+                result[symbol] = {key: value for key, value in quotes[symbol].items() if key != 'symbol'}
     except Exception as e:
         print(f"Error fetching market indices: {e}")
     
     return result
 
-def get_watchlist_prices(symbols):
+def get_watchlist_prices(symbols, names=None):
     """
     Get real-time prices for a list of stock symbols
     
     Args:
         symbols: List of stock ticker symbols
+        names: Optional mapping of symbol to display name (e.g. from the watchlist table)
     
     Returns:
         Dictionary with real-time stock data
@@ -337,66 +211,27 @@ def get_watchlist_prices(symbols):
     if not symbols:
         return {}
     
-    result = {}
-    
-    # Process in batches of 10 symbols for better performance
-    def process_batch(batch):
-        batch_result = {}
-        try:
-            # Join symbols with space for yfinance
-            symbols_str = ' '.join(batch)
-            tickers = yf.Tickers(symbols_str)
-            
-            for symbol in batch:
-                try:
-                    ticker = tickers.tickers[symbol]
-                    hist = ticker.history(period='2d')
-                    
-                    if not hist.empty:
-                        current = hist['Close'].iloc[-1]
-                        prev_close = hist['Close'].iloc[-2] if len(hist) > 1 else hist['Open'].iloc[-1]
-                        change = current - prev_close
-                        change_percent = (change / prev_close) * 100
-                        
-                        # Get company name
-                        info = ticker.info
-                        name = info.get('shortName', info.get('longName', symbol))
-                        
-                        batch_result[symbol] = {
-                            'symbol': symbol,
-                            'name': name,
-                            'price': round(current, 2),
-                            'change': round(change, 2),
-                            'change_percent': round(change_percent, 2),
-                            'volume': int(hist['Volume'].iloc[-1]),
-                            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                        }
-                except Exception as e:
-                    print(f"Error processing data for {symbol}: {e}")
-                    batch_result[symbol] = {
-                        'symbol': symbol,
-                        'name': symbol,
-                        'price': 0,
-                        'change': 0,
-                        'change_percent': 0,
-                        'volume': 0,
-                        'error': str(e)
-                    }
-        except Exception as e:
-            print(f"Error fetching batch data: {e}")
-        
-        return batch_result
-    
-    # Split symbols into batches of 10
-    batches = [symbols[i:i+10] for i in range(0, len(symbols), 10)]
+    if names:
+        seed_names(names)
     
-    # Process batches in parallel
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        batch_results = list(executor.map(process_batch, batches))
+    # One multi-symbol download for the whole list
+    try:
+        result = get_quotes(symbols, names=names)
+    except Exception as e:
+        print(f"Error fetching watchlist prices: {e}")
+        result = {}
     
-    # Combine results
-    for batch_result in batch_results:
-        result.update(batch_result)
+    for symbol in symbols:
+        if symbol not in result:
+            result[symbol] = {
+                'symbol': symbol,
+                'name': (names or {}).get(symbol, symbol),
+                'price': 0,
+                'change': 0,
+                'change_percent': 0,
+                'volume': 0,
+                'error': f'No data available for {symbol}'
+            }
     
     return result
 
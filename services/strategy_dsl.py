@@ -0,0 +1,315 @@
+"""
+Custom strategy rules.
+
+A rule is a single expression over price series, e.g.::
+
+    sma(close, 20) > sma(close, 50) and rsi(close, 14) < 40
+
+Rules are parsed with ``ast`` in eval mode and only a small whitelist of
+syntax is accepted: the price fields below, numeric literals, arithmetic,
+comparisons, ``and``/``or``/``not`` and calls to the functions in
+``FUNCTIONS`` with literal periods. Nothing is ever passed to ``eval``.
+
+An accepted rule is compiled into a graph of NumPy operations in which equal
+subexpressions share one node, so ``sma(close, 20)`` used twice (or MACD
+line and signal) is computed once. Compiled rules are cached by source text.
+"""
+import ast
+import functools
+
+import numpy as np
+
+from services import indicators
+
+# Price fields a rule may reference
+FIELDS = ('open', 'high', 'low', 'close', 'volume')
+
+MAX_RULE_LENGTH = 2000
+MAX_NODES = 256
+MAX_WINDOW = 5000
+
+
+class RuleError(ValueError):
+    """Raised when a rule is not valid"""
+
+
+def _lag(x, periods):
+    out = np.full(x.shape, np.nan)
+    if periods < len(x):
+        out[periods:] = x[:len(x) - periods]
+    return out
+
+
+# Function name -> (argument kinds with defaults, graph expansion)
+# Kinds: 'series' is any numeric expression, 'window' a positive integer
+# literal, 'number' a numeric literal. Expansions build nodes via the compiler
+# so that shared pieces (MACD, Bollinger, lags) are deduplicated too.
+FUNCTIONS = {
+    'sma': ((('series', None), ('window', None)), lambda c, x, w: c.node('sma', x, w)),
+    'ema': ((('series', None), ('window', None)), lambda c, x, w: c.node('ema', x, w)),
+    'std': ((('series', None), ('window', None)), lambda c, x, w: c.node('std', x, w)),
+    'rsi': ((('series', None), ('window', 14)), lambda c, x, w: c.node('rsi', x, w)),
+    'macd': ((('series', None), ('window', 12), ('window', 26)),
+             lambda c, x, f, s: c.node('item', c.node('macd', x, f, s, 9), 0)),
+    'macd_signal': ((('series', None), ('window', 12), ('window', 26), ('window', 9)),
+                    lambda c, x, f, s, p: c.node('item', c.node('macd', x, f, s, p), 1)),
+    'macd_hist': ((('series', None), ('window', 12), ('window', 26), ('window', 9)),
+                  lambda c, x, f, s, p: c.node('item', c.node('macd', x, f, s, p), 2)),
+    'bb_upper': ((('series', None), ('window', 20), ('number', 2.0)),
+                 lambda c, x, w, k: c.node('item', c.node('bollinger', x, w, k), 1)),
+    'bb_lower': ((('series', None), ('window', 20), ('number', 2.0)),
+                 lambda c, x, w, k: c.node('item', c.node('bollinger', x, w, k), 2)),
+    'lag': ((('series', None), ('window', 1)), lambda c, x, n: c.node('lag', x, n)),
+    'abs': ((('series', None),), lambda c, x: c.node('abs', x)),
+    'min': ((('series', None), ('series', None)), lambda c, a, b: c.node('min', a, b)),
+    'max': ((('series', None), ('series', None)), lambda c, a, b: c.node('max', a, b)),
+    'cross_above': ((('series', None), ('series', None)),
+                    lambda c, a, b: c.node('and', c.node('gt', a, b), c.node('le', c.node('lag', a, 1), c.node('lag', b, 1)))),
+    'cross_below': ((('series', None), ('series', None)),
+                    lambda c, a, b: c.node('and', c.node('lt', a, b), c.node('ge', c.node('lag', a, 1), c.node('lag', b, 1)))),
+}
+
+# Node operation -> (result kind, evaluation). Node arguments are node ids
+# (evaluated first) followed by literal parameters.
+_OPS = {
+    'sma': ('number', lambda x, w: indicators.sma(x, w)),
+    'ema': ('number', lambda x, w: indicators.ema(x, span=w)),
+    'std': ('number', lambda x, w: indicators.rolling_std(x, w)),
+    'rsi': ('number', lambda x, w: indicators.rsi(x, w)),
+    'macd': ('tuple', lambda x, f, s, p: indicators.macd(x, f, s, p)),
+    'bollinger': ('tuple', lambda x, w, k: indicators.bollinger(x, w, k)),
+    'item': ('number', lambda values, i: values[i]),
+    'lag': ('number', _lag),
+    'abs': ('number', np.abs),
+    'min': ('number', np.minimum),
+    'max': ('number', np.maximum),
+    'neg': ('number', np.negative),
+    'add': ('number', np.add),
+    'sub': ('number', np.subtract),
+    'mul': ('number', np.multiply),
+    'div': ('number', np.divide),
+    'lt': ('bool', np.less),
+    'le': ('bool', np.less_equal),
+    'gt': ('bool', np.greater),
+    'ge': ('bool', np.greater_equal),
+    'eq': ('bool', np.equal),
+    'ne': ('bool', np.not_equal),
+    'and': ('bool', np.logical_and),
+    'or': ('bool', np.logical_or),
+    'not': ('bool', np.logical_not),
+}
+
+# Number of leading node-id arguments of each operation (the rest are literals)
+_NODE_ARGS = {
+    'sma': 1, 'ema': 1, 'std': 1, 'rsi': 1, 'macd': 1, 'bollinger': 1, 'item': 1, 'lag': 1,
+    'abs': 1, 'neg': 1, 'not': 1,
+}
+
+_BINARY = {ast.Add: 'add', ast.Sub: 'sub', ast.Mult: 'mul', ast.Div: 'div'}
+_COMPARE = {ast.Lt: 'lt', ast.LtE: 'le', ast.Gt: 'gt', ast.GtE: 'ge', ast.Eq: 'eq', ast.NotEq: 'ne'}
+
+
+class Rule:
+    """
+    A compiled custom strategy rule
+
+    Attributes:
+        source: Rule text
+        fields: Price fields the rule reads
+        nodes: Operations in evaluation order, as (op, args) tuples
+        labels: Node id -> source text of each indicator call, for charts
+    """
+
+    def __init__(self, source, nodes, output, labels):
+        self.source = source
+        self.nodes = tuple(nodes)
+        self.output = output
+        self.labels = dict(labels)
+        self.fields = tuple(args[0] for op, args in self.nodes if op == 'field')
+
+    def evaluate(self, series):
+        """
+        Evaluate the rule over price arrays
+
+        Args:
+            series: Dictionary mapping field names to 1-D arrays (or 2-D
+                matrices with one series per column) of equal shape
+
+        Returns:
+            Tuple of (signal, indicators): an int8 array that is 1 where the
+            rule holds and 0 elsewhere, and a dictionary of the indicator
+            series the rule computed, keyed by their source text
+        """
+        missing = [field for field in self.fields if field not in series]
+        if missing:
+            raise RuleError(f"Rule needs price fields that are not available: {', '.join(missing)}")
+
+        values = [None] * len(self.nodes)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for i, (op, args) in enumerate(self.nodes):
+                if op == 'field':
+                    values[i] = np.asarray(series[args[0]], dtype=np.float64)
+                elif op == 'const':
+                    values[i] = args[0]
+                else:
+                    count = _NODE_ARGS.get(op, len(args))
+                    values[i] = _OPS[op][1](*[values[a] for a in args[:count]], *args[count:])
+        # A rule over literals only still yields one value per bar
+        shape = np.shape(next(iter(series.values()))) if series else ()
+        signal = np.broadcast_to(np.asarray(values[self.output], dtype=bool), shape).astype(np.int8)
+        return signal, {label: values[i] for i, label in self.labels.items()}
+
+    def signals(self, series):
+        """int8 signal array (1 where the rule holds)"""
+        return self.evaluate(series)[0]
+
+
+class _Compiler:
+    def __init__(self):
+        self.nodes = []
+        self.kinds = []
+        self.index = {}
+        self.labels = {}
+
+    def node(self, op, *args):
+        """Intern an operation so equal subexpressions map to one node"""
+        key = (op, args)
+        if key in self.index:
+            return self.index[key]
+        if len(self.nodes) >= MAX_NODES:
+            raise RuleError('Rule is too complex')
+        if op in ('field', 'const'):
+            kind = 'number'
+        else:
+            kind = _OPS[op][0]
+        self.nodes.append(key)
+        self.kinds.append(kind)
+        self.index[key] = len(self.nodes) - 1
+        return self.index[key]
+
+    def expect(self, node_id, kind, where):
+        if self.kinds[node_id] != kind:
+            wanted = 'a condition' if kind == 'bool' else 'a number'
+            raise RuleError(f'{where} must be {wanted}')
+        return node_id
+
+    def compile(self, tree):
+        if isinstance(tree, ast.BoolOp):
+            op = 'and' if isinstance(tree.op, ast.And) else 'or'
+            result = self.expect(self.compile(tree.values[0]), 'bool', f"Operands of '{op}'")
+            for value in tree.values[1:]:
+                result = self.node(op, result, self.expect(self.compile(value), 'bool', f"Operands of '{op}'"))
+            return result
+
+        if isinstance(tree, ast.UnaryOp):
+            operand = self.compile(tree.operand)
+            if isinstance(tree.op, ast.Not):
+                return self.node('not', self.expect(operand, 'bool', "Operand of 'not'"))
+            if isinstance(tree.op, ast.USub):
+                return self.node('neg', self.expect(operand, 'number', 'Operand of unary minus'))
+            if isinstance(tree.op, ast.UAdd):
+                return self.expect(operand, 'number', 'Operand of unary plus')
+
+        if isinstance(tree, ast.BinOp) and type(tree.op) in _BINARY:
+            left = self.expect(self.compile(tree.left), 'number', 'Arithmetic operands')
+            right = self.expect(self.compile(tree.right), 'number', 'Arithmetic operands')
+            return self.node(_BINARY[type(tree.op)], left, right)
+
+        if isinstance(tree, ast.Compare):
+            # a < b < c means a < b and b < c
+            left = self.expect(self.compile(tree.left), 'number', 'Compared values')
+            result = None
+            for op, comparator in zip(tree.ops, tree.comparators):
+                if type(op) not in _COMPARE:
+                    break
+                right = self.expect(self.compile(comparator), 'number', 'Compared values')
+                test = self.node(_COMPARE[type(op)], left, right)
+                result = test if result is None else self.node('and', result, test)
+                left = right
+            else:
+                return result
+
+        if isinstance(tree, ast.Call):
+            return self.call(tree)
+
+        if isinstance(tree, ast.Name):
+            if tree.id in FIELDS:
+                return self.node('field', tree.id)
+            raise RuleError(f"Unknown name '{tree.id}' (price fields: {', '.join(FIELDS)})")
+
+        if isinstance(tree, ast.Constant) and type(tree.value) in (int, float):
+            return self.node('const', float(tree.value))
+
+        raise RuleError(f"Unsupported syntax: '{ast.unparse(tree)}'")
+
+    def call(self, tree):
+        if not isinstance(tree.func, ast.Name) or tree.func.id not in FUNCTIONS:
+            name = ast.unparse(tree.func)
+            raise RuleError(f"Unknown function '{name}' (available: {', '.join(sorted(FUNCTIONS))})")
+        name = tree.func.id
+        if tree.keywords:
+            raise RuleError(f'{name}() takes positional arguments only')
+        kinds, expand = FUNCTIONS[name]
+        if len(tree.args) > len(kinds) or len(tree.args) < sum(default is None for _, default in kinds):
+            raise RuleError(f'Wrong number of arguments for {name}()')
+
+        args = []
+        for position, (kind, default) in enumerate(kinds):
+            if position >= len(tree.args):
+                args.append(default)
+            elif kind == 'series':
+                args.append(self.expect(self.compile(tree.args[position]), 'number', f'Arguments of {name}()'))
+            else:
+                args.append(self.literal(tree.args[position], kind, name))
+
+        result = expand(self, *args)
+        if self.kinds[result] == 'number':
+            self.labels.setdefault(result, ast.unparse(tree))
+        return result
+
+    @staticmethod
+    def literal(tree, kind, name):
+        value = tree.value if isinstance(tree, ast.Constant) else None
+        if kind == 'window':
+            if type(value) is not int or not 0 < value <= MAX_WINDOW:
+                raise RuleError(f'Periods of {name}() must be whole numbers between 1 and {MAX_WINDOW}')
+            return value
+        if type(value) not in (int, float):
+            raise RuleError(f'Parameters of {name}() must be numbers')
+        return float(value)
+
+
+@functools.lru_cache(maxsize=256)
+def compile_rule(source):
+    """
+    Parse, validate and compile a custom strategy rule
+
+    Args:
+        source: Rule text
+
+    Returns:
+        Rule object (cached per source text)
+
+    Raises:
+        RuleError: If the rule is empty, too long, not a valid expression or
+            uses anything outside the whitelist
+    """
+    source = (source or '').strip()
+    if not source:
+        raise RuleError('Custom strategy code is empty')
+    if len(source) > MAX_RULE_LENGTH:
+        raise RuleError(f'Custom strategy code is too long (limit {MAX_RULE_LENGTH} characters)')
+    try:
+        tree = ast.parse(source, mode='eval')
+    except SyntaxError as e:
+        raise RuleError(f'Invalid syntax: {e.msg}') from None
+    except (ValueError, RecursionError, MemoryError):
+        raise RuleError('Custom strategy code could not be parsed') from None
+
+    compiler = _Compiler()
+    try:
+        output = compiler.compile(tree.body)
+    except RecursionError:
+        raise RuleError('Rule is too deeply nested') from None
+    compiler.expect(output, 'bool', 'The rule')
+    return Rule(source, compiler.nodes, output, compiler.labels)
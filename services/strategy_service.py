@@ -1,9 +1,13 @@
 import pandas as pd
 import numpy as np
-import yfinance as yf
 from datetime import datetime, timedelta
 import json
 
+from services import indicators, backtest_engine, trade_ledger
+from services.bar_store import get_history
+from services.symbol_resolver import canonical_symbol
+from services.strategy_dsl import FIELDS, compile_rule, RuleError
+
 def get_predefined_strategies():
     """
     Get a list of predefined trading strategies
@@ -55,60 +59,45 @@ def get_predefined_strategies():
             'name': 'Custom Strategy',
             'description': 'Create your own custom strategy using a combination of technical indicators.',
             'parameters': {
-                'code': {'type': 'text', 'default': '', 'description': 'Custom strategy code'}
+                'code': {'type': 'text', 'default': 'sma(close, 20) > sma(close, 50) and rsi(close, 14) < 70',
+                         'description': 'Rule that holds while in position, e.g. sma(close, 20) > sma(close, 50) and rsi(close, 14) < 40'}
             }
         }
     ]
     
     return strategies
 
+def _close(data):
+    return data['Close'].to_numpy(dtype=np.float64)
+
 def calculate_sma(data, window):
     """Calculate Simple Moving Average"""
-    return data['Close'].rolling(window=window).mean()
+    return pd.Series(indicators.sma(_close(data), window), index=data.index)
 
 def calculate_rsi(data, window=14):
-    """Calculate Relative Strength Index"""
-    delta = data['Close'].diff()
-    gain = delta.where(delta > 0, 0).rolling(window=window).mean()
-    loss = -delta.where(delta < 0, 0).rolling(window=window).mean()
-    
-    rs = gain / loss
-    rsi = 100 - (100 / (1 + rs))
-    
-    return rsi
+    """Calculate Relative Strength Index (Wilder smoothing)"""
+    return pd.Series(indicators.rsi(_close(data), window), index=data.index)
 
 def calculate_macd(data, fast_period=12, slow_period=26, signal_period=9):
     """Calculate Moving Average Convergence Divergence"""
-    fast_ema = data['Close'].ewm(span=fast_period, adjust=False).mean()
-    slow_ema = data['Close'].ewm(span=slow_period, adjust=False).mean()
-    
-    macd_line = fast_ema - slow_ema
-    signal_line = macd_line.ewm(span=signal_period, adjust=False).mean()
-    
-    return macd_line, signal_line
+    macd_line, signal_line, _ = indicators.macd(_close(data), fast_period, slow_period, signal_period)
+    return pd.Series(macd_line, index=data.index), pd.Series(signal_line, index=data.index)
 
 def calculate_bollinger_bands(data, window=20, num_std=2):
     """Calculate Bollinger Bands"""
-    sma = data['Close'].rolling(window=window).mean()
-    std = data['Close'].rolling(window=window).std()
-    
-    upper_band = sma + (std * num_std)
-    lower_band = sma - (std * num_std)
-    
-    return upper_band, lower_band
+    _, upper_band, lower_band = indicators.bollinger(_close(data), window, num_std)
+    return pd.Series(upper_band, index=data.index), pd.Series(lower_band, index=data.index)
 
-def _sanitize_json_data(data):
-    """
-    Sanitize data for JSON serialization by handling NaN values
-    """
-    if isinstance(data, dict):
-        return {k: _sanitize_json_data(v) for k, v in data.items()}
-    elif isinstance(data, list):
-        return [_sanitize_json_data(item) for item in data]
-    elif isinstance(data, (np.float64, np.float32, float)) and np.isnan(data):
-        return None
-    else:
-        return data
+def _json_values(values):
+    """Array (any shape) as nested lists with NaN and infinities replaced by None"""
+    values = np.asarray(values, dtype=np.float64)
+    out = values.astype(object)
+    out[~np.isfinite(values)] = None
+    return out.tolist()
+
+def _years(index):
+    """Calendar span of a date index in years"""
+    return trade_ledger.span_years(index[0], index[-1]) if len(index) > 1 else 0.0
 
 def backtest_strategy(symbol, strategy_type, parameters, start_date, end_date):
     """
@@ -129,41 +118,17 @@ def backtest_strategy(symbol, strategy_type, parameters, start_date, end_date):
         if not symbol or len(symbol.strip()) == 0:
             return {'error': 'Invalid stock symbol'}
             
-        # Clean the symbol
-        symbol = symbol.strip().upper()
+        # Map the input to its listed symbol (e.g. adds .NS for Indian stocks)
+        symbol = canonical_symbol(symbol)
         
         # Get historical data
-        data = pd.DataFrame()
         error_message = None
-        
-        # Try different symbol formats
-        symbol_variations = [symbol]
-        
-        # For non-suffixed symbols, try with common suffixes
-        if not any(symbol.endswith(suffix) for suffix in ['.NS', '.BO', '.BSE', '.N', '.O']):
-            symbol_variations.extend([f"{symbol}.NS", f"{symbol}.BO"])
-        
-        # For suffixed symbols, also try the base symbol
-        elif any(symbol.endswith(suffix) for suffix in ['.NS', '.BO', '.BSE', '.N', '.O']):
-            base_symbol = symbol.split('.')[0]
-            if base_symbol not in symbol_variations:
-                symbol_variations.append(base_symbol)
-        
-        # Try each symbol variation
-        for sym in symbol_variations:
-            try:
-                print(f"Trying symbol: {sym}")
-                ticker = yf.Ticker(sym)
-                temp_data = ticker.history(start=start_date, end=end_date)
-                
-                if not temp_data.empty:
-                    data = temp_data
-                    symbol = sym  # Update to the working symbol
-                    print(f"Successfully fetched data for {symbol}")
-                    break
-            except Exception as e:
-                error_message = str(e)
-                print(f"Error fetching data for {sym}: {e}")
+        try:
+            data = get_history(symbol, start=start_date, end=end_date)
+        except Exception as e:
+            error_message = str(e)
+            print(f"Error fetching data for {symbol}: {e}")
+            data = pd.DataFrame()
         
         if data.empty:
             return {'error': f'No data available for this symbol ({symbol}) and date range. {error_message if error_message else ""}'}
@@ -172,7 +137,6 @@ def backtest_strategy(symbol, strategy_type, parameters, start_date, end_date):
         signals = pd.DataFrame(index=data.index)
         signals['price'] = data['Close']
         signals['signal'] = 0  # 0: no position, 1: long position
-        signals['position'] = 0
         
         # Apply strategy
         if strategy_type == 'sma_crossover':
@@ -259,57 +223,52 @@ def backtest_strategy(symbol, strategy_type, parameters, start_date, end_date):
                 'lower_band': signals['lower_band'].tolist()
             }
         
-        else:
-            return {'error': f'Unknown strategy type: {strategy_type}'}
-        
-        # Calculate positions (entry and exit points)
-        signals['position'] = signals['signal'].diff().fillna(0)
-        
-        # Calculate returns
-        signals['returns'] = data['Close'].pct_change()
-        signals['strategy_returns'] = signals['returns'] * signals['signal'].shift(1)
-        
-        # Calculate cumulative returns
-        signals['cumulative_returns'] = (1 + signals['returns']).cumprod()
-        signals['cumulative_strategy_returns'] = (1 + signals['strategy_returns']).cumprod()
-        
-        # Find trade entry and exit points
-        buy_signals = signals[signals['position'] == 1]
-        sell_signals = signals[signals['position'] == -1]
-        
-        trades = []
-        for i in range(min(len(buy_signals), len(sell_signals))):
-            buy_date = buy_signals.index[i].strftime('%Y-%m-%d')
-            buy_price = buy_signals['price'].iloc[i]
-            
-            sell_date = sell_signals.index[i].strftime('%Y-%m-%d')
-            sell_price = sell_signals['price'].iloc[i]
-            
-            profit = sell_price - buy_price
-            profit_percent = (profit / buy_price) * 100
+        elif strategy_type == 'custom':
+            # Rules are parsed against a whitelist and compiled once per text
+            try:
+                rule = compile_rule(parameters.get('code', ''))
+                fields = {field: data[field.capitalize()].to_numpy(dtype=np.float64) for field in rule.fields}
+                signal, values = rule.evaluate(fields)
+            except RuleError as e:
+                return {'error': f'Invalid custom strategy: {e}'}
+            signals['signal'] = signal
             
-            trades.append({
-                'entry_date': buy_date,
-                'entry_price': float(buy_price),
-                'exit_date': sell_date,
-                'exit_price': float(sell_price),
-                'profit': float(profit),
-                'profit_percent': float(profit_percent)
-            })
+            # Add indicator data for visualization
+            indicator_data = {label: series.tolist() for label, series in values.items()}
         
-        # Calculate performance metrics
-        total_trades = len(trades)
-        winning_trades = sum(1 for trade in trades if trade['profit'] > 0)
-        losing_trades = total_trades - winning_trades
+        else:
+            return {'error': f'Unknown strategy type: {strategy_type}'}
         
-        win_rate = winning_trades / total_trades if total_trades > 0 else 0
+        # Score the signal: trades are runs of a constant non-zero signal
+        price = data['Close'].to_numpy(dtype=np.float64)
+        signal = signals['signal'].to_numpy(dtype=np.int8)
+        scores, ledger, equity = trade_ledger.performance(price, signal, _years(data.index), with_trades=True)
+        metrics = {name: trade_ledger.metric_value(name, values[0]) for name, values in scores.items()}
         
-        total_return = signals['cumulative_strategy_returns'].iloc[-1] - 1 if not signals['cumulative_strategy_returns'].empty else 0
-        buy_hold_return = signals['cumulative_returns'].iloc[-1] - 1 if not signals['cumulative_returns'].empty else 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cumulative_returns = price / price[0]
+        metrics['buy_hold_return'] = float(cumulative_returns[-1] - 1) if np.isfinite(cumulative_returns[-1]) else 0.0
         
-        # Calculate drawdown
-        drawdown = 1 - signals['cumulative_strategy_returns'] / signals['cumulative_strategy_returns'].cummax()
-        max_drawdown = drawdown.max()
+        # Trade records are assembled column-wise from the ledger arrays
+        dates = data.index.strftime('%Y-%m-%d')
+        entry_price = price[ledger['entry']]
+        exit_price = price[ledger['exit']]
+        columns = {
+            'direction': np.where(ledger['direction'] > 0, 'long', 'short').tolist(),
+            'entry_date': dates[ledger['entry']].tolist(),
+            'entry_price': entry_price.tolist(),
+            'exit_date': dates[ledger['exit']].tolist(),
+            'exit_price': exit_price.tolist(),
+            'profit': ((exit_price - entry_price) * ledger['direction']).tolist(),
+            'profit_percent': (ledger['return'] * 100).tolist(),
+            'holding_period': ledger['bars'].tolist(),
+            'mae_percent': (ledger['mae'] * 100).tolist(),
+            'mfe_percent': (ledger['mfe'] * 100).tolist()
+        }
+        records = [dict(zip(columns, values)) for values in zip(*columns.values())]
+        is_open = ledger['open'].tolist()
+        trades = [trade for trade, held in zip(records, is_open) if not held]
+        open_trade = next((trade for trade, held in zip(records, is_open) if held), None)
         
         # Prepare result
         result = {
@@ -319,21 +278,14 @@ def backtest_strategy(symbol, strategy_type, parameters, start_date, end_date):
             'start_date': start_date,
             'end_date': end_date,
             'trades': trades,
-            'metrics': {
-                'total_trades': total_trades,
-                'winning_trades': winning_trades,
-                'losing_trades': losing_trades,
-                'win_rate': float(win_rate),
-                'total_return': float(total_return),
-                'buy_hold_return': float(buy_hold_return),
-                'max_drawdown': float(max_drawdown)
-            },
+            'open_trade': open_trade,
+            'metrics': metrics,
             'chart_data': {
-                'dates': [date.strftime('%Y-%m-%d') for date in signals.index],
-                'prices': [float(x) if not np.isnan(x) else None for x in signals['price'].tolist()],
-                'cumulative_returns': [float(x) if not np.isnan(x) else None for x in signals['cumulative_returns'].tolist()],
-                'cumulative_strategy_returns': [float(x) if not np.isnan(x) else None for x in signals['cumulative_strategy_returns'].tolist()],
-                'indicators': _sanitize_json_data(indicator_data)
+                'dates': dates.tolist(),
+                'prices': _json_values(price),
+                'cumulative_returns': _json_values(cumulative_returns),
+                'cumulative_strategy_returns': _json_values(equity[0]),
+                'indicators': {name: _json_values(values) for name, values in indicator_data.items()}
             }
         }
         
@@ -342,3 +294,67 @@ def backtest_strategy(symbol, strategy_type, parameters, start_date, end_date):
     except Exception as e:
         print(f"Error backtesting strategy for {symbol}: {e}")
         return {'error': str(e)}
+
+def sweep_strategy(symbol, strategy_type, ranges, start_date, end_date, sort_by='total_return', top=5):
+    """
+    Backtest every combination of parameter ranges for a predefined strategy
+
+    Prices are fetched once and all settings are evaluated together by the
+    vectorized backtest engine.
+
+    Args:
+        symbol: Stock ticker symbol
+        strategy_type: Type of strategy to sweep
+        ranges: Dictionary mapping parameter names to a value, a list of
+            values, or {'min', 'max', 'step'}; omitted parameters use defaults
+        start_date: Start date for backtesting
+        end_date: End date for backtesting
+        sort_by: Metric used to rank the best settings
+        top: Number of best settings to return
+
+    Returns:
+        Dictionary with the swept values, a metrics grid per metric (nested
+        lists in parameter order) and the best settings
+    """
+    try:
+        if not symbol or len(symbol.strip()) == 0:
+            return {'error': 'Invalid stock symbol'}
+        strategy = next((s for s in get_predefined_strategies() if s['id'] == strategy_type), None)
+        if strategy is None:
+            return {'error': f'Unknown strategy type: {strategy_type}'}
+        if strategy_type not in backtest_engine.BUILDERS:
+            return {'error': f'Strategy {strategy_type} cannot be swept'}
+        if sort_by not in backtest_engine.METRICS:
+            return {'error': f'Unknown metric: {sort_by}'}
+
+        symbol = canonical_symbol(symbol)
+        data = get_history(symbol, start=start_date, end=end_date)
+        if data.empty:
+            return {'error': f'No data available for this symbol ({symbol}) and date range.'}
+
+        close = _close(data)
+        # Custom rules may read any price field
+        fields = {field: data[field.capitalize()].to_numpy(dtype=np.float64) for field in FIELDS if field != 'close'}
+        try:
+            grid, metrics = backtest_engine.sweep(strategy_type, close, strategy['parameters'], ranges or {},
+                                                  _years(data.index), fields)
+        except ValueError as e:
+            return {'error': str(e)}
+
+        buy_hold_return = close[-1] / close[0] - 1 if len(close) > 1 else 0.0
+        return {
+            'symbol': symbol,
+            'strategy': strategy_type,
+            'start_date': start_date,
+            'end_date': end_date,
+            'bars': len(close),
+            'combinations': int(metrics['total_return'].size),
+            'parameters': grid,
+            'metrics': {name: _json_values(values) for name, values in metrics.items()},
+            'buy_hold_return': float(buy_hold_return),
+            'best': backtest_engine.best_settings(grid, metrics, sort_by, top),
+        }
+
+    except Exception as e:
+        print(f"Error sweeping strategy for {symbol}: {e}")
+        return {'error': str(e)}
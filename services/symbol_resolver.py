@@ -0,0 +1,198 @@
+"""
+Symbol resolver.
+
+Maps user input such as ``reliance`` or ``TCS.BO`` to the symbol that is
+actually listed upstream (``RELIANCE.NS``). All exchange-suffix candidates
+for a batch of inputs are probed with one bulk download, the first candidate
+(in priority order) with recent bars wins, and successful resolutions are
+persisted to disk so probing happens once per input. Inputs that match
+nothing are remembered in the shared cache for a while so repeated typos do
+not hit upstream either.
+"""
+import os
+import json
+import threading
+
+import numpy as np
+
+from services import DATA_DIR
+from services.cache import cache
+from services.market_data import get_provider
+from services.singleflight import get_group
+
+RESOLVER_PATH = os.environ.get('SYMBOL_RESOLVER_PATH', os.path.join(DATA_DIR, 'symbols.json'))
+
+# Unresolvable inputs are not probed again for this long
+NEGATIVE_TTL_SECONDS = int(os.environ.get('SYMBOL_NEGATIVE_TTL_SECONDS', 6 * 3600))
+
+# Suffixes tried, in order, for inputs without an exchange suffix
+EXCHANGE_SUFFIXES = ['.NS', '.BO']
+
+# Suffixes recognised as already naming an exchange
+KNOWN_SUFFIXES = ('.NS', '.BO', '.BSE', '.N', '.O')
+
+_NAMESPACE = 'unresolved'
+cache.configure(_NAMESPACE, NEGATIVE_TTL_SECONDS)
+
+_resolved = {}
+_loaded = False
+_lock = threading.Lock()
+_write_lock = threading.Lock()
+_flight = get_group('symbol_resolver')
+
+
+def normalize(symbol):
+    """Canonical form of user input used as the resolution key"""
+    return (symbol or '').strip().upper()
+
+
+def candidates(symbol):
+    """
+    Listed symbols that user input may refer to, most likely first
+
+    Args:
+        symbol: Normalized user input
+
+    Returns:
+        List of candidate symbols
+    """
+    if not symbol:
+        return []
+    # Indices, currencies and futures are never exchange-suffixed
+    if symbol.startswith('^') or '=' in symbol:
+        return [symbol]
+    if symbol.endswith(KNOWN_SUFFIXES):
+        base = symbol.rsplit('.', 1)[0]
+        return [symbol, base]
+    return [symbol] + [f"{symbol}{suffix}" for suffix in EXCHANGE_SUFFIXES]
+
+
+def _read_file():
+    try:
+        with open(RESOLVER_PATH) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"Error reading symbol resolutions: {e}")
+        return {}
+
+
+def _ensure_loaded():
+    global _loaded
+    if _loaded:
+        return
+    resolutions = _read_file()
+    with _lock:
+        if not _loaded:
+            for key, symbol in resolutions.items():
+                _resolved.setdefault(key, symbol)
+            _loaded = True
+
+
+def _save(resolutions):
+    """Merge new resolutions into the file shared by all processes"""
+    try:
+        with _write_lock:
+            merged = _read_file()
+            merged.update(resolutions)
+            os.makedirs(os.path.dirname(os.path.abspath(RESOLVER_PATH)), exist_ok=True)
+            tmp_path = f"{RESOLVER_PATH}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(merged, f, indent=0, sort_keys=True)
+            os.replace(tmp_path, RESOLVER_PATH)
+    except OSError as e:
+        print(f"Error writing symbol resolutions: {e}")
+
+
+def _probe(keys):
+    """
+    Resolve several normalized inputs with one bulk download of all their candidates
+
+    Returns:
+        Dictionary mapping each input to its listed symbol, or None
+    """
+    options = {key: candidates(key) for key in keys}
+    probe_symbols = list(dict.fromkeys(symbol for symbols in options.values() for symbol in symbols))
+    if not probe_symbols:
+        return {key: None for key in keys}
+
+    frame = get_provider().download(probe_symbols, period='5d')
+    if frame is None or frame.empty:
+        listed = set()
+    else:
+        close = frame['Close'].reindex(columns=probe_symbols).to_numpy(dtype=np.float64)
+        has_bars = ~np.isnan(close).all(axis=0)
+        listed = {symbol for symbol, ok in zip(probe_symbols, has_bars) if ok}
+
+    resolved = {key: next((symbol for symbol in symbols if symbol in listed), None) for key, symbols in options.items()}
+
+    found = {key: symbol for key, symbol in resolved.items() if symbol}
+    if found:
+        with _lock:
+            _resolved.update(found)
+        _save(found)
+    for key, symbol in resolved.items():
+        if symbol is None:
+            cache.set(_NAMESPACE, key, True)
+    return resolved
+
+
+def resolve_many(symbols):
+    """
+    Resolve a batch of user inputs to listed symbols
+
+    Known inputs are answered from the persisted table; the rest are probed
+    together in a single bulk download.
+
+    Args:
+        symbols: List of user-entered symbols
+
+    Returns:
+        Dictionary mapping each input (as given) to its listed symbol, or None
+        if no candidate has data
+    """
+    _ensure_loaded()
+    keys = {symbol: normalize(symbol) for symbol in symbols}
+    resolved = {}
+    pending = []
+    with _lock:
+        for key in dict.fromkeys(keys.values()):
+            if key in _resolved:
+                resolved[key] = _resolved[key]
+            elif not key:
+                resolved[key] = None
+            else:
+                pending.append(key)
+
+    unknown = []
+    for key in pending:
+        if cache.get(_NAMESPACE, key):
+            resolved[key] = None
+        else:
+            unknown.append(key)
+
+    if unknown:
+        try:
+            resolved.update(_flight.do(','.join(sorted(unknown)), _probe, unknown))
+        except Exception as e:
+            # Upstream failures are not cached as negative results
+            print(f"Error resolving symbols {unknown}: {e}")
+            resolved.update({key: None for key in unknown})
+
+    return {symbol: resolved[key] for symbol, key in keys.items()}
+
+
+def resolve_symbol(symbol):
+    """
+    Resolve one user input to its listed symbol
+
+    Returns:
+        The listed symbol, or None if no candidate has data
+    """
+    return resolve_many([symbol])[symbol]
+
+
+def canonical_symbol(symbol):
+    """Listed symbol for user input, falling back to the normalized input when unresolved"""
+    return resolve_symbol(symbol) or normalize(symbol)
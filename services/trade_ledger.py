@@ -0,0 +1,403 @@
+"""
+Trade extraction and performance metrics.
+
+Works on signal matrices with one row per setting (or symbol) and one column
+per bar, so the single backtest, parameter sweeps and batch runs share the
+same rules. Trades are the runs of a constant non-zero signal, found by
+run-length encoding every row at once: a trade is entered at the close of
+the first bar of its run and exited at the close of the bar where the signal
+changes (a flip from long to short closes one trade and opens the next).
+Trade returns and excursions are read off the strategy equity curve, so they
+agree with the reported total return. Nothing loops per bar or per trade in
+Python.
+"""
+from datetime import date, datetime
+
+import numpy as np
+
+# Bars per year used to annualize daily-bar metrics
+PERIODS_PER_YEAR = 252
+
+METRICS = (
+    'total_return', 'cagr', 'max_drawdown', 'sharpe_ratio', 'sortino_ratio', 'exposure',
+    'total_trades', 'winning_trades', 'losing_trades', 'win_rate',
+    'avg_trade_return', 'avg_holding_period', 'avg_mae', 'avg_mfe',
+)
+
+
+def _as_rows(signals):
+    signals = np.asarray(signals)
+    return signals.reshape(1, -1) if signals.ndim == 1 else signals
+
+
+def strategy_returns(close, signals):
+    """
+    Per-bar strategy returns: today's return earned by yesterday's signal
+
+    Args:
+        close: 1-D close price array (n bars)
+        signals: (rows x n) signal matrix (1 long, -1 short, 0 flat)
+
+    Returns:
+        (rows x n-1) float array
+    """
+    close = np.asarray(close, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = np.nan_to_num(close[1:] / close[:-1] - 1.0, nan=0.0, posinf=0.0, neginf=0.0)
+    return returns * _as_rows(signals)[:, :-1]
+
+
+def equity_curve(step):
+    """Equity per bar starting at 1 from (rows x n-1) strategy returns"""
+    equity = np.ones((step.shape[0], step.shape[1] + 1))
+    growth = equity[:, 1:]
+    np.add(step, 1.0, out=growth)
+    np.cumprod(growth, axis=1, out=growth)
+    return equity
+
+
+def extract_trades(signals, equity):
+    """
+    Run-length encode signal rows into trades
+
+    Args:
+        signals: (rows x n) signal matrix
+        equity: (rows x n) strategy equity from ``equity_curve``
+
+    Returns:
+        Dictionary of per-trade arrays, ordered by row then time: row,
+        entry and exit bar, direction (1 long, -1 short), open (still held
+        at the last bar; exit is then the last bar), bars held, return, and
+        mae / mfe (worst and best equity excursion while held, as returns)
+    """
+    signals = _as_rows(signals)
+    rows, n = signals.shape
+    # A run starts at bar 0 of every row and wherever the signal changes
+    starts = np.ones((rows, n), dtype=bool)
+    starts[:, 1:] = signals[:, 1:] != signals[:, :-1]
+    first = np.flatnonzero(starts)
+    # Every row's first run starts a new flat index, so run ends never cross rows
+    end = np.append(first[1:], rows * n)
+    direction = signals.ravel()[first]
+    held = direction != 0
+    first, end, direction = first[held], end[held], direction[held]
+
+    row = first // n
+    entry = first - row * n
+    is_open = end - row * n >= n
+    exit_bar = np.where(is_open, n - 1, end - row * n)
+
+    flat_equity = equity.ravel()
+    entry_equity = flat_equity[first]
+    trade_return = flat_equity[row * n + exit_bar] / entry_equity - 1.0
+
+    # Best and worst equity over (entry, exit] via one reduceat per extreme.
+    # Only a trade opened on a row's last bar has no bars held; without it
+    # every bound is in range except possibly the last, whose segment runs to
+    # the end of the array anyway
+    has_bars = exit_bar > entry
+    low = first[has_bars] + 1
+    high = (row * n + exit_bar)[has_bars] + 1
+    bounds = np.empty(2 * len(low), dtype=np.int64)
+    bounds[0::2] = low
+    bounds[1::2] = high
+    if len(bounds) and bounds[-1] >= rows * n:
+        bounds = bounds[:-1]
+    mae = np.zeros(len(first))
+    mfe = np.zeros(len(first))
+    if len(bounds):
+        trough = np.minimum.reduceat(flat_equity, bounds)[0::2]
+        peak = np.maximum.reduceat(flat_equity, bounds)[0::2]
+        mae[has_bars] = np.minimum(trough / entry_equity[has_bars] - 1.0, 0.0)
+        mfe[has_bars] = np.maximum(peak / entry_equity[has_bars] - 1.0, 0.0)
+
+    return {
+        'row': row,
+        'entry': entry,
+        'exit': exit_bar,
+        'direction': direction.astype(np.int8),
+        'open': is_open,
+        'bars': exit_bar - entry,
+        'return': trade_return,
+        'mae': mae,
+        'mfe': mfe,
+    }
+
+
+def _per_row(rows, index, values=None):
+    return np.bincount(index, weights=values, minlength=rows)
+
+
+def _calendar_date(value):
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    return value.date() if isinstance(value, datetime) else value
+
+
+def span_years(first, last):
+    """
+    Calendar span between two dates in years, for annualizing returns
+
+    Timestamps are compared by their (exchange-local) calendar dates, so a
+    DST change in between does not shorten the span by a day. Dates and
+    'YYYY-MM-DD' strings are accepted too.
+    """
+    return (_calendar_date(last) - _calendar_date(first)).days / 365.25
+
+
+def performance(close, signals, years=None, periods_per_year=PERIODS_PER_YEAR, with_trades=False):
+    """
+    Performance metrics for every signal row
+
+    Args:
+        close: 1-D close price array
+        signals: 1-D signal array or (rows x bars) signal matrix
+        years: Length of the period in years for CAGR (defaults to the bar
+            count over periods_per_year)
+        periods_per_year: Bars per year for annualizing Sharpe and Sortino
+        with_trades: Also return the trade arrays and equity curves
+
+    Returns:
+        Dictionary of per-row metric arrays (see METRICS); trade-level
+        averages cover closed trades only. With ``with_trades`` a tuple of
+        (metrics, trades, equity).
+    """
+    signals = _as_rows(signals)
+    rows, n = signals.shape
+    if n < 2:
+        metrics = {name: np.zeros(rows) for name in METRICS}
+        if with_trades:
+            return metrics, extract_trades(signals, np.ones((rows, n))), np.ones((rows, n))
+        return metrics
+
+    step = strategy_returns(close, signals)
+    equity = equity_curve(step)
+    trades = extract_trades(signals, equity)
+
+    final = equity[:, -1]
+    ratio = np.maximum.accumulate(equity, axis=1)
+    np.divide(equity, ratio, out=ratio)
+    drawdown = 1.0 - ratio.min(axis=1)
+
+    if years is None:
+        years = (n - 1) / periods_per_year
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cagr = np.where(final > 0, final ** (1.0 / years) - 1.0, -1.0) if years > 0 else np.zeros(rows)
+
+    # Moments from row sums; einsum avoids squared temporaries
+    periods = n - 1
+    total_return = step.sum(axis=1)
+    mean = total_return / periods
+    square_sum = np.einsum('ij,ij->i', step, step)
+    std = np.sqrt(np.maximum(square_sum - total_return * mean, 0.0) / (periods - 1)) if periods > 1 else np.zeros(rows)
+    losses = np.minimum(step, 0.0, out=step)
+    downside = np.sqrt(np.einsum('ij,ij->i', losses, losses) / periods)
+    scale = np.sqrt(periods_per_year)
+    sharpe = np.divide(mean, std, out=np.zeros(rows), where=std > 0) * scale
+    sortino = np.divide(mean, downside, out=np.zeros(rows), where=downside > 0) * scale
+    exposure = np.count_nonzero(signals[:, :-1], axis=1) / (n - 1)
+
+    closed = ~trades['open']
+    row = trades['row'][closed]
+    total = _per_row(rows, row)
+    wins = _per_row(rows, row, trades['return'][closed] > 0)
+
+    def average(values):
+        return np.divide(_per_row(rows, row, values[closed]), total, out=np.zeros(rows), where=total > 0)
+
+    metrics = {
+        'total_return': final - 1.0,
+        'cagr': cagr,
+        'max_drawdown': drawdown,
+        'sharpe_ratio': sharpe,
+        'sortino_ratio': sortino,
+        'exposure': exposure,
+        'total_trades': total,
+        'winning_trades': wins,
+        'losing_trades': total - wins,
+        'win_rate': np.divide(wins, total, out=np.zeros(rows), where=total > 0),
+        'avg_trade_return': average(trades['return']),
+        'avg_holding_period': average(trades['bars'].astype(np.float64)),
+        'avg_mae': average(trades['mae']),
+        'avg_mfe': average(trades['mfe']),
+    }
+    if with_trades:
+        return metrics, trades, equity
+    return metrics
+
+
+def metric_value(name, value):
+    """Plain Python value of one metric for JSON output"""
+    if name in ('total_trades', 'winning_trades', 'losing_trades'):
+        return int(value)
+    value = float(value)
+    return value if np.isfinite(value) else None
+
+
+class RunningLedger:
+    """
+    Streaming form of ``performance`` for one signal series
+
+    Holds the terminal state of a backtest (position, equity, drawdown peak,
+    the running sums behind the ratio metrics and the open trade) so it can be
+    extended one bar at a time and gives the same metrics as scoring the
+    whole history again. Serializes to a plain dictionary.
+    """
+
+    FIELDS = (
+        'bars', 'first_close', 'close', 'signal', 'equity', 'peak', 'max_drawdown',
+        'step_sum', 'step_square_sum', 'loss_square_sum', 'exposed',
+        'trades', 'wins', 'return_sum', 'bars_sum', 'mae_sum', 'mfe_sum',
+        'entry', 'entry_equity', 'trough', 'crest',
+    )
+
+    def __init__(self):
+        self.bars = 0
+        self.first_close = None
+        self.close = None
+        self.signal = 0
+        self.equity = 1.0
+        self.peak = 1.0
+        self.max_drawdown = 0.0
+        self.step_sum = 0.0
+        self.step_square_sum = 0.0
+        self.loss_square_sum = 0.0
+        self.exposed = 0
+        self.trades = 0
+        self.wins = 0
+        self.return_sum = 0.0
+        self.bars_sum = 0
+        self.mae_sum = 0.0
+        self.mfe_sum = 0.0
+        # Open trade: entry bar, equity at entry and the equity extremes since
+        self.entry = None
+        self.entry_equity = None
+        self.trough = None
+        self.crest = None
+
+    def update(self, close, signal):
+        """Apply one bar: its close and the signal decided at that close"""
+        close, signal = float(close), int(signal)
+        if self.bars:
+            try:
+                change = close / self.close - 1.0
+            except ZeroDivisionError:
+                change = 0.0
+            step = change * self.signal if np.isfinite(change) else 0.0
+            self.equity *= 1.0 + step
+            self.step_sum += step
+            self.step_square_sum += step * step
+            self.loss_square_sum += min(step, 0.0) ** 2
+            self.exposed += self.signal != 0
+            self.peak = max(self.peak, self.equity)
+            self.max_drawdown = max(self.max_drawdown, 1.0 - self.equity / self.peak)
+            if self.entry is not None:
+                self.trough = min(self.trough, self.equity)
+                self.crest = max(self.crest, self.equity)
+                if signal != self.signal:
+                    self._close_trade()
+        else:
+            self.first_close = close
+        if signal != 0 and self.entry is None:
+            self.entry, self.entry_equity = self.bars, self.equity
+            self.trough = self.crest = self.equity
+        self.bars += 1
+        self.close, self.signal = close, signal
+
+    def _close_trade(self):
+        trade_return = self.equity / self.entry_equity - 1.0
+        self.trades += 1
+        self.wins += trade_return > 0
+        self.return_sum += trade_return
+        self.bars_sum += self.bars - self.entry
+        self.mae_sum += min(self.trough / self.entry_equity - 1.0, 0.0)
+        self.mfe_sum += max(self.crest / self.entry_equity - 1.0, 0.0)
+        self.entry = self.entry_equity = self.trough = self.crest = None
+
+    @classmethod
+    def from_history(cls, close, signals):
+        """Terminal state after a whole close / signal history, computed vectorized"""
+        ledger = cls()
+        close = np.asarray(close, dtype=np.float64)
+        signals = np.asarray(signals).astype(np.int8).ravel()
+        n = len(close)
+        if n == 0:
+            return ledger
+        ledger.bars = n
+        ledger.first_close, ledger.close, ledger.signal = float(close[0]), float(close[-1]), int(signals[-1])
+        equity = np.ones(1)
+        if n > 1:
+            step = strategy_returns(close, signals)
+            equity = equity_curve(step)[0]
+            step = step[0]
+            ledger.step_sum = float(step.sum())
+            ledger.step_square_sum = float(step @ step)
+            losses = np.minimum(step, 0.0)
+            ledger.loss_square_sum = float(losses @ losses)
+            ledger.exposed = int(np.count_nonzero(signals[:-1]))
+            ledger.max_drawdown = float(1.0 - (equity / np.maximum.accumulate(equity)).min())
+        ledger.equity, ledger.peak = float(equity[-1]), float(equity.max())
+
+        trades = extract_trades(signals, equity.reshape(1, -1))
+        closed = ~trades['open']
+        ledger.trades = int(closed.sum())
+        ledger.wins = int((trades['return'][closed] > 0).sum())
+        ledger.return_sum = float(trades['return'][closed].sum())
+        ledger.bars_sum = int(trades['bars'][closed].sum())
+        ledger.mae_sum = float(trades['mae'][closed].sum())
+        ledger.mfe_sum = float(trades['mfe'][closed].sum())
+        if trades['open'].any():
+            entry = int(trades['entry'][-1])
+            held = equity[entry:]
+            ledger.entry, ledger.entry_equity = entry, float(equity[entry])
+            ledger.trough, ledger.crest = float(held.min()), float(held.max())
+        return ledger
+
+    def metrics(self, years=None, periods_per_year=PERIODS_PER_YEAR):
+        """Metrics matching ``performance`` over every bar applied so far"""
+        if self.bars < 2:
+            return {name: 0 if name in ('total_trades', 'winning_trades', 'losing_trades') else 0.0
+                    for name in METRICS}
+        periods = self.bars - 1
+        if years is None:
+            years = periods / periods_per_year
+        if years > 0:
+            cagr = self.equity ** (1.0 / years) - 1.0 if self.equity > 0 else -1.0
+        else:
+            cagr = 0.0
+        mean = self.step_sum / periods
+        std = np.sqrt(max(self.step_square_sum - self.step_sum * mean, 0.0) / (periods - 1)) if periods > 1 else 0.0
+        downside = np.sqrt(self.loss_square_sum / periods)
+        scale = np.sqrt(periods_per_year)
+        trades = self.trades
+
+        def average(total):
+            return total / trades if trades else 0.0
+
+        values = {
+            'total_return': self.equity - 1.0,
+            'cagr': cagr,
+            'max_drawdown': self.max_drawdown,
+            'sharpe_ratio': mean / std * scale if std > 0 else 0.0,
+            'sortino_ratio': mean / downside * scale if downside > 0 else 0.0,
+            'exposure': self.exposed / periods,
+            'total_trades': trades,
+            'winning_trades': self.wins,
+            'losing_trades': trades - self.wins,
+            'win_rate': average(self.wins),
+            'avg_trade_return': average(self.return_sum),
+            'avg_holding_period': average(self.bars_sum),
+            'avg_mae': average(self.mae_sum),
+            'avg_mfe': average(self.mfe_sum),
+        }
+        return {name: metric_value(name, value) for name, value in values.items()}
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    @classmethod
+    def from_dict(cls, data):
+        ledger = cls()
+        for name in cls.FIELDS:
+            setattr(ledger, name, data[name])
+        return ledger
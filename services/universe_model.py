@@ -0,0 +1,273 @@
+"""
+Cross-sectional direction model trained offline on a whole universe.
+
+A per-symbol model sees about 120 rows of one stock and is fitted while the
+user waits. This module stacks the same eight stored features
+(``services.feature_store``) for every symbol in the local bar store into
+one matrix, trains a single classifier on it and publishes it as a
+versioned artifact:
+
+    python -m services.universe_model                       # every stored symbol
+    python -m services.universe_model AAPL MSFT NVDA --start 2018-01-01
+    python -m services.universe_model --symbols-file nifty50.txt
+
+Artifacts are pickled under ``models/universe/`` and a small manifest names
+the current one. The manifest is swapped in atomically, so running web
+workers pick up a new model on their next prediction. Predictions then only
+compute features and run inference; while no artifact matches the current
+FEATURE_VERSION they fall back to per-symbol fits.
+"""
+import os
+import sys
+import json
+import time
+import pickle
+import argparse
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from services.bar_store import stored_symbols, stored_bars
+from services.feature_store import FEATURES, feature_matrix
+from services.model_registry import MODEL_DIR
+
+UNIVERSE_DIR = os.environ.get('UNIVERSE_MODEL_DIR', os.path.join(MODEL_DIR, 'universe'))
+
+# Manifest naming the published artifact
+MANIFEST = 'current.json'
+
+# Published artifacts kept on disk (the current one included)
+KEEP_ARTIFACTS = 3
+
+# Bars a symbol needs before it contributes rows
+MIN_BARS = 120
+
+# Bars ahead the target looks (as in prediction_service.direction_target)
+TARGET_HORIZON = 7
+
+# Share of the most recent dates held out to measure the model
+VALIDATION_FRACTION = 0.2
+
+_current = None
+_current_stamp = None
+_lock = threading.Lock()
+
+
+def _symbol_rows(symbol, start_ts, min_bars):
+    """Complete feature rows of one symbol with known outcomes, and their timestamps"""
+    from services.prediction_service import direction_target
+
+    features, timestamps, _ = feature_matrix(symbol)
+    if features is None:
+        return None
+    close = np.asarray(stored_bars(symbol)[0][4][:len(timestamps)])
+    keep = timestamps >= start_ts if start_ts is not None else np.ones(len(timestamps), dtype=bool)
+    if keep.sum() < min_bars:
+        return None
+    features = np.asarray(features).T[keep]
+    target = direction_target(close, TARGET_HORIZON)[keep]
+    usable = np.isfinite(features).all(axis=1)
+    usable[-TARGET_HORIZON:] = False  # Their outcome is not known yet
+    return features[usable], target[usable], timestamps[keep][usable]
+
+
+def build_dataset(symbols, start_date=None, min_bars=MIN_BARS):
+    """
+    Stack the model features of many symbols from the local bar store
+
+    Args:
+        symbols: Listed symbols already in the bar store
+        start_date: Optional first date of bars to use
+        min_bars: Bars a symbol needs to be included
+
+    Returns:
+        Tuple of (features, targets, timestamps, symbols used); features is a
+        float32 (rows x features) matrix
+    """
+    start_ts = pd.Timestamp(start_date, tz='UTC').timestamp() if start_date else None
+    blocks, used = [], []
+    for symbol in symbols:
+        try:
+            rows = _symbol_rows(symbol, start_ts, min_bars)
+        except Exception as e:
+            print(f"Error building features for {symbol}: {e}")
+            continue
+        if rows is not None and len(rows[0]):
+            blocks.append(rows)
+            used.append(symbol)
+    if not blocks:
+        return np.empty((0, 0), dtype=np.float32), np.empty(0, dtype=np.int64), np.empty(0), []
+    features, targets, timestamps = (np.concatenate(parts) for parts in zip(*blocks))
+    return features, targets, timestamps, used
+
+
+def _fit(features, targets):
+    from sklearn.ensemble import HistGradientBoostingClassifier
+    # Histogram boosting scales to millions of stacked rows and needs no feature scaling
+    model = HistGradientBoostingClassifier(max_iter=200, learning_rate=0.05, random_state=42)
+    model.fit(features, targets)
+    return model
+
+
+def train(symbols=None, start_date=None, min_bars=MIN_BARS, keep=KEEP_ARTIFACTS):
+    """
+    Train the universe model and publish it as the current artifact
+
+    The most recent VALIDATION_FRACTION of dates is held out to report
+    accuracy; the published model is then refitted on every row.
+
+    Args:
+        symbols: Listed symbols to train on (every stored daily series by default)
+        start_date: Optional first date of bars to use
+        min_bars: Bars a symbol needs to be included
+        keep: Published artifacts to keep on disk
+
+    Returns:
+        Summary dictionary (also stored in the manifest)
+
+    Raises:
+        ValueError: If no symbol has enough stored history
+    """
+    from services.prediction_service import FEATURE_VERSION
+
+    started = time.time()
+    features, targets, timestamps, used = build_dataset(symbols or stored_symbols('1d'), start_date, min_bars)
+    if not used or len(np.unique(targets)) < 2:
+        raise ValueError('Not enough stored history to train on')
+
+    # Hold out the latest dates across the whole universe
+    cutoff = np.quantile(timestamps, 1.0 - VALIDATION_FRACTION)
+    held_out = timestamps > cutoff
+    validation = None
+    if held_out.any() and (~held_out).any():
+        model = _fit(features[~held_out], targets[~held_out])
+        validation = {
+            'rows': int(held_out.sum()),
+            'accuracy': round(float((model.predict(features[held_out]) == targets[held_out]).mean()), 4),
+            'base_rate': round(float(targets[held_out].mean()), 4),
+            'from': pd.Timestamp(cutoff, unit='s').strftime('%Y-%m-%d'),
+        }
+    model = _fit(features, targets)
+
+    summary = {
+        'version': FEATURE_VERSION,
+        'features': list(FEATURES),
+        'trained_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'symbols': len(used),
+        'rows': int(len(targets)),
+        'last_date': pd.Timestamp(timestamps.max(), unit='s').strftime('%Y-%m-%d'),
+        'validation': validation,
+        'seconds': round(time.time() - started, 1),
+    }
+    summary['artifact'] = _publish(dict(summary, model=model), keep)
+    return summary
+
+
+def _write_atomic(path, write, mode):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, mode) as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def _publish(artifact, keep):
+    """Write the artifact, point the manifest at it and drop the oldest artifacts"""
+    os.makedirs(UNIVERSE_DIR, exist_ok=True)
+    name = f"universe-v{artifact['version']}-{datetime.now().strftime('%Y%m%d%H%M%S')}.pkl"
+    _write_atomic(os.path.join(UNIVERSE_DIR, name),
+                  lambda f: pickle.dump(artifact, f, protocol=pickle.HIGHEST_PROTOCOL), 'wb')
+    manifest = {key: value for key, value in artifact.items() if key != 'model'}
+    manifest['artifact'] = name
+    _write_atomic(os.path.join(UNIVERSE_DIR, MANIFEST), lambda f: json.dump(manifest, f, indent=2), 'w')
+
+    artifacts = sorted((entry.stat().st_mtime, entry.name) for entry in os.scandir(UNIVERSE_DIR)
+                       if entry.name.startswith('universe-') and entry.name.endswith('.pkl') and entry.name != name)
+    for _, old in artifacts[:max(len(artifacts) + 1 - keep, 0)]:
+        os.remove(os.path.join(UNIVERSE_DIR, old))
+    return name
+
+
+def current():
+    """
+    The published artifact, reloaded when the manifest changes
+
+    Returns:
+        Artifact dictionary (summary plus 'model'), or None if none is
+        published for the current FEATURE_VERSION
+    """
+    global _current, _current_stamp
+    from services.prediction_service import FEATURE_VERSION
+
+    path = os.path.join(UNIVERSE_DIR, MANIFEST)
+    try:
+        stamp = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _lock:
+        if stamp != _current_stamp:
+            artifact = None
+            try:
+                with open(path) as f:
+                    manifest = json.load(f)
+                if manifest.get('version') == FEATURE_VERSION:
+                    with open(os.path.join(UNIVERSE_DIR, manifest['artifact']), 'rb') as f:
+                        artifact = pickle.load(f)
+            except (OSError, ValueError, KeyError, pickle.UnpicklingError) as e:
+                print(f"Error loading universe model: {e}")
+            _current, _current_stamp = artifact, stamp
+        return _current
+
+
+def predict(features):
+    """
+    Score feature rows with the published universe model
+
+    Args:
+        features: (rows x features) matrix of complete feature rows
+
+    Returns:
+        Tuple of (predicted classes, probabilities of a rise) arrays, or
+        None if no universe model is published
+    """
+    artifact = current()
+    if artifact is None:
+        return None
+    features = np.asarray(features, dtype=np.float32)
+    probabilities = artifact['model'].predict_proba(features)[:, 1]
+    return (probabilities > 0.5).astype(np.int64), probabilities
+
+
+def info():
+    """Summary of the published model for stats, or None"""
+    artifact = current()
+    return None if artifact is None else {key: value for key, value in artifact.items() if key != 'model'}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Train the universe direction model from the local bar store')
+    parser.add_argument('symbols', nargs='*', help='symbols to train on (default: every stored symbol)')
+    parser.add_argument('--symbols-file', help='file with one symbol per line')
+    parser.add_argument('--start', dest='start_date')
+    parser.add_argument('--min-bars', type=int, default=MIN_BARS)
+    parser.add_argument('--keep', type=int, default=KEEP_ARTIFACTS, help='published artifacts to keep')
+    args = parser.parse_args(argv)
+
+    symbols = list(args.symbols)
+    if args.symbols_file:
+        with open(args.symbols_file) as f:
+            symbols.extend(line.split('#')[0].strip() for line in f)
+    symbols = [symbol for symbol in symbols if symbol]
+
+    try:
+        summary = train(symbols or None, args.start_date, args.min_bars, args.keep)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    print(json.dumps(summary))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
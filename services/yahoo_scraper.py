@@ -7,6 +7,8 @@ import pandas as pd
 import time
 from datetime import datetime
 
+from services.market_data import get_provider
+
 def get_yahoo_market_stocks(category='most-active'):
     """
     Get stock data from Yahoo Finance for different categories
@@ -36,6 +38,10 @@ def get_yahoo_market_stocks(category='most-active'):
     if category not in category_urls:
         return {'error': f'Invalid category: {category}'}
     
+    # Offline providers (fixture replay) must never reach out to Yahoo
+    if get_provider().offline:
+        return []
+    
     url = category_urls[category]
     headers = {
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"
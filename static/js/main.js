@@ -322,3 +322,44 @@ function debounce(func, wait = 300) {
         timeout = setTimeout(later, wait);
     };
 }
+
+/**
+ * Run a long request as a background job and wait for its result
+ * @param {Object} payload - Job request, e.g. {type: 'predict', symbol: 'AAPL'}
+ * @param {Function} onProgress - Called with {status, progress, message} updates
+ * @returns {Promise<Object>} The job's result, or {error} if it failed
+ */
+function runJob(payload, onProgress = () => {}) {
+    const finish = record => record.result || { error: record.error || 'Job failed' };
+
+    return fetch('/api/jobs', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(payload)
+    })
+    .then(response => response.json())
+    .then(job => {
+        if (job.error) {
+            return { error: job.error };
+        }
+        return new Promise(resolve => {
+            // Short polls keep web workers free; any worker can answer for the job
+            const poll = () => {
+                fetch(`/api/jobs/${job.job_id}`)
+                    .then(response => response.json())
+                    .then(record => {
+                        if (record.error && !record.status) {
+                            resolve({ error: record.error });
+                        } else if (record.status === 'queued' || record.status === 'running') {
+                            onProgress(record);
+                            setTimeout(poll, 1000);
+                        } else {
+                            resolve(finish(record));
+                        }
+                    })
+                    .catch(() => setTimeout(poll, 2000));
+            };
+            poll();
+        });
+    });
+}